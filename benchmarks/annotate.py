@@ -0,0 +1,89 @@
+from common import ROOT, write_results
+from PIL import Image, ImageDraw, ImageFont
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from models.annotate import FONT_PATH, draw_boxes  # noqa: E402
+
+"""Micro-benchmark of the per-image cost of rendering detection boxes
+
+Compares the shared annotation renderer (models/annotate.py) with the previous
+approach of loading the label font for every box. Example:
+
+    python benchmarks/annotate.py --boxes 1 100 --repeats 20
+"""
+
+
+def legacy_draw(img: Image.Image, boxes: list, labels: list) -> Image.Image:
+    """The previous renderer (the font is loaded once per box)"""
+    draw = ImageDraw.Draw(img)
+    for box, label in zip(boxes, labels):
+        draw.rectangle(box, outline="red", width=2)
+        draw.text(
+            (box[0] + 4, box[1] + 4),
+            label,
+            font=ImageFont.truetype(FONT_PATH, 32),
+            fill=(255, 0, 0, 255),
+        )
+    return img
+
+
+def detections(size: tuple[int, int], count: int) -> tuple[list, list]:
+    """Random boxes (with DETR style labels) within an image"""
+    rng = random.Random(count)
+    boxes, labels = [], []
+
+    for _ in range(count):
+        x, y = rng.uniform(0, size[0] * 0.8), rng.uniform(0, size[1] * 0.8)
+        boxes.append([x, y, x + size[0] * 0.15, y + size[1] * 0.15])
+        labels.append(f"LABEL (score: {rng.random():.3f})")
+
+    return boxes, labels
+
+
+def per_image_ms(fn, img: Image.Image, boxes: list, labels: list, repeats: int):
+    """The time per render. The legacy renderer draws on the image itself, the
+    shared renderer includes the cost of drawing on a copy"""
+    fn(img, boxes, labels)  # warm up (loads the cached font)
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn(img, boxes, labels)
+    return round((time.perf_counter() - started) / repeats * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the box renderer")
+    parser.add_argument("--boxes", nargs="+", type=int, default=[1, 100])
+    parser.add_argument("--size", nargs=2, type=int, default=[1280, 960])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    size = tuple(args.size)
+    img = Image.effect_mandelbrot(size, (-2, -1.2, 1, 1.2), 64).convert("RGB")
+    results = []
+
+    for count in args.boxes:
+        boxes, labels = detections(size, count)
+        results.append(
+            {
+                "boxes": count,
+                "image_size": list(size),
+                "shared_ms": per_image_ms(draw_boxes, img, boxes, labels, args.repeats),
+                "legacy_ms": per_image_ms(
+                    legacy_draw, img, boxes, labels, args.repeats
+                ),
+            }
+        )
+
+    write_results(args.output, {"benchmark": "annotate", "results": results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from PIL import Image
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import requests
+
+"""Shared helpers for the benchmarks (local image server, app process management)"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Randomly initialised stand-ins for the pretrained models (no downloads required)
+STANDINS_DIR = os.path.join(ROOT, "benchmarks", "standins")
+
+
+def free_port() -> int:
+    """Returns a free TCP port on the loopback interface"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def generate_images(
+    directory: str, count: int, size: tuple[int, int] = (640, 480)
+) -> list[str]:
+    """Write a reproducible set of JPEG fixture images
+
+    Args:
+        directory (str): The directory to write the images to
+        count (int): The amount of images
+        size (tuple[int, int], optional): The (width, height) of each image
+
+    Returns:
+        list[str]: The file names of the images
+    """
+    os.makedirs(directory, exist_ok=True)
+    names = []
+
+    for i in range(count):
+        name = f"fixture-{i}-{size[0]}x{size[1]}.jpg"
+        path = os.path.join(directory, name)
+
+        if not os.path.exists(path):
+            Image.effect_mandelbrot(size, (-2 + i * 0.01, -1.2, 1, 1.2), 64).convert(
+                "RGB"
+            ).save(path, quality=90)
+
+        names.append(name)
+
+    return names
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageServer:
+    """Serves a directory of fixture images over HTTP (on a background thread)
+
+    Args:
+        directory (str): The directory to serve
+    """
+
+    def __init__(self, directory: str) -> None:
+        handler = partial(QuietHandler, directory=directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", free_port()), handler)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        """Returns the URL of a served file"""
+        return f"http://127.0.0.1:{self.server.server_port}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_app(port: int, env: dict | None = None) -> subprocess.Popen:
+    """Start the flask app in a subprocess
+
+    Args:
+        port (int): The port to serve on
+        env (dict, optional): Extra environment variables (i.e., INFERENCE_*)
+
+    Returns:
+        subprocess.Popen: The app process
+    """
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "flask",
+            "--app",
+            "src/app.py",
+            "run",
+            "--port",
+            str(port),
+            "--no-reload",
+            "--with-threads",
+        ],
+        cwd=ROOT,
+        env={**os.environ, "INFERENCE_MODEL_DIR": STANDINS_DIR, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(url: str, timeout: float = 120) -> None:
+    """Poll a URL until it responds with 200 OK
+
+    Raises:
+        TimeoutError: The URL did not respond in time
+    """
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.01)
+
+    raise TimeoutError(f"{url} did not respond within {timeout}s")
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Returns the p-th percentile (0-100) of a list of values (nearest rank)"""
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def write_results(path: str | None, results: dict) -> None:
+    """Print the results and write them as JSON (when a path is provided)"""
+    output = json.dumps(results, indent=2)
+    print(output)
+
+    if path:
+        with open(path, "w") as f:
+            f.write(output)
@@ -0,0 +1,144 @@
+from common import ROOT, generate_images, write_results
+from io import BytesIO
+from multiprocessing import get_context
+from PIL import Image
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from fetch import ImageFetcher  # noqa: E402
+
+"""Compares decoding src images at full resolution against the draft decode
+
+The full path decodes every image at its full resolution and converts it to RGB
+(as src images were decoded before), the draft path decodes it at the size a
+model needs (see ImageFetcher.decode). Each path runs in a fresh process (that
+does not import the models), the time per image and the peak memory it added
+(the peak RSS, Linux only) are reported per image size, format and model.
+Example:
+
+    python benchmarks/decode.py --sizes 1920x1080 6000x4000 --formats JPEG PNG
+"""
+
+def full_decode(data: bytes) -> Image.Image:
+    """The previous decode, a full resolution RGB image"""
+    img = Image.open(BytesIO(data))
+    img.load()
+    return img.convert("RGB")
+
+
+def memory(field: str) -> int:
+    """Read a memory figure of the process (in kB) from /proc/self/status"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(path: str, target: tuple[int, int] | None, repeats: int) -> dict:
+    """Decode an image repeatedly (in a fresh process) with either path
+
+    Args:
+        path (str): The encoded image
+        target (tuple[int, int] | None): The size a model needs the image at
+        (None for the full path)
+        repeats (int): The amount of decodes
+
+    Returns:
+        dict: The seconds per decode, the decoded size and the peak memory added
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    fetcher = ImageFetcher(max_pixels=Image.MAX_IMAGE_PIXELS)
+    if target is None:
+        decode = full_decode
+    else:
+        decode = lambda data: fetcher.decode(data, lambda w, h: target)  # noqa: E731
+
+    # Reset the peak RSS (VmHWM) to the current RSS
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+    baseline = memory("VmRSS")
+    started = time.perf_counter()
+    for _ in range(repeats):
+        img = decode(data)
+    seconds = (time.perf_counter() - started) / repeats
+    peak = memory("VmHWM")
+
+    return {
+        "seconds": seconds,
+        "decoded_size": list(img.size),
+        "peak_mb": (peak - baseline) / 1024,
+    }
+
+
+def run(path: str, target: tuple[int, int] | None, repeats: int) -> dict:
+    """Measure a decode path in a fresh (spawned) process, see measure()"""
+    with get_context("spawn").Pool(1) as pool:
+        return pool.apply(measure, (path, target, repeats))
+
+
+def write_image(directory: str, size: tuple[int, int], format: str) -> str:
+    """Write a test image of a size and format, returns its path"""
+    (name,) = generate_images(directory, 1, size)
+    path = os.path.join(directory, f"{size[0]}x{size[1]}.{format.lower()}")
+    Image.open(os.path.join(directory, name)).save(path, format)
+    return path
+
+
+def main():
+    from models.pretrained.alexnet import Alexnet
+    from models.pretrained.resnet import Resnet
+
+    # The models whose input size the draft path decodes at
+    models = {"AlexNet": Alexnet(), "ResNet": Resnet()}
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark full resolution against draft image decoding"
+    )
+    parser.add_argument("--sizes", nargs="+", default=["1920x1080", "6000x4000"])
+    parser.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    parser.add_argument("--models", nargs="+", default=list(models))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            width, height = (int(i) for i in size.split("x"))
+
+            for format in args.formats:
+                path = write_image(directory, (width, height), format)
+
+                full = run(path, None, args.repeats)
+                for model in args.models:
+                    target = models[model].input_size(width, height)
+                    draft = run(path, target, args.repeats)
+                    results.append(
+                        {
+                            "size": size,
+                            "format": format,
+                            "model": model,
+                            "decoded_size": draft["decoded_size"],
+                            "full_ms_per_image": round(full["seconds"] * 1000, 2),
+                            "draft_ms_per_image": round(draft["seconds"] * 1000, 2),
+                            "speedup": round(full["seconds"] / draft["seconds"], 2),
+                            "full_peak_mb": round(full["peak_mb"], 1),
+                            "draft_peak_mb": round(draft["peak_mb"], 1),
+                        }
+                    )
+
+    write_results(args.output, {"benchmark": "decode", "results": results})
+
+
+if __name__ == "__main__":
+    main()
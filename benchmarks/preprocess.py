@@ -0,0 +1,125 @@
+from common import ROOT, write_results
+from PIL import Image
+import argparse
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from models.preprocess import IMAGENET_MEAN, IMAGENET_STD, Preprocessor  # noqa: E402
+from models.pretrained.alexnet import Alexnet  # noqa: E402
+from models.pretrained.resnet import Resnet  # noqa: E402
+from models.pretrained.vit import Vit  # noqa: E402
+
+"""Compares the shared tensor preprocessing against the per-model processors
+
+Reports the time per image of each path and the largest absolute difference
+between their outputs, and fails when the difference exceeds --max-steps uint8
+steps (one step is 1/255 of the pixel range, divided by the normalisation std).
+Example:
+
+    python benchmarks/preprocess.py --batch-sizes 1 8 32 --output preprocess.json
+"""
+
+
+def reference_processors() -> dict:
+    """The per-model (PIL based) processors the models used previously"""
+    from torchvision import transforms
+    from transformers import DetrImageProcessor, ViTImageProcessor
+
+    alexnet = transforms.Compose(
+        [
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+        ]
+    )
+    vit = ViTImageProcessor()
+    detr = DetrImageProcessor()
+
+    return {
+        "AlexNet": lambda imgs: torch.stack([alexnet(img) for img in imgs]),
+        "Vit": lambda imgs: vit(imgs, return_tensors="pt")["pixel_values"],
+        "ResNet": lambda imgs: detr(images=imgs, return_tensors="pt")["pixel_values"],
+    }
+
+
+def images(count: int) -> list:
+    """Mixed size RGB test images"""
+    sizes = [(640, 480), (1024, 768), (480, 640), (1920, 1080)]
+    return [
+        Image.effect_mandelbrot(sizes[i % len(sizes)], (-2, -1.2, 1, 1.2), 64)
+        .convert("RGB")
+        .rotate(i)
+        for i in range(count)
+    ]
+
+
+def timed(fn, imgs, repeats: int) -> tuple[float, torch.Tensor]:
+    """Returns the mean seconds per image and a copy of the last output (the
+    Preprocessor returns views of a buffer that its next call overwrites)"""
+    output = fn(imgs)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        output = fn(imgs)
+    seconds = (time.perf_counter() - started) / repeats / len(imgs)
+
+    if isinstance(output, tuple):
+        return seconds, tuple(x if x is None else x.clone() for x in output)
+    return seconds, output.clone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--max-steps",
+        type=float,
+        default=1,
+        help="The largest difference allowed, in uint8 steps of the input",
+    )
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    references = reference_processors()
+    results = []
+
+    for model in (Alexnet, Vit, Resnet):
+        alias = model().alias()
+        preprocessor = Preprocessor(model.input_spec)
+        # Float rounding aside, outputs may differ by whole uint8 steps
+        atol = args.max_steps / 255 / min(model.input_spec.std) + 1e-5
+
+        for batch_size in args.batch_sizes:
+            imgs = images(batch_size)
+
+            reference, expected = timed(references[alias], imgs, args.repeats)
+            tensor, (actual, _) = timed(preprocessor, imgs, args.repeats)
+            difference = (expected - actual).abs().max().item()
+
+            results.append(
+                {
+                    "model": alias,
+                    "batch_size": batch_size,
+                    "reference_ms_per_image": round(reference * 1000, 3),
+                    "tensor_ms_per_image": round(tensor * 1000, 3),
+                    "speedup": round(reference / tensor, 2),
+                    "max_abs_diff": round(difference, 4),
+                    "atol": round(atol, 4),
+                    "within_atol": difference <= atol,
+                }
+            )
+
+    write_results(args.output, {"benchmark": "preprocess", "results": results})
+
+    if not all(result["within_atol"] for result in results):
+        sys.exit(f"The outputs differ by more than {args.max_steps} uint8 steps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+from common import ROOT, STANDINS_DIR, write_results
+from PIL import Image
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import config  # noqa: E402
+from models.optimize import OptimizationProfile  # noqa: E402
+from models.registry import discover  # noqa: E402
+
+"""Benchmarks each CPU optimisation profile against plain eager fp32
+
+For every model and profile, reports the forward pass time per image and the
+accuracy delta against the unoptimised model: the largest absolute logit
+difference and how often the top-1 prediction still agrees. Uses the stand-in
+models unless --model-dir points elsewhere. Example:
+
+    python benchmarks/profiles.py --profiles inference_mode inference_mode,int8
+"""
+
+DEFAULT_PROFILES = [
+    "inference_mode",
+    "inference_mode,channels_last",
+    "inference_mode,int8",
+    "inference_mode,trace",
+    "inference_mode,compile",
+    "inference_mode,bf16",
+]
+
+
+def images(count: int) -> list:
+    return [
+        Image.effect_mandelbrot((640, 480), (-2 + i * 0.05, -1.2, 1, 1.2), 64).convert(
+            "RGB"
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark optimisation profiles")
+    parser.add_argument("--model-dir", default=STANDINS_DIR)
+    parser.add_argument("--models", nargs="+", default=["AlexNet", "Vit"])
+    parser.add_argument("--profiles", nargs="+", default=DEFAULT_PROFILES)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    specs = {spec.alias.lower(): spec for spec in discover(args.model_dir)}
+    results = []
+
+    for alias in args.models:
+        spec = specs[alias.lower()]
+        baseline = None
+
+        for profile in ["no_grad", *args.profiles]:
+            model = spec.create()
+            model.load()
+
+            # Apply the profile the same way the ModelController does
+            config.PROFILE = "" if profile == "no_grad" else profile
+            model.optimize()
+
+            batch = model.preprocessor(images(args.batch_size))
+            batch = (batch[0].clone(), batch[1])
+
+            output = model.forward(batch[0])["logits"]  # warm up (trace/compile)
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                output = model.forward(batch[0])["logits"].clone()
+            seconds = (time.perf_counter() - started) / args.repeats
+
+            if baseline is None:
+                baseline = output
+
+            results.append(
+                {
+                    "model": spec.alias,
+                    "profile": profile,
+                    "applied": str(model.profile),
+                    "bf16_supported": OptimizationProfile("bf16").bf16,
+                    "ms_per_image": round(seconds / args.batch_size * 1000, 3),
+                    "max_abs_logit_delta": round(
+                        (output - baseline).abs().max().item(), 5
+                    ),
+                    "top1_agreement": (output.argmax(1) == baseline.argmax(1))
+                    .float()
+                    .mean()
+                    .item(),
+                }
+            )
+
+    write_results(args.output, {"benchmark": "profiles", "results": results})
+
+
+if __name__ == "__main__":
+    main()
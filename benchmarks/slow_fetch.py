@@ -0,0 +1,190 @@
+from common import (
+    ROOT,
+    STANDINS_DIR,
+    QuietHandler,
+    free_port,
+    generate_images,
+    percentile,
+    start_app,
+    wait_until_ready,
+    write_results,
+)
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer
+from threading import Event, Thread
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+
+"""Compares the WSGI and the async (ASGI) server with many slow src downloads
+
+Every src is served after a delay, so a request spends most of its time waiting
+on the network. The WSGI server holds a thread per download (and is capped by
+INFERENCE_FETCH_MAX_CONCURRENT), the async server keeps the downloads on its
+event loop. The wall time, latency percentiles and the peak thread count of the
+server are reported per mode and amount of concurrent requests. Requires
+`pip install httpx uvicorn`. Example:
+
+    python benchmarks/slow_fetch.py --requests 100 400 --delay 2
+"""
+
+
+class SlowHandler(QuietHandler):
+    """Serves the fixture images after a delay (in seconds)"""
+
+    delay = 2.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        super().do_GET()
+
+
+class BacklogHTTPServer(ThreadingHTTPServer):
+    # Accept hundreds of simultaneous connections
+    request_queue_size = 1024
+
+
+class SlowImageServer:
+    """Serves a directory of fixture images, each after a delay
+
+    Args:
+        directory (str): The directory to serve
+        delay (float): Seconds to wait before serving an image
+    """
+
+    def __init__(self, directory: str, delay: float) -> None:
+        handler = type("Handler", (SlowHandler,), {"delay": delay})
+        self.server = BacklogHTTPServer(
+            ("127.0.0.1", free_port()), partial(handler, directory=directory)
+        )
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_asgi_app(port: int, env: dict) -> subprocess.Popen:
+    """Start the async server in a subprocess (see common.start_app)"""
+    return subprocess.Popen(
+        [sys.executable, "src/asgi.py", "--port", str(port)],
+        cwd=ROOT,
+        env={**os.environ, "INFERENCE_MODEL_DIR": STANDINS_DIR, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def threads(pid: int) -> int:
+    """Returns the amount of threads of a process (Linux only)"""
+    return len(os.listdir(f"/proc/{pid}/task"))
+
+
+def measure(mode: str, model: str, srcs: list[str], counts: list[int]) -> list[dict]:
+    """Start a server and send each amount of concurrent requests to it"""
+    port = free_port()
+    env = {
+        "INFERENCE_LOAD_MODE": "lazy",
+        "INFERENCE_PRELOAD": model,
+        "INFERENCE_LOAD_IN_BACKGROUND": "0",
+        "INFERENCE_CACHE_MAX_BYTES": "0",
+    }
+    process = (start_asgi_app if mode == "asgi" else start_app)(port, env)
+    results = []
+
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{base}/ping")
+
+        def enrich(i: int) -> tuple[float, bool]:
+            started = time.perf_counter()
+            try:
+                params = {"src": srcs[i % len(srcs)], "model": model, "format": "json"}
+                ok = requests.get(f"{base}/api/enrich", params=params, timeout=300).ok
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        enrich(0)  # Warm up
+
+        for count in counts:
+            peak, stop = threads(process.pid), Event()
+
+            def sample() -> None:
+                nonlocal peak
+                while not stop.wait(0.05):
+                    peak = max(peak, threads(process.pid))
+
+            sampler = Thread(target=sample, daemon=True)
+            sampler.start()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=count) as pool:
+                outcomes = list(pool.map(enrich, range(count)))
+            wall = time.perf_counter() - started
+
+            stop.set()
+            sampler.join()
+
+            latencies = [latency for latency, _ in outcomes]
+            results.append(
+                {
+                    "mode": mode,
+                    "concurrency": count,
+                    "errors": sum(not ok for _, ok in outcomes),
+                    "wall_s": round(wall, 2),
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                    "peak_threads": peak,
+                }
+            )
+    finally:
+        process.terminate()
+        process.wait()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the WSGI and async servers with slow src downloads"
+    )
+    parser.add_argument("--modes", nargs="+", default=["wsgi", "asgi"])
+    parser.add_argument("--model", default="AlexNet")
+    parser.add_argument("--requests", type=int, nargs="+", default=[100, 400])
+    parser.add_argument("--delay", type=float, default=2.0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = generate_images(directory, 8)
+
+        with SlowImageServer(directory, args.delay) as server:
+            # Distinct URLs, so that no download is shared between requests
+            srcs = [f"{server.url(names[i % len(names)])}?{i}" for i in range(1000)]
+            results = [
+                result
+                for mode in args.modes
+                for result in measure(mode, args.model, srcs, args.requests)
+            ]
+
+    write_results(
+        args.output,
+        {"benchmark": "slow_fetch", "delay_s": args.delay, "results": results},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+from models.pretrained.alexnet import Alexnet as PretrainedAlexnet
+from torchvision.models import alexnet
+from models.preprocess import Preprocessor
+import torch
+
+
+class Alexnet(PretrainedAlexnet):
+    """The AlexNet architecture with random weights (nothing is downloaded)"""
+
+    def alias(self) -> str:
+        return "AlexNet"
+
+    def description(self) -> str:
+        return "Randomly initialised AlexNet stand-in (benchmarking only)"
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+
+        self.model = alexnet(weights=None).eval()
+        self.preprocessor = Preprocessor(self.input_spec)
@@ -0,0 +1,65 @@
+from models.pretrained.blip import Blip as PretrainedBlip
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import (
+    BlipConfig,
+    BlipForConditionalGeneration,
+    BlipImageProcessor,
+    PreTrainedTokenizerFast,
+)
+import torch
+
+WORDS = "a an the of on in with and dog cat man woman car tree sky red blue".split()
+
+
+class Blip(PretrainedBlip):
+    """A tiny randomly initialised BLIP with a word level tokenizer built locally
+    (nothing is downloaded)"""
+
+    def alias(self) -> str:
+        return "Blip"
+
+    def description(self) -> str:
+        return "Randomly initialised tiny BLIP stand-in (benchmarking only)"
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+
+        special = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"]
+        vocab = {token: i for i, token in enumerate(special + WORDS)}
+        backend = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+        backend.pre_tokenizer = pre_tokenizers.Whitespace()
+
+        self.tokenizer = PreTrainedTokenizerFast(
+            tokenizer_object=backend,
+            pad_token="[PAD]",
+            unk_token="[UNK]",
+            bos_token="[CLS]",
+            eos_token="[SEP]",
+            sep_token="[SEP]",
+        )
+
+        config = BlipConfig(
+            vision_config={
+                "hidden_size": 32,
+                "intermediate_size": 64,
+                "num_hidden_layers": 1,
+                "num_attention_heads": 2,
+                "image_size": 64,
+                "patch_size": 16,
+            },
+            text_config={
+                "vocab_size": len(vocab),
+                "hidden_size": 32,
+                "intermediate_size": 64,
+                "num_hidden_layers": 1,
+                "num_attention_heads": 2,
+                "encoder_hidden_size": 32,
+                "pad_token_id": vocab["[PAD]"],
+                "bos_token_id": vocab["[CLS]"],
+                "eos_token_id": vocab["[SEP]"],
+                "sep_token_id": vocab["[SEP]"],
+            },
+        )
+
+        self.image_processor = BlipImageProcessor(size={"height": 64, "width": 64})
+        self.model = BlipForConditionalGeneration(config).eval()
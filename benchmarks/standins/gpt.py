@@ -0,0 +1,69 @@
+from models.pretrained.gpt import Gpt as PretrainedGpt
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import (
+    GPT2Config,
+    PreTrainedTokenizerFast,
+    VisionEncoderDecoderConfig,
+    VisionEncoderDecoderModel,
+    ViTConfig,
+    ViTImageProcessor,
+)
+import torch
+
+WORDS = "a an the of on in with and dog cat man woman car tree sky red blue".split()
+
+
+class Gpt(PretrainedGpt):
+    """A tiny randomly initialised ViT-GPT2 with a word level tokenizer built
+    locally (nothing is downloaded)"""
+
+    def alias(self) -> str:
+        return "Gpt"
+
+    def description(self) -> str:
+        return "Randomly initialised tiny ViT-GPT2 stand-in (benchmarking only)"
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+
+        vocab = {token: i for i, token in enumerate(["<|endoftext|>"] + WORDS)}
+        backend = Tokenizer(models.WordLevel(vocab, unk_token="<|endoftext|>"))
+        backend.pre_tokenizer = pre_tokenizers.Whitespace()
+
+        # GPT2 uses a single token to start, end and pad sequences
+        self.tokenizer = PreTrainedTokenizerFast(
+            tokenizer_object=backend,
+            bos_token="<|endoftext|>",
+            eos_token="<|endoftext|>",
+            unk_token="<|endoftext|>",
+        )
+
+        encoder = ViTConfig(
+            hidden_size=32,
+            num_hidden_layers=1,
+            num_attention_heads=2,
+            intermediate_size=64,
+            image_size=64,
+            patch_size=16,
+        )
+        decoder = GPT2Config(
+            vocab_size=len(vocab),
+            n_embd=32,
+            n_layer=1,
+            n_head=2,
+            n_positions=128,
+            add_cross_attention=True,
+            is_decoder=True,
+            bos_token_id=0,
+            eos_token_id=0,
+        )
+        config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(
+            encoder, decoder, decoder_start_token_id=0, pad_token_id=0, eos_token_id=0
+        )
+
+        self.image_processor = ViTImageProcessor(size={"height": 64, "width": 64})
+        self.model = VisionEncoderDecoderModel(config).eval()
+
+        # The random weights tend to end captions straight away, which would make
+        # generation unrealistically cheap, so always decode max_new_tokens
+        self.model.generation_config.suppress_tokens = [0]
@@ -0,0 +1,47 @@
+from models.pretrained.resnet import Resnet as PretrainedResnet
+from models.preprocess import Preprocessor
+from transformers import (
+    DetrConfig,
+    DetrForObjectDetection,
+    DetrImageProcessor,
+    ResNetConfig,
+)
+import torch
+
+
+class Resnet(PretrainedResnet):
+    """A tiny randomly initialised DETR (nothing is downloaded)"""
+
+    def alias(self) -> str:
+        return "ResNet"
+
+    def description(self) -> str:
+        return "Randomly initialised tiny DETR stand-in (benchmarking only)"
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+
+        backbone = ResNetConfig(
+            embedding_size=16,
+            hidden_sizes=[16, 32, 64, 128],
+            depths=[1, 1, 1, 1],
+            out_features=["stage4"],
+        )
+        config = DetrConfig(
+            use_timm_backbone=False,
+            use_pretrained_backbone=False,
+            backbone_config=backbone,
+            d_model=32,
+            encoder_layers=1,
+            decoder_layers=1,
+            encoder_attention_heads=2,
+            decoder_attention_heads=2,
+            encoder_ffn_dim=64,
+            decoder_ffn_dim=64,
+            num_queries=20,
+            num_labels=91,
+        )
+
+        self.preprocessor = Preprocessor(self.input_spec)
+        self.processor = DetrImageProcessor()
+        self.model = DetrForObjectDetection(config).eval()
@@ -0,0 +1,14 @@
+from models.pretrained.tesseract import Tesseract as PretrainedTesseract
+
+
+class Tesseract(PretrainedTesseract):
+    """Tesseract has no weights to randomise, so the stand-in runs the real OCR
+    engine. It needs tesserocr (or the tesseract executable) and the language
+    data, i.e. INFERENCE_OCR_TESSDATA pointing at a directory with eng.traineddata
+    """
+
+    def alias(self) -> str:
+        return "Tesseract"
+
+    def description(self) -> str:
+        return "The Tesseract OCR engine (benchmarking stand-in)"
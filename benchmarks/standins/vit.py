@@ -0,0 +1,32 @@
+from models.pretrained.vit import Vit as PretrainedVit
+from models.labels import imagenet_classes
+from models.preprocess import Preprocessor
+from transformers import ViTConfig, ViTForImageClassification
+import torch
+
+
+class Vit(PretrainedVit):
+    """A tiny randomly initialised ViT (nothing is downloaded)"""
+
+    def alias(self) -> str:
+        return "Vit"
+
+    def description(self) -> str:
+        return "Randomly initialised tiny ViT stand-in (benchmarking only)"
+
+    def load(self) -> None:
+        torch.manual_seed(0)
+
+        config = ViTConfig(
+            hidden_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=2,
+            intermediate_size=128,
+            image_size=224,
+            patch_size=16,
+            num_labels=1000,
+            id2label=dict(enumerate(imagenet_classes())),
+        )
+
+        self.preprocessor = Preprocessor(self.input_spec)
+        self.model = ViTForImageClassification(config).eval()
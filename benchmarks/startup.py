@@ -0,0 +1,91 @@
+from common import (
+    ImageServer,
+    free_port,
+    generate_images,
+    start_app,
+    wait_until_ready,
+    write_results,
+)
+import argparse
+import statistics
+import tempfile
+import time
+import requests
+
+"""Measures server startup: time to the first /ping and to the first inference
+
+The app is started with the randomly initialised stand-in models from
+benchmarks/standins, so nothing is downloaded. Example:
+
+    python benchmarks/startup.py --runs 5 --load-mode lazy --output startup.json
+"""
+
+
+def measure(port: int, env: dict, src: str, model: str) -> dict:
+    """Start the app once and time its first responses (in seconds)"""
+    started = time.perf_counter()
+    process = start_app(port, env)
+
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{base}/ping")
+        ping = time.perf_counter() - started
+
+        res = requests.post(
+            f"{base}/api/enrich",
+            json={"src": [src], "model": model, "format": "json"},
+            timeout=300,
+        )
+        res.raise_for_status()
+        inference = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {"first_ping": ping, "first_inference": inference}
+
+
+def summarise(values: list[float]) -> dict:
+    return {
+        "median": round(statistics.median(values), 4),
+        "min": round(min(values), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure server startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model", default="AlexNet")
+    parser.add_argument("--load-mode", choices=["eager", "lazy"], default="lazy")
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    env = {"INFERENCE_LOAD_MODE": args.load_mode}
+
+    with tempfile.TemporaryDirectory() as directory:
+        name = generate_images(directory, 1)[0]
+
+        with ImageServer(directory) as server:
+            runs = [
+                measure(free_port(), env, server.url(name), args.model)
+                for _ in range(args.runs)
+            ]
+
+    write_results(
+        args.output,
+        {
+            "benchmark": "startup",
+            "model": args.model,
+            "load_mode": args.load_mode,
+            "runs": args.runs,
+            "first_ping_seconds": summarise([run["first_ping"] for run in runs]),
+            "first_inference_seconds": summarise(
+                [run["first_inference"] for run in runs]
+            ),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from common import (
+    ImageServer,
+    free_port,
+    generate_images,
+    percentile,
+    start_app,
+    wait_until_ready,
+    write_results,
+)
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import tempfile
+import time
+import requests
+
+"""Measures the throughput of two models served side by side per thread split
+
+The app is started once per split of the thread budget (see
+src/models/threads.py), i.e. '2:2' runs each model with 2 intra-op threads and
+'0:0' splits the budget evenly. Concurrent clients send single image requests
+to both models at once, the images per second of each model (and in total) and
+the latency percentiles are reported per split. With --pin the model workers
+are pinned to disjoint cores (INFERENCE_CPU_AFFINITY=auto). Example:
+
+    python benchmarks/threads.py --splits 0:0 1:3 2:2 4:4 8:8 --budget 4
+"""
+
+
+def measure(
+    split: str,
+    models: list[str],
+    srcs: list[str],
+    args: argparse.Namespace,
+) -> dict:
+    """Start the app with a thread split and drive both models concurrently"""
+    threads = [int(count) for count in split.split(":")]
+    port = free_port()
+    env = {
+        "INFERENCE_LOAD_MODE": "lazy",
+        "INFERENCE_PRELOAD": ",".join(models),
+        "INFERENCE_LOAD_IN_BACKGROUND": "0",
+        "INFERENCE_CACHE_MAX_BYTES": "0",
+        "INFERENCE_THREAD_BUDGET": str(args.budget),
+        "INFERENCE_CPU_AFFINITY": "auto" if args.pin else "",
+        "INFERENCE_ADMISSION_MAX_QUEUE": str(args.concurrency * 2),
+        **{
+            f"INFERENCE_INTRA_OP_THREADS_{model.upper()}": str(count)
+            for model, count in zip(models, threads)
+        },
+    }
+    process = start_app(port, env)
+
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{base}/ping")
+
+        def enrich(i: int) -> tuple[str, float, bool]:
+            model = models[i % len(models)]
+            params = {"src": [srcs[i % len(srcs)]], "model": model, "format": "json"}
+            started = time.perf_counter()
+            try:
+                ok = requests.post(f"{base}/api/enrich", json=params, timeout=300).ok
+            except requests.RequestException:
+                ok = False
+            return model, time.perf_counter() - started, ok
+
+        # Warm up both models
+        for i in range(len(models) * 2):
+            enrich(i)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(enrich, range(args.requests)))
+        wall = time.perf_counter() - started
+
+        info = requests.get(f"{base}/api/stats", timeout=10).json()["threads"]
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = [latency for _, latency, _ in outcomes]
+    return {
+        "split": split,
+        "threads": info["models"],
+        "errors": sum(not ok for _, _, ok in outcomes),
+        "wall_s": round(wall, 2),
+        "images_per_s": round(len(outcomes) / wall, 1),
+        "per_model_images_per_s": {
+            model: round(sum(name == model for name, _, _ in outcomes) / wall, 1)
+            for model in models
+        },
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of two models per thread budget split"
+    )
+    parser.add_argument("--models", nargs=2, default=["AlexNet", "ResNet"])
+    parser.add_argument(
+        "--splits",
+        nargs="+",
+        default=["0:0", "1:1", "2:2"],
+        help="The intra-op threads of each model as 'a:b' (0 splits the budget)",
+    )
+    parser.add_argument("--budget", type=int, default=0)
+    parser.add_argument("--pin", action="store_true", help="Pin the model workers")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = generate_images(directory, 8)
+
+        with ImageServer(directory) as server:
+            srcs = [server.url(name) for name in names]
+            results = [measure(split, args.models, srcs, args) for split in args.splits]
+
+    write_results(
+        args.output,
+        {
+            "benchmark": "threads",
+            "budget": args.budget,
+            "pinned": args.pin,
+            "results": results,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
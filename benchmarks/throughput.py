@@ -0,0 +1,308 @@
+from common import (
+    ImageServer,
+    free_port,
+    generate_images,
+    percentile,
+    start_app,
+    wait_until_ready,
+    write_results,
+)
+from threading import Lock, local
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import tempfile
+import time
+import requests
+
+"""Measures the throughput and latency of /api/enrich per model and format
+
+Every model runs in a fresh app process (with the randomly initialised
+stand-ins from benchmarks/standins, so nothing is downloaded) that requests a
+set of fixture images from a local HTTP server. GET requests enrich a single
+src, POST requests enrich --batch-sizes src images at once, each at every
+--concurrency level. The result cache is disabled so every request runs the
+model. Reports requests (and images) per second, p50/p95/p99 latency and the
+peak RSS of the app during each run. Example:
+
+    python benchmarks/throughput.py --models AlexNet ResNet --concurrency 1 8 \\
+        --batch-sizes 1 8 --output throughput.json
+
+Passing the output of an earlier run as --baseline reports the change of each
+run, and --max-regression fails when the throughput of a run drops by more than
+that percentage.
+"""
+
+MODELS = ["AlexNet", "Vit", "ResNet", "Blip", "Gpt", "Tesseract"]
+
+# Only the models that draw their results support image responses
+IMAGE_MODELS = {"ResNet", "Tesseract"}
+
+
+def rss(pid: int) -> tuple[float, float]:
+    """Returns the current and peak RSS of a process (in MB, Linux only)"""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                values[line[:5]] = int(line.split()[1]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def reset_peak_rss(pid: int) -> None:
+    """Reset the peak RSS of a process to its current RSS (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass  # The peak then includes the earlier runs
+
+
+def drive(send, count: int, concurrency: int) -> tuple[list[float], int, float]:
+    """Send requests from concurrent clients until 'count' have been sent
+
+    Args:
+        send (Callable[[requests.Session, int], bool]): Sends request i, returns
+        whether it succeeded
+        count (int): The amount of requests
+        concurrency (int): The amount of concurrent clients
+
+    Returns:
+        tuple[list[float], int, float]: The latency of each successful request,
+        the amount of errors and the duration of the run (in seconds)
+    """
+    counter = itertools.count()
+    sessions = local()
+    latencies, errors = [], 0
+    lock = Lock()
+
+    def client() -> None:
+        nonlocal errors
+        sessions.session = requests.Session()
+
+        while (i := next(counter)) < count:
+            started = time.perf_counter()
+            try:
+                ok = send(sessions.session, i)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+
+    return latencies, errors, time.perf_counter() - started
+
+
+def benchmark_model(model: str, srcs: list[str], args) -> list[dict]:
+    """Run every method, format, batch size and concurrency level of a model"""
+    port = free_port()
+    process = start_app(
+        port,
+        {
+            "INFERENCE_LOAD_MODE": "lazy",
+            "INFERENCE_PRELOAD": model,
+            "INFERENCE_CACHE_MAX_BYTES": "0",
+            "INFERENCE_CACHE_MAX_URLS": "0",
+        },
+    )
+    base = f"http://127.0.0.1:{port}"
+    results = []
+
+    try:
+        wait_until_ready(f"{base}/ping")
+
+        formats = [f for f in args.formats if f == "json" or model in IMAGE_MODELS]
+        runs = []
+        for format in formats:
+            if "GET" in args.methods:
+                runs.append(("GET", format, 1))
+            if "POST" in args.methods:
+                runs.extend(("POST", format, size) for size in args.batch_sizes)
+
+        for method, format, batch_size in runs:
+
+            def send(session: requests.Session, i: int) -> bool:
+                if method == "GET":
+                    res = session.get(
+                        f"{base}/api/enrich",
+                        params={
+                            "src": srcs[i % len(srcs)],
+                            "model": model,
+                            # GET responds with json through the 'text' format
+                            "format": "text" if format == "json" else format,
+                        },
+                        timeout=args.timeout,
+                    )
+                else:
+                    res = session.post(
+                        f"{base}/api/enrich",
+                        json={
+                            "src": [
+                                srcs[(i * batch_size + j) % len(srcs)]
+                                for j in range(batch_size)
+                            ],
+                            "model": model,
+                            "format": format,
+                        },
+                        timeout=args.timeout,
+                    )
+                return res.status_code == 200 and "error" not in res.text[:64]
+
+            # Warm up (loads the model and fills the connection pools)
+            drive(send, args.warmup, 1)
+
+            for concurrency in args.concurrency:
+                reset_peak_rss(process.pid)
+                latencies, errors, duration = drive(send, args.requests, concurrency)
+                _, peak = rss(process.pid)
+
+                ms = [latency * 1000 for latency in latencies]
+                results.append(
+                    {
+                        "model": model,
+                        "method": method,
+                        "format": format,
+                        "batch_size": batch_size,
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "errors": errors,
+                        "requests_per_second": round(len(latencies) / duration, 2),
+                        "images_per_second": round(
+                            len(latencies) * batch_size / duration, 2
+                        ),
+                        "latency_ms": {
+                            "mean": round(statistics.mean(ms), 2) if ms else 0,
+                            "p50": round(percentile(ms, 50), 2),
+                            "p95": round(percentile(ms, 95), 2),
+                            "p99": round(percentile(ms, 99), 2),
+                        },
+                        "peak_rss_mb": round(peak, 1),
+                    }
+                )
+                print(
+                    f"{model} {method} {format} batch={batch_size} "
+                    f"concurrency={concurrency}: "
+                    f"{results[-1]['requests_per_second']} req/s",
+                    flush=True,
+                )
+    finally:
+        process.terminate()
+        process.wait()
+
+    return results
+
+
+def run_key(result: dict) -> tuple:
+    return tuple(
+        result[key]
+        for key in ("model", "method", "format", "batch_size", "concurrency")
+    )
+
+
+def compare(results: list[dict], baseline: list[dict]) -> float:
+    """Add the change (in %) of the throughput and p95 latency of each run
+    compared to a baseline run with the same parameters
+
+    Returns:
+        float: The largest throughput regression (in %)
+    """
+    previous = {run_key(result): result for result in baseline}
+    regression = 0.0
+
+    for result in results:
+        before = previous.get(run_key(result))
+        if before is None or not before["requests_per_second"]:
+            continue
+
+        throughput = (
+            result["requests_per_second"] / before["requests_per_second"] - 1
+        ) * 100
+        p95 = before["latency_ms"]["p95"]
+        result["change_percent"] = {
+            "requests_per_second": round(throughput, 1),
+            "p95": round((result["latency_ms"]["p95"] / p95 - 1) * 100, 1)
+            if p95
+            else None,
+        }
+        regression = max(regression, -throughput)
+
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /api/enrich throughput")
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument(
+        "--methods", nargs="+", choices=["GET", "POST"], default=["GET", "POST"]
+    )
+    parser.add_argument(
+        "--formats", nargs="+", choices=["json", "image"], default=["json", "image"]
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[8],
+        help="The amount of src images per POST request",
+    )
+    parser.add_argument("--requests", type=int, default=64, help="Requests per run")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--images", type=int, default=16, help="Fixture images")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[640, 480])
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    parser.add_argument("--baseline", help="The results of an earlier run")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="Exit with an error when a run is this much slower (in %%) than the "
+        "baseline",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = generate_images(directory, args.images, tuple(args.image_size))
+
+        with ImageServer(directory) as server:
+            srcs = [server.url(name) for name in names]
+            results = [
+                result
+                for model in args.models
+                for result in benchmark_model(model, srcs, args)
+            ]
+
+    regression = 0.0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regression = compare(results, json.load(f)["results"])
+
+    write_results(
+        args.output,
+        {
+            "benchmark": "throughput",
+            "images": args.images,
+            "image_size": args.image_size,
+            "requests_per_run": args.requests,
+            "results": results,
+        },
+    )
+
+    if args.max_regression is not None and regression > args.max_regression:
+        sys.exit(f"A run was {regression:.1f}% slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+from contextvars import ContextVar
+from threading import Condition, Lock
+import math
+import time
+import config
+import metrics
+
+"""Admission control: per-model concurrency limits, bounded wait queues and
+request deadlines
+
+Every request using a model has to enter the gate of the model first. A gate
+lets INFERENCE_ADMISSION_MAX_CONCURRENT requests through at once and queues up
+to INFERENCE_ADMISSION_MAX_QUEUE more. Once the queue is full, requests are
+rejected straight away (a 429 with a Retry-After estimated from how long
+requests hold the gate) instead of piling up threads.
+
+Every request has a deadline: INFERENCE_REQUEST_TIMEOUT seconds, or its own
+'timeout' parameter or X-Request-Timeout header. Work whose deadline has passed
+is dropped before it reaches the model: while waiting at the gate, in the
+micro-batching queue (see models/batching.py) and between the images of a
+request. The deadline of the current request is kept in a context variable,
+which is copied into the threads working on the request.
+"""
+
+
+# The header a client sets its own timeout (in seconds) with
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+
+class AdmissionError(Exception):
+    """A request that cannot be served (now)
+
+    Args:
+        message (str): Why the request was not served
+        retry_after (int, optional): Seconds after which a retry may succeed
+    """
+
+    status = 503
+
+    def __init__(self, message: str, retry_after: int | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Overloaded(AdmissionError):
+    """Raised when the wait queue of a model is full"""
+
+    status = 429
+
+
+class DeadlineExceeded(AdmissionError):
+    """Raised when the deadline of a request has passed before its work ran"""
+
+    status = 504
+
+
+# The perf_counter() deadline of the request being handled (None for no deadline)
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+def set_deadline(deadline: float | None) -> None:
+    """Set the deadline of the current request (a perf_counter() value)"""
+    _deadline.set(deadline)
+
+
+def deadline() -> float | None:
+    """The deadline of the current request (a perf_counter() value)"""
+    return _deadline.get()
+
+
+def expired(deadline: float | None) -> bool:
+    """Whether a deadline has passed"""
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def check_deadline(stage: str, model: str = "") -> None:
+    """Drop the work of the current request when its deadline has passed
+
+    Args:
+        stage (str): Where the work was dropped (labels the metric)
+        model (str, optional): The model the work was for
+
+    Raises:
+        DeadlineExceeded: The deadline has passed
+    """
+    if expired(deadline()):
+        metrics.DEADLINE_DROPPED.inc(model, stage)
+        raise DeadlineExceeded("the request deadline passed before it could run")
+
+
+class Gate:
+    """Limits the concurrent requests of a model, queueing a bounded amount
+
+    Args:
+        name (str): The model alias
+        max_concurrent (int): Requests let through at once (0 for no limit)
+        max_queue (int): Requests waiting to be let through
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int) -> None:
+        self.name = name
+        self.max_concurrent = max(0, max_concurrent)
+        self.max_queue = max(0, max_queue)
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+        # Moving average of how long a request holds the gate (in seconds)
+        self.hold_seconds = 1.0
+
+        self._condition = Condition(Lock())
+
+    def retry_after(self) -> int:
+        """Estimated seconds until a queued request would be let through"""
+        slots = self.max_concurrent or 1
+        return max(1, math.ceil(self.hold_seconds * (self.waiting + 1) / slots))
+
+    def enter(self, deadline: float | None = None) -> None:
+        """Wait to be let through (until the deadline)
+
+        Args:
+            deadline (float, optional): The perf_counter() deadline of the request
+
+        Raises:
+            Overloaded: The queue is full
+            DeadlineExceeded: The deadline passed while waiting
+        """
+        with self._condition:
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    metrics.ADMISSION_REJECTED.inc(self.name)
+                    raise Overloaded(
+                        f"too many requests for {self.name}, try again later",
+                        self.retry_after(),
+                    )
+
+                self.waiting += 1
+                try:
+                    while self.active >= self.max_concurrent:
+                        timeout = (
+                            None if deadline is None else deadline - time.perf_counter()
+                        )
+                        if timeout is not None and timeout <= 0:
+                            self.expired += 1
+                            metrics.DEADLINE_DROPPED.inc(self.name, "admission")
+                            raise DeadlineExceeded(
+                                f"the request deadline passed waiting for {self.name}",
+                                self.retry_after(),
+                            )
+                        self._condition.wait(timeout)
+                finally:
+                    self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+
+    def leave(self, held: float) -> None:
+        """Let the next request through
+
+        Args:
+            held (float): Seconds the leaving request held the gate
+        """
+        with self._condition:
+            self.active -= 1
+            self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held
+            self._condition.notify()
+
+    def stats(self) -> dict:
+        """Returns a JSON serialisable copy of the state and counters"""
+        with self._condition:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "retry_after": self.retry_after(),
+            }
+
+
+class Admission:
+    """The gates of every model (created on first use, the limits can be set
+    per model, i.e. INFERENCE_ADMISSION_MAX_CONCURRENT_BLIP=1)"""
+
+    def __init__(self) -> None:
+        self.gates: dict[str, Gate] = {}
+        self._lock = Lock()
+
+    def gate(self, alias: str) -> Gate:
+        """Returns the gate of a model"""
+        with self._lock:
+            gate = self.gates.get(alias)
+            if gate is None:
+                max_concurrent = config.model_option(
+                    "ADMISSION_MAX_CONCURRENT", alias, config.ADMISSION_MAX_CONCURRENT
+                )
+                max_queue = config.model_option(
+                    "ADMISSION_MAX_QUEUE", alias, config.ADMISSION_MAX_QUEUE
+                )
+                gate = self.gates[alias] = Gate(alias, max_concurrent, max_queue)
+            return gate
+
+    def stats(self) -> dict:
+        """Returns the stats of every gate keyed by model alias"""
+        with self._lock:
+            gates = list(self.gates.values())
+        return {gate.name: gate.stats() for gate in gates}
+
+
+# The process wide gates
+gates = Admission()
@@ -1,10 +1,36 @@
-from flask import Flask, request, send_file, Response
+from flask import Flask, g, request, send_file, stream_with_context, Response
+from contextlib import closing
 from typing import Literal
-from handling import api_error, format_response
-from lib import classify, classify_group, get_image, header
+from handling import api_error, format_response, json_response
+from lib import (
+    caption_stream,
+    classify,
+    classify_group,
+    classify_models,
+    classify_stream,
+    decode_size,
+    fetch_images,
+    header,
+    lookup_sources,
+)
+from admission import AdmissionError, gates
+from cache import result_cache, url_cache
+from fetch import DecodeSize
+from json import dumps
+from metrics import Counter, Gauge
+from profiling import profiler
+from uploads import UploadError, is_upload, receive_uploads, upload_params
+from werkzeug.exceptions import RequestEntityTooLarge
+import admission
+import profiling
+import config
+import metrics
 import os
-from PIL.Image import Image
+import time
+from models.base import ModelBase
 from models.model_controller import ModelController
+from models.threads import budget
+from models.ocr import OcrError, preload_tesserocr
 from flask_swagger_ui import get_swaggerui_blueprint
 import warnings
 import os
@@ -18,9 +44,16 @@ dir_path = os.path.dirname(os.path.realpath(__file__))
 Classifcation = Literal["classify", "ocr"]
 ClassifyModel = Literal["ResNet500"]
 
+# The formats a request for several models can be answered in
+MULTI_MODEL_FORMATS = ("json", "text")
+
 # Initialise the flask app
 app = Flask(__name__)
 
+# Bound request bodies (and the form fields holding base64 images) for uploads
+app.config["MAX_CONTENT_LENGTH"] = config.UPLOAD_MAX_REQUEST_BYTES
+app.config["MAX_FORM_MEMORY_SIZE"] = config.UPLOAD_MAX_REQUEST_BYTES
+
 # Swagger UI
 SWAGGER_URL = "/api"
 API_URL = "/static/swagger.yaml"
@@ -33,8 +66,9 @@ SWAGGER_BLUEPRINT = get_swaggerui_blueprint(
 app.register_blueprint(SWAGGER_BLUEPRINT, url_prefix=SWAGGER_URL)
 
 # Global reference to the model controller
+preload_tesserocr()  # Has to be imported on the main thread (see models/ocr.py)
 model_controller = ModelController()
-model_controller.load_models()
+model_controller.load_models(background=config.LOAD_IN_BACKGROUND)
 
 # Header information
 print(header())
@@ -43,6 +77,359 @@ print(
 )
 
 
+class ModelUnavailable(Exception):
+    """Raised when a requested model fails to load (answered with a 503)"""
+
+    status = 503
+
+
+def use_model(alias: str) -> ModelBase | None:
+    """Find a model and mark it as in use for the rest of the request
+    (loading it first when it has not been loaded yet). The request waits for
+    a turn of the model later, once its images are fetched (see admit)
+
+    Args:
+        alias (str): The model alias
+
+    Raises:
+        ModelUnavailable: The model failed to load
+
+    Returns:
+        ModelBase | None: The loaded model (or None if no model matches)
+    """
+    model = model_controller.find_model(alias)
+    if model is None:
+        return None
+
+    try:
+        g.setdefault("models", []).append(model_controller.acquire(model))
+    except Exception as e:
+        print(f"Unable to load the {model.alias()} model: {e}")
+        raise ModelUnavailable(
+            f"the {model.alias()} model could not be loaded ({type(e).__name__})"
+        ) from e
+
+    g.setdefault("model_alias", model.alias())  # Labels the request metrics
+    return model
+
+
+def use_models(aliases: list[str]) -> list[ModelBase] | None:
+    """Find several models and mark each as in use for the rest of the request
+
+    Args:
+        aliases (list[str]): The model aliases
+
+    Returns:
+        list[ModelBase] | None: The loaded models in request order, without
+        duplicates (or None if an alias does not match any model)
+    """
+    models = [model_controller.find_model(alias) for alias in aliases]
+    if None in models:
+        return None
+    models = list(dict.fromkeys(models))
+
+    for model in models:
+        use_model(model.alias())
+
+    return models
+
+
+def admit(*models: ModelBase) -> None:
+    """Wait for a turn of the models of the request (or fail fast with a 429/504,
+    see admission.py). Called once the src images are fetched and decoded, so
+    a slow download does not hold a turn of a model. The turns are held until
+    the response is sent (i.e., including encoding an image response)
+
+    Args:
+        *models (ModelBase): The models the request runs
+    """
+    admitted = g.setdefault("admitted", set())
+
+    # The gates are entered in alias order, so requests for overlapping sets of
+    # models never wait on each other in a cycle
+    for model in sorted(models, key=lambda model: model.alias()):
+        if model.alias() in admitted:
+            continue
+
+        admission.check_deadline("admission", model.alias())
+        gate = gates.gate(model.alias())
+        gate.enter(admission.deadline())
+        g.setdefault("gates", []).append((gate, time.perf_counter()))
+        admitted.add(model.alias())
+
+
+def model_aliases(value) -> list[str] | None:
+    """Read the model alias(es) of a request. Several models are requested as a
+    list, a comma separated string or repeated query parameters
+
+    Args:
+        value (str | list[str]): The 'model' parameter(s)
+
+    Returns:
+        list[str] | None: The aliases (None when the parameter is invalid)
+    """
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        return None
+
+    aliases = [alias.strip() for v in values for alias in v.split(",")]
+    return [alias for alias in aliases if alias] or None
+
+
+def request_decode_size(aliases: list[str] | None, format: str) -> DecodeSize | None:
+    """The size the images of a request are decoded at, before its models are
+    loaded (see lib.decode_size). Used for images decoded ahead of the handler,
+    i.e. uploads and prefetched src images
+
+    Args:
+        aliases (list[str] | None): The model aliases of the request
+        format (str): The output format of the request
+
+    Returns:
+        DecodeSize | None: The decode size (None decodes at full resolution)
+    """
+    models = [model_controller.find_model(alias) for alias in aliases or []]
+    if not models or None in models:
+        return None
+
+    return decode_size(models, format)
+
+
+def models_response(
+    src: list[str], aliases: list[str], format: str, params, single: bool = False
+) -> Response:
+    """Run several models over the src images, fetching and decoding each image
+    once (see classify_models)
+
+    Args:
+        src (list[str]): The src URLs
+        aliases (list[str]): The model aliases
+        format (str): The output format of the results ('json' or 'text')
+        params (dict): The request parameters (the model options are read from them)
+        single (bool, optional): Answer with the entry of the (only) src image
+
+    Returns:
+        Response: The src and the results keyed by model alias of each image
+    """
+    if format not in MULTI_MODEL_FORMATS:
+        return api_error(
+            "several models can only be requested with the 'json' or 'text' format"
+        )
+
+    models = use_models(aliases)
+    if models is None:
+        return api_error(
+            f"'model' did not match any loaded models. Available models {model_controller.display_available_models()}"
+        )
+
+    try:
+        options = {model.alias(): model.request_options(params) for model in models}
+    except (TypeError, ValueError):
+        return api_error("invalid model options (i.e., max_new_tokens)")
+
+    fetched = fetch_images(src, decode_size(models, format))
+    images = [result.image for result in fetched if result.image is not None]
+
+    if single and not images:
+        return api_error(
+            f"could not generate image from src query paramter ({fetched[0].error})"
+        )
+
+    if not images:
+        error = "No images available to process post filter"
+        errors = [result.to_dict() for result in fetched]
+        return json_response(dumps({"error": error, "errors": errors}))
+
+    admit(*models)
+    results = iter(classify_models(images, models, format, options))
+    entries = [
+        {"src": result.url, "results": next(results)}
+        if result.image is not None
+        else result.to_dict()
+        for result in fetched
+    ]
+
+    return entries[0] if single else entries
+
+
+def stream_response(
+    src: list[str], model: ModelBase, options: dict | None = None
+) -> Response:
+    """Stream one JSON line per src image as soon as its result is available
+
+    Args:
+        src (list[str]): The src URLs
+        model (ModelBase): The model to classify with
+        options (dict, optional): The model options of the request
+
+    Returns:
+        Response: A newline delimited JSON (application/x-ndjson) response
+    """
+
+    def generate():
+        for line in classify_stream(src, model, options):
+            yield dumps(line) + "\n"
+
+    # The request context (and the acquired model) is kept until the stream ends
+    return Response(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+
+def sse_response(src: list[str], model: ModelBase, options: dict) -> Response:
+    """Stream the caption of each src image token by token as server-sent events
+
+    Args:
+        src (list[str]): The src URLs (captioned in order)
+        model (ModelBase): A captioning model
+        options (dict): The decoding options of the request
+
+    Returns:
+        Response: A text/event-stream response
+    """
+    if not hasattr(model, "stream_caption"):
+        return api_error("the 'sse' format is only supported by captioning models")
+
+    def generate():
+        # The server closes the response when the client disconnects, which
+        # closes the stream (and stops generating its caption)
+        with closing(caption_stream(src, model, options)) as events:
+            for event, data in events:
+                yield f"event: {event}\ndata: {dumps(data)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.before_request
+def start_request():
+    """Count the request as in flight and start timing it (see metrics.py)"""
+    g.started = request.environ.get(metrics.RECEIVED) or time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc(request.endpoint or "")
+
+
+@app.after_request
+def finish_request(response: Response) -> Response:
+    """Record the request latency once the response has been sent (so streamed
+    responses are timed until their last line)"""
+    labels = (
+        request.endpoint or "",
+        g.get("model_alias", ""),
+        str(response.status_code),
+    )
+    started = g.started
+
+    def record():
+        metrics.REQUESTS_IN_FLIGHT.dec(labels[0])
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+
+    # Passthrough (file) bodies are handed to the server as is, without closing
+    # the response, so they are recorded straight away
+    if response.direct_passthrough:
+        record()
+    else:
+        response.call_on_close(record)
+    return response
+
+
+@app.before_request
+def start_deadline():
+    """Set the deadline of the request (see admission.py), from its 'timeout'
+    (header, query or POST body) or the configured default"""
+    timeout = request.headers.get(admission.TIMEOUT_HEADER, request.args.get("timeout"))
+    if timeout is None and request.method == "POST":
+        if is_upload(request):
+            body = upload_params(request)
+        else:
+            body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            timeout = body.get("timeout")
+
+    try:
+        timeout = float(timeout) if timeout is not None else config.REQUEST_TIMEOUT
+    except (TypeError, ValueError):
+        return api_error("'timeout' must be a number of seconds")
+
+    admission.set_deadline(g.started + timeout if timeout > 0 else None)
+
+
+@app.errorhandler(UploadError)
+def upload_error(e: UploadError) -> Response:
+    """Answer a request whose uploads exceed the limits (see uploads.py)"""
+    return api_error(str(e), e.status)
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e: RequestEntityTooLarge) -> Response:
+    """Answer a request whose body exceeds INFERENCE_UPLOAD_MAX_REQUEST_BYTES"""
+    return api_error(
+        f"the request body is larger than {config.UPLOAD_MAX_REQUEST_BYTES} bytes", 413
+    )
+
+
+@app.errorhandler(ModelUnavailable)
+def model_unavailable(e: ModelUnavailable) -> Response:
+    """Answer a request for a model that failed to load"""
+    return api_error(str(e), e.status)
+
+
+@app.errorhandler(OcrError)
+def ocr_error(e: OcrError) -> Response:
+    """Answer a request for an image that tesseract could not read"""
+    return api_error(str(e), e.status)
+
+
+@app.errorhandler(AdmissionError)
+def admission_error(e: AdmissionError) -> Response:
+    """Answer a request that was rejected or ran out of time (see admission.py)"""
+    response = api_error(str(e), e.status)
+    if e.retry_after is not None:
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@app.before_request
+def start_profile():
+    """Profile an enrich request that carries the profiling token (see profiling.py)"""
+    if request.endpoint != "enrich" or profiling.HEADER not in request.headers:
+        return None
+
+    if not profiling.authorized(request.headers[profiling.HEADER]):
+        return api_error("invalid profiling token", 403)
+
+    g.capture = profiler.start(request.method, request.full_path)
+    if g.capture is None:
+        return api_error("another request is being profiled, try again later", 409)
+
+
+@app.after_request
+def finish_profile(response: Response) -> Response:
+    """Stop the capture once the response has been sent, and point to its trace"""
+    capture = g.pop("capture", None)
+    if capture is None:
+        return response
+
+    capture.trace.model = g.get("model_alias", "")
+    capture.trace.status = response.status_code
+    response.headers["X-Profile-Id"] = capture.trace.id
+    response.call_on_close(lambda: profiler.stop(capture))
+    return response
+
+
+@app.teardown_request
+def release_models(exc):
+    """Release the models used by the request (so they can be evicted when idle)
+    and let the next queued requests through"""
+    for model in g.pop("models", []):
+        model_controller.release(model)
+
+    for gate, entered in g.pop("gates", []):
+        gate.leave(time.perf_counter() - entered)
+
+
 @app.route("/")
 def index():
     """Return JSON data representing the loaded models available"""
@@ -61,6 +448,130 @@ def models():
     return model_controller.display_models()
 
 
+@app.route("/api/stats")
+def stats():
+    """Return runtime statistics (i.e., batch sizes and cache hit rates)"""
+    return {
+        "admission": gates.stats(),
+        "batching": model_controller.batching_stats(),
+        "cache": {"results": result_cache.stats(), "urls": url_cache.stats()},
+        "threads": budget.stats(),
+    }
+
+
+def runtime_metrics() -> list:
+    """The model, queue, admission and cache metrics, collected when /metrics is
+    scraped"""
+    loaded = Gauge("inference_model_loaded", "Whether a model is loaded", ("model",))
+    load_seconds = Gauge(
+        "inference_model_load_seconds", "Time taken to load a model", ("model",)
+    )
+    memory = Gauge(
+        "inference_model_memory_bytes", "Approximate memory used by a model", ("model",)
+    )
+    in_use = Gauge(
+        "inference_model_requests_in_flight",
+        "Requests currently using a model",
+        ("model",),
+    )
+    queue_depth = Gauge(
+        "inference_queue_depth",
+        "Images waiting for a micro-batch of a model",
+        ("model",),
+    )
+
+    for alias, stats in model_controller.model_stats().items():
+        loaded.set(int(stats["status"] == "ready"), alias)
+        memory.set(stats["memory"], alias)
+        in_use.set(stats["in_use"], alias)
+        queue_depth.set(stats["queue_depth"], alias)
+        if stats["load_seconds"] is not None:
+            load_seconds.set(stats["load_seconds"], alias)
+
+    collected = [loaded, load_seconds, memory, in_use, queue_depth]
+
+    active = Gauge(
+        "inference_admission_active", "Requests let through a models gate", ("model",)
+    )
+    waiting = Gauge(
+        "inference_admission_waiting",
+        "Requests queued at a models gate",
+        ("model",),
+    )
+    for alias, stats in gates.stats().items():
+        active.set(stats["active"], alias)
+        waiting.set(stats["waiting"], alias)
+    collected += [active, waiting]
+
+    results = result_cache.stats()
+    for key in ("hits", "misses", "coalesced", "evictions"):
+        counter = Counter(f"inference_cache_{key}_total", f"Result cache {key}")
+        counter.inc(amount=results[key])
+        collected.append(counter)
+
+    for key, documentation in (
+        ("entries", "Results in the result cache"),
+        ("bytes", "Approximate size of the result cache"),
+    ):
+        gauge = Gauge(f"inference_cache_{key}", documentation)
+        gauge.set(results[key])
+        collected.append(gauge)
+
+    urls = url_cache.stats()
+    for key in ("revalidated", "changed"):
+        counter = Counter(
+            f"inference_url_cache_{key}_total", f"Remembered src images {key}"
+        )
+        counter.inc(amount=urls[key])
+        collected.append(counter)
+
+    return collected
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Expose the metrics in the Prometheus text format (see metrics.py)"""
+    return Response(
+        metrics.registry.expose(runtime_metrics()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def admin_error() -> Response | None:
+    """Guard the admin endpoints with the profiling token"""
+    if not profiling.enabled():
+        return api_error("profiling is disabled (set INFERENCE_PROFILING_TOKEN)", 404)
+
+    if not profiling.authorized(request.headers.get(profiling.HEADER)):
+        return api_error("invalid profiling token", 403)
+
+    return None
+
+
+@app.route("/api/admin/profiles")
+def list_profiles():
+    """List the recently captured request traces (newest first)"""
+    return admin_error() or json_response(dumps(profiler.list()), 200)
+
+
+@app.route("/api/admin/profiles/<id>/<name>")
+def download_profile(id: str, name: str):
+    """Download a file of a captured trace (see profiling.py for the files)"""
+    error = admin_error()
+    if error is not None:
+        return error
+
+    trace = profiler.find(id)
+    if trace is None or name not in trace.files:
+        return api_error(f"no trace file '{id}/{name}'", 404)
+
+    return Response(
+        trace.files[name],
+        mimetype=profiling.MIMETYPES[name],
+        headers={"Content-Disposition": f'attachment; filename="{id}-{name}"'},
+    )
+
+
 @app.route("/api/enrich", methods=["GET", "POST"])
 def enrich():
     """Classify a single entity through a provided mode and type
@@ -86,57 +597,171 @@ def enrich():
         src = request.args.get("src")
         if src is None:
             return api_error("url query parameter was not provided")
-        else:
-            src.strip()
 
-        img = get_image(src)
-        if img is None:
-            return api_error("could not generate image from src query paramter")
+        # Model(s) and return format
+        aliases = model_aliases(request.args.getlist("model") or ["ResNet"])
+        format = request.args.get("format", default="img").strip()
+
+        # A 'data:' URI is decoded in place
+        size = request_decode_size(aliases, format)
+        src = receive_uploads(request, [src.strip()], size)[0]
 
-        # Model
-        model = request.args.get("model", default="ResNet").strip()
+        if aliases is not None and len(aliases) > 1:
+            return models_response([src], aliases, format, request.args, single=True)
 
         # Find the model from the controller
-        model = model_controller.find_model(model)
+        model = use_model(aliases[0]) if aliases is not None else None
 
         if model is None:
             return api_error("model query parameter did not match any loaded models")
 
-        # Return format
-        format = request.args.get("format", default="img").strip()
+        try:
+            options = model.request_options(request.args)
+        except (TypeError, ValueError):
+            return api_error("invalid model options (i.e., max_new_tokens)")
+
+        # Streams download and classify their images together
+        if format in ("ndjson", "sse"):
+            admit(model)
+            respond = stream_response if format == "ndjson" else sse_response
+            return respond([src], model, options)
+
+        # Serve the cached result when the src image has not changed
+        cached = lookup_sources([src], model, format, options)
+        if cached:
+            admit(model)  # An image response is still encoded
+            return format_response(cached[0], format)
+
+        fetched = fetch_images([src], decode_size([model], format))[0]
+        if fetched.image is None:
+            return api_error(
+                f"could not generate image from src query paramter ({fetched.error})"
+            )
 
-        res = classify(img, model, format)
+        admit(model)
+        res = classify(fetched.image, model, format, options)
 
     # POST REQUEST
     if request.method == "POST":
         """Extract params from the POST body"""
 
-        json = request.json
+        # Image uploads carry their parameters in the query string and form fields
+        uploaded = is_upload(request)
+        json = upload_params(request) if uploaded else request.json
         if json is None:
             return api_error("invalid JSON in POST body")
 
-        src = json.get("src")
+        src = json.get("src", [] if uploaded else None)
         if src is None:
             return api_error("src was not specified as a POST body parameter")
 
-        model = json.get("model", "ResNet")
-        model = model_controller.find_model(model)  # Find the model from the controller
+        aliases = model_aliases(json.get("model", "ResNet"))
+        if aliases is None:
+            return api_error("'model' must be a model alias or a list of aliases")
+
+        format = json.get("format", "default")
+
+        if isinstance(src, str):
+            src = [src]
+
+        src = receive_uploads(request, src, request_decode_size(aliases, format))
+        if not src:
+            return api_error("no src or uploaded images were provided")
+
+        if len(aliases) > 1:
+            return models_response(src, aliases, format, json)
+
+        model = use_model(aliases[0])  # Find the model from the controller
         if model is None:
             return api_error(
                 f"'model' query parameter did not match any loaded models. Available models {model_controller.display_available_models()}"
             )
 
-        format = json.get("format", "default")
-
-        # Create images
-        images = [get_image(url) for url in src]
+        try:
+            options = model.request_options(json)
+        except (TypeError, ValueError):
+            return api_error("invalid model options (i.e., max_new_tokens)")
+
+        # Streams download and classify their images together
+        if format in ("ndjson", "sse"):
+            admit(model)
+            respond = stream_response if format == "ndjson" else sse_response
+            return respond(src, model, options)
+
+        # Grid image options (tiles are capped to the configured size)
+        tile_size = json.get("tile_size")
+        columns = json.get("columns")
+
+        for name, value in (("tile_size", tile_size), ("columns", columns)):
+            if value is not None and (not isinstance(value, int) or value < 1):
+                return api_error(f"'{name}' must be a positive integer")
+
+        if tile_size is not None:
+            tile_size = min(tile_size, config.GRID_TILE_SIZE)
+
+        # Results for unchanged src images that are already cached
+        cached = (
+            lookup_sources(src, model, format, options, raw=True)
+            if format == "json"
+            else {}
+        )
+
+        # Create images (concurrently, each result keeps its src and any error)
+        fetched = fetch_images(
+            [url for i, url in enumerate(src) if i not in cached],
+            decode_size([model], format),
+        )
 
         # Filter out the failed images
-        images_filtered: list[Image] = list(filter(lambda x: x is not None, images))  # type: ignore
-
-        if images_filtered is None:
-            return api_error("No images available to process post filter")
+        images_filtered = [result for result in fetched if result.image is not None]
+        errors = [result.to_dict() for result in fetched if result.error is not None]
+
+        if not images_filtered and not cached:
+            return json_response(
+                dumps(
+                    {
+                        "error": "No images available to process post filter",
+                        "errors": errors,
+                    }
+                )
+            )
 
-        res = classify_group(images_filtered, model, format)
+        if images_filtered:
+            admit(model)
+
+        res = (
+            classify_group(
+                [result.image for result in images_filtered],
+                model,
+                format,
+                srcs=[result.url for result in images_filtered],
+                tile_size=tile_size,
+                columns=columns,
+                options=options,
+            )
+            if images_filtered
+            else []
+        )
+
+        if format == "json":
+            # Report the cached and failed images in place (in input order)
+            fetched_iter = iter(fetched)
+            results = iter(res)
+            res = []
+
+            for i, url in enumerate(src):
+                if i in cached:
+                    res.append({"src": url, "result": cached[i]})
+                    continue
+
+                result = next(fetched_iter)
+                res.append(
+                    next(results) if result.image is not None else result.to_dict()
+                )
+        else:
+            response = format_response(res, format)
+            if errors and isinstance(response, Response):
+                response.headers["X-Enrich-Errors"] = dumps(errors)
+            return response
 
     return format_response(res, format)
@@ -0,0 +1,321 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from json import JSONDecodeError, dumps, loads
+from threading import Event
+from urllib.parse import parse_qs
+import argparse
+import asyncio
+import sys
+import time
+from app import app, model_aliases, request_decode_size
+from cache import url_cache
+from fetch import PREFETCHED, AsyncImageFetcher, DecodeSize, fetcher
+import config
+import metrics
+
+"""Async (ASGI) serving, so slow src downloads do not pin worker threads
+
+The ASGI application serves the same routes (and swagger spec) as the WSGI app.
+The src images of an /api/enrich request are downloaded on an async HTTP client
+(httpx) before the request is handed to the app, so hundreds of downloads can
+be in flight without holding a thread each. Decoding runs on a bounded decoder
+executor, and the (blocking) request handlers, i.e. inference and encoding, on
+a bounded executor of INFERENCE_ASGI_WORKERS threads. Example (from the
+repository root, requires `pip install httpx uvicorn`):
+
+    python src/asgi.py --port 5000
+    uvicorn --app-dir src asgi:application --port 5000
+
+Streamed formats (ndjson and sse) are not prefetched, they download each src
+as the stream progresses. Src URLs remembered for revalidation (see cache.py)
+are not prefetched either, as an unchanged src is answered without its body.
+"""
+
+# Formats whose src images are downloaded as the response streams
+STREAMED = ("ndjson", "sse")
+
+
+class ClientDisconnected(OSError):
+    """Raised into a (streaming) handler when its client has gone away"""
+
+    pass
+
+
+def prefetch_sources(
+    method: str, query: bytes, body: bytes
+) -> tuple[list[str], DecodeSize | None]:
+    """The src URLs of an /api/enrich request that can be downloaded ahead of it,
+    and the size their images are decoded at (see lib.decode_size)
+
+    Args:
+        method (str): The request method
+        query (bytes): The query string
+        body (bytes): The request body
+
+    Returns:
+        tuple[list[str], DecodeSize | None]: The URLs (empty when the request is
+        invalid or streamed) and the decode size
+    """
+    if method == "GET":
+        args = parse_qs(query.decode("latin-1"))
+        src = [url.strip() for url in args.get("src", [])[:1]]
+        format = args.get("format", ["img"])[0].strip()
+        aliases = model_aliases(args.get("model", ["ResNet"]))
+    elif method == "POST":
+        try:
+            params = loads(body)
+        except (JSONDecodeError, UnicodeDecodeError):
+            return [], None
+
+        if not isinstance(params, dict):
+            return [], None
+
+        src = params.get("src")
+        src = [src] if isinstance(src, str) else src
+        format = params.get("format", "default")
+        aliases = model_aliases(params.get("model", "ResNet"))
+
+        if not isinstance(src, list):
+            return [], None
+    else:
+        return [], None
+
+    if format in STREAMED:
+        return [], None
+
+    # Uploaded (data: URI) images are decoded by the app (see uploads.py)
+    urls = [
+        url
+        for url in src
+        if isinstance(url, str)
+        and url.startswith(("http://", "https://"))
+        and url_cache.get(url) is None
+    ]
+    return urls, request_decode_size(aliases, format) if urls else None
+
+
+def wsgi_environ(scope: dict, body: bytes) -> dict:
+    """Build the WSGI environ of an ASGI http request
+
+    Args:
+        scope (dict): The ASGI connection scope
+        body (bytes): The request body
+
+    Returns:
+        dict: The environ
+    """
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path) :]
+
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+
+        # Repeated headers are combined into a comma separated list
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+class AsyncServer:
+    """An ASGI application serving a WSGI app, with the src images of enrich
+    requests downloaded asynchronously ahead of the app
+
+    Args:
+        app (Callable): The WSGI app
+        workers (int): The threads running the WSGI app
+        decode_workers (int): The threads decoding downloaded images
+        max_fetches (int): Maximum concurrent src downloads
+    """
+
+    def __init__(
+        self,
+        app,
+        workers: int = config.ASGI_WORKERS,
+        decode_workers: int = config.ASGI_DECODE_WORKERS,
+        max_fetches: int = config.ASGI_MAX_FETCHES,
+    ) -> None:
+        self.app = app
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="asgi")
+        self.decoder = ThreadPoolExecutor(decode_workers, thread_name_prefix="decode")
+        self.fetcher = AsyncImageFetcher(fetcher, max_fetches, self.decoder)
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+        received = time.perf_counter()
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+            body.extend(message.get("body", b""))
+
+            # Bodies beyond the upload limit are rejected instead of buffered
+            if len(body) > config.UPLOAD_MAX_REQUEST_BYTES:
+                return await self.reject(send, 413, "the request body is too large")
+
+            if not message.get("more_body", False):
+                break
+
+        environ = wsgi_environ(scope, bytes(body))
+        environ[metrics.RECEIVED] = received
+
+        if scope["path"] == "/api/enrich":
+            urls, size = prefetch_sources(
+                scope["method"], scope["query_string"], body
+            )
+            if urls:
+                environ[PREFETCHED] = await self.fetcher.fetch_all(urls, size)
+
+        await self.respond(environ, receive, send)
+
+    async def reject(self, send, status: int, error: str) -> None:
+        """Answer a request with a JSON error without handing it to the app"""
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            }
+        )
+        body = dumps({"error": error}).encode()
+        await send({"type": "http.response.body", "body": body})
+
+    async def lifespan(self, receive, send) -> None:
+        """Answer the server startup and shutdown events"""
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.fetcher.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def respond(self, environ: dict, receive, send) -> None:
+        """Run the WSGI app on the executor and send its response. The whole
+        response (including a streamed body) is produced on one thread, so
+        callbacks run once it has been sent see the same thread as the handler
+
+        Args:
+            environ (dict): The WSGI environ of the request
+            receive (Callable): The ASGI receive channel
+            send (Callable): The ASGI send channel
+        """
+        loop = asyncio.get_running_loop()
+        disconnected = Event()
+
+        async def watch() -> None:
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        def send_sync(message: dict) -> None:
+            if disconnected.is_set():
+                raise ClientDisconnected("the client disconnected")
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run() -> None:
+            status, headers = None, []
+
+            def start_response(new_status: str, new_headers: list, exc_info=None):
+                nonlocal status, headers
+                status, headers = new_status, new_headers
+
+            def start() -> None:
+                send_sync(
+                    {
+                        "type": "http.response.start",
+                        "status": int(status.split(" ", 1)[0]),
+                        "headers": [
+                            (name.lower().encode("latin-1"), value.encode("latin-1"))
+                            for name, value in headers
+                        ],
+                    }
+                )
+
+            output = self.app(environ, start_response)
+            try:
+                started = False
+                for chunk in output:
+                    if not chunk:
+                        continue
+
+                    if not started:
+                        start()
+                        started = True
+
+                    send_sync(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+
+                if not started:
+                    start()
+                send_sync({"type": "http.response.body", "body": b""})
+            except ClientDisconnected:
+                pass
+            finally:
+                if hasattr(output, "close"):
+                    output.close()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await loop.run_in_executor(self.executor, run)
+        finally:
+            watcher.cancel()
+
+
+# The ASGI application (i.e., `uvicorn --app-dir src asgi:application`)
+application = AsyncServer(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the api with an ASGI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(application, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
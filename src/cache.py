@@ -0,0 +1,282 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import sha256
+from threading import Lock
+from typing import Callable
+from PIL.Image import Image as PILImage
+import json
+import time
+import config
+
+"""Content-addressed caching of inference results"""
+
+
+def image_digest(img: PILImage) -> str:
+    """Hash the decoded pixels of an image. The digest is memoised on the
+    image so that it is only computed once per image
+
+    Args:
+        img (PILImage): The image to hash
+
+    Returns:
+        str: A hex digest identifying the image content
+    """
+    digest = img.info.get("digest")
+
+    if digest is None:
+        hasher = sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+        hasher.update(img.tobytes())
+        digest = hasher.hexdigest()
+        img.info["digest"] = digest
+
+    return digest
+
+
+def result_key(
+    digest: str, alias: str, format: str, options: dict | None = None
+) -> str:
+    """The cache key of a result for an image digest, model alias and output format
+    (and any model specific request options, see ModelBase.request_options)"""
+    if options:
+        format = f"{format}:{json.dumps(options, sort_keys=True)}"
+    return f"{alias.lower()}:{format}:{digest}"
+
+
+def sizeof(value) -> int:
+    """Approximate the memory used by a cached value (in bytes)"""
+    if isinstance(value, PILImage):
+        return value.width * value.height * len(value.getbands())
+
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+class ResultCache:
+    """A thread-safe LRU cache bounded by an approximate memory budget and a TTL
+
+    Concurrent requests for a key that is already being computed wait on the
+    in-flight computation instead of starting a duplicate (single-flight).
+
+    Args:
+        max_bytes (int): The memory budget (0 disables caching, single-flight
+        coalescing still applies)
+        ttl (float): Seconds an entry stays valid for
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._inflight: dict[str, Future] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _lookup(self, key: str):
+        """Returns the entry for a key (or None). Must hold the lock"""
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        value, size, expires = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self._bytes -= size
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value) -> None:
+        """Insert a value, evicting the least recently used entries. Must hold the lock"""
+        size = sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+            self.evictions += 1
+
+    def contains(self, key: str) -> bool:
+        """Whether a valid entry exists for the key (does not count as a hit)"""
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def get(self, key: str):
+        """Returns the cached value for a key (or None), counting a hit or miss"""
+        with self._lock:
+            entry = self._lookup(key) if self.max_bytes > 0 else None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry[0]
+
+    def get_or_compute(self, key: str, fn: Callable, store: bool = True):
+        """Return the cached value for a key, computing it with fn on a miss
+
+        Args:
+            key (str): The cache key
+            fn (Callable[[], any]): Computes the value
+            store (bool, optional): Cache the computed value (when False,
+            concurrent duplicates still share the computation)
+
+        Returns:
+            any: The cached or computed value
+        """
+        return self.get_or_compute_many([key], lambda missing: [fn()], store)[0]
+
+    def get_or_compute_many(
+        self, keys: list[str], fn: Callable, store: bool = True
+    ) -> list:
+        """Return the cached values for a list of keys. Missing values are
+        computed together by a single call to fn (i.e., one batched forward pass)
+
+        Args:
+            keys (list[str]): The cache keys
+            fn (Callable[[list[int]], list]): Computes the values for the given
+            indexes of 'keys' (in the same order)
+            store (bool, optional): Cache the computed values (see get_or_compute)
+
+        Raises:
+            RuntimeError: fn returned a different amount of values than requested
+
+        Returns:
+            list: The values (in the same order as the keys)
+        """
+        results = [None] * len(keys)
+        waiting: dict[int, Future] = {}
+        owned: list[int] = []
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._lookup(key) if self.max_bytes > 0 else None
+
+                if entry is not None:
+                    self.hits += 1
+                    results[i] = entry[0]
+                elif key in self._inflight:
+                    self.coalesced += 1
+                    waiting[i] = self._inflight[key]
+                else:
+                    self.misses += 1
+                    self._inflight[key] = Future()
+                    owned.append(i)
+
+        if owned:
+            try:
+                values = list(fn(owned))
+                if len(values) != len(owned):
+                    raise RuntimeError(
+                        f"computed {len(values)} values for {len(owned)} keys"
+                    )
+            except Exception as e:
+                with self._lock:
+                    for i in owned:
+                        self._inflight.pop(keys[i]).set_exception(e)
+                raise
+
+            with self._lock:
+                for i, value in zip(owned, values):
+                    results[i] = value
+                    if store and self.max_bytes > 0:
+                        self._store(keys[i], value)
+                    self._inflight.pop(keys[i]).set_result(value)
+
+        for i, future in waiting.items():
+            results[i] = future.result()
+
+        return results
+
+    def stats(self) -> dict:
+        """Returns the hit, miss and coalesced counts along with the cache usage"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class UrlCache:
+    """Maps a src URL to the digest of the image it last served, along with the
+    validators (ETag / Last-Modified) used to check the image has not changed
+
+    Args:
+        max_entries (int): The maximum amount of URLs remembered (LRU)
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+
+        self._lock = Lock()
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+
+        self.revalidated = 0
+        self.changed = 0
+
+    def get(self, url: str) -> tuple | None:
+        """Returns the (digest, etag, last_modified) remembered for a URL"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(
+        self, url: str, digest: str, etag: str | None, last_modified: str | None
+    ) -> None:
+        """Remember the digest of a URL (only when the origin sent validators)"""
+        if self.max_entries <= 0 or (etag is None and last_modified is None):
+            return
+
+        with self._lock:
+            self._entries[url] = (digest, etag, last_modified)
+            self._entries.move_to_end(url)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record(self, not_modified: bool) -> None:
+        """Count the outcome of a revalidation"""
+        with self._lock:
+            if not_modified:
+                self.revalidated += 1
+            else:
+                self.changed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "revalidated": self.revalidated,
+                "changed": self.changed,
+            }
+
+
+# Process wide caches
+result_cache = ResultCache(config.CACHE_MAX_BYTES, config.CACHE_TTL)
+url_cache = UrlCache(config.CACHE_MAX_URLS)
@@ -0,0 +1,210 @@
+import os
+
+"""Runtime configuration for the inference api
+
+Every option can be overridden through an environment variable prefixed
+with 'INFERENCE_'. Model specific options can additionally be overridden
+per model by suffixing the variable with the upper-cased model alias,
+e.g. INFERENCE_BATCH_MAX_SIZE_ALEXNET=32
+"""
+
+
+def env_str(name: str, default: str) -> str:
+    """Read a string option from the environment
+
+    Args:
+        name (str): The option name (without the 'INFERENCE_' prefix)
+        default (str): The value used when the option is not set
+
+    Returns:
+        str: The configured value
+    """
+    return os.environ.get(f"INFERENCE_{name}", default)
+
+
+def env_int(name: str, default: int) -> int:
+    """Read an integer option from the environment (see env_str)"""
+    return int(env_str(name, str(default)))
+
+
+def env_float(name: str, default: float) -> float:
+    """Read a float option from the environment (see env_str)"""
+    return float(env_str(name, str(default)))
+
+
+def model_option(name: str, alias: str, default):
+    """Read a model specific option, falling back to the global option
+
+    Args:
+        name (str): The option name (without the 'INFERENCE_' prefix)
+        alias (str): The alias of the model the option applies to
+        default (any): The global default. Its type is used to parse the value
+
+    Returns:
+        any: The per-model value, else the global value, else the default
+    """
+    value = os.environ.get(
+        f"INFERENCE_{name}_{alias.upper()}", env_str(name, str(default))
+    )
+    return type(default)(value)
+
+
+# Micro-batching (see models/batching.py)
+# How long the scheduler waits to collect concurrent requests into one batch
+BATCH_WINDOW_MS = env_float("BATCH_WINDOW_MS", 5.0)
+
+# The maximum amount of images run through a single forward pass
+BATCH_MAX_SIZE = env_int("BATCH_MAX_SIZE", 16)
+
+# Image fetching (see fetch.py)
+# Maximum concurrent downloads for a single request, and for the whole process
+FETCH_MAX_WORKERS = env_int("FETCH_MAX_WORKERS", 8)
+FETCH_MAX_CONCURRENT = env_int("FETCH_MAX_CONCURRENT", 32)
+
+# Seconds to wait for a connection, between received bytes, and for a whole download
+FETCH_CONNECT_TIMEOUT = env_float("FETCH_CONNECT_TIMEOUT", 3.05)
+FETCH_READ_TIMEOUT = env_float("FETCH_READ_TIMEOUT", 10.0)
+FETCH_TOTAL_TIMEOUT = env_float("FETCH_TOTAL_TIMEOUT", 30.0)
+
+# The maximum size of a downloaded image (in bytes)
+FETCH_MAX_BYTES = env_int("FETCH_MAX_BYTES", 20 * 1024 * 1024)
+
+# Image decoding (see fetch.py)
+# The accepted image formats (comma separated Pillow format names)
+DECODE_FORMATS = [
+    name.strip().upper()
+    for name in env_str("DECODE_FORMATS", "JPEG,MPO,PNG,WEBP,GIF,BMP,TIFF").split(",")
+    if name.strip()
+]
+
+# Images with more pixels (width x height) are rejected from their header
+DECODE_MAX_PIXELS = env_int("DECODE_MAX_PIXELS", 50_000_000)
+
+# The bytes of a download inspected for the image header before the rest is downloaded
+DECODE_PROBE_BYTES = env_int("DECODE_PROBE_BYTES", 256 * 1024)
+
+# Decode images at roughly the resolution the models need when the response holds
+# results rather than an image (JPEG draft mode)
+DECODE_DRAFT = env_str("DECODE_DRAFT", "1") != "0"
+
+# Uploaded images (see uploads.py)
+# The maximum size of an uploaded image, and of a whole request body (in bytes)
+UPLOAD_MAX_BYTES = env_int("UPLOAD_MAX_BYTES", 20 * 1024 * 1024)
+UPLOAD_MAX_REQUEST_BYTES = env_int("UPLOAD_MAX_REQUEST_BYTES", 100 * 1024 * 1024)
+
+# The maximum amount of images uploaded with a single request
+UPLOAD_MAX_FILES = env_int("UPLOAD_MAX_FILES", 64)
+
+# Admission control (see admission.py)
+# Concurrent requests per model (0 disables the limit), and requests queued for one
+ADMISSION_MAX_CONCURRENT = env_int("ADMISSION_MAX_CONCURRENT", 4)
+ADMISSION_MAX_QUEUE = env_int("ADMISSION_MAX_QUEUE", 32)
+
+# The default deadline of a request in seconds (0 disables it)
+REQUEST_TIMEOUT = env_float("REQUEST_TIMEOUT", 30.0)
+
+# Async serving (see asgi.py)
+# Maximum concurrent src downloads of the async server (these do not hold a thread)
+ASGI_MAX_FETCHES = env_int("ASGI_MAX_FETCHES", 512)
+
+# The threads decoding downloaded images, and the threads running the (blocking)
+# request handlers, i.e. inference and encoding
+ASGI_DECODE_WORKERS = env_int("ASGI_DECODE_WORKERS", 4)
+ASGI_WORKERS = env_int("ASGI_WORKERS", 32)
+
+# Result caching (see cache.py)
+# The memory budget of the inference result cache (in bytes, 0 disables the cache)
+CACHE_MAX_BYTES = env_int("CACHE_MAX_BYTES", 256 * 1024 * 1024)
+
+# Seconds a cached result stays valid for
+CACHE_TTL = env_float("CACHE_TTL", 3600.0)
+
+# The amount of src URLs remembered for ETag/Last-Modified revalidation (0 disables)
+CACHE_MAX_URLS = env_int("CACHE_MAX_URLS", 0)
+
+# Image responses (see encoding.py)
+# The maximum amount of images encoded at once (across all requests). Encoding runs
+# on the request thread, so this bounds concurrency rather than sizing a pool
+ENCODE_MAX_WORKERS = env_int("ENCODE_MAX_WORKERS", 4)
+
+# The default JPEG/WebP quality, and maximum longer side of an image response (0 disables)
+ENCODE_QUALITY = env_int("ENCODE_QUALITY", 70)
+ENCODE_MAX_DIM = env_int("ENCODE_MAX_DIM", 0)
+
+# Grid images (see grid.py)
+# The width and height of each tile, and the maximum tiles per row of a grid image
+GRID_TILE_SIZE = env_int("GRID_TILE_SIZE", 1024)
+GRID_COLUMNS = env_int("GRID_COLUMNS", 8)
+
+# OCR (see models/ocr.py)
+# 'tesserocr' (in-process tesseract workers), 'cli' or 'auto' (tesserocr if installed)
+OCR_ENGINE = env_str("OCR_ENGINE", "auto")
+
+# The amount of concurrent tesseract workers (processes for the 'cli' engine)
+OCR_WORKERS = env_int("OCR_WORKERS", 2)
+
+# The tesseract language(s), tessdata directory (empty for the default) and executable
+OCR_LANG = env_str("OCR_LANG", "eng")
+OCR_TESSDATA = env_str("OCR_TESSDATA", "")
+OCR_CMD = env_str("OCR_CMD", "tesseract")
+
+# Comma separated preprocessing applied before recognition ('grayscale', 'binarize')
+OCR_PREPROCESS = env_str("OCR_PREPROCESS", "")
+
+# Caption generation (see models/captioning.py)
+# The default maximum caption length (in tokens) and beams (1 decodes greedily)
+CAPTION_MAX_NEW_TOKENS = env_int("CAPTION_MAX_NEW_TOKENS", 30)
+CAPTION_NUM_BEAMS = env_int("CAPTION_NUM_BEAMS", 1)
+
+# The largest max_new_tokens and num_beams a request can ask for
+CAPTION_TOKEN_LIMIT = env_int("CAPTION_TOKEN_LIMIT", 128)
+CAPTION_BEAM_LIMIT = env_int("CAPTION_BEAM_LIMIT", 8)
+
+# Model loading (see models/model_controller.py)
+# The directory models are discovered in (defaults to models/pretrained)
+MODEL_DIR = env_str("MODEL_DIR", "")
+
+# 'eager' loads every model at startup, 'lazy' loads each model on its first use
+LOAD_MODE = env_str("LOAD_MODE", "eager")
+
+# Comma separated aliases of models to load at startup (and never evict) in lazy mode
+PRELOAD = [
+    alias.strip() for alias in env_str("PRELOAD", "").split(",") if alias.strip()
+]
+
+# Load the startup models on a background thread so the server answers straight away
+LOAD_IN_BACKGROUND = env_str("LOAD_IN_BACKGROUND", "1") != "0"
+
+# Idle models are unloaded once the process RSS exceeds this budget (0 disables eviction)
+MEMORY_BUDGET_MB = env_int("MEMORY_BUDGET_MB", 0)
+
+# CPU optimisation (see models/optimize.py)
+# The optimisation profile applied to each model (comma separated options)
+PROFILE = env_str("PROFILE", "inference_mode")
+
+# The intra-op threads of each model (0 splits the thread budget between the models
+# loaded at startup), and the inter-op threads used by torch (0 keeps the default)
+INTRA_OP_THREADS = env_int("INTRA_OP_THREADS", 0)
+INTER_OP_THREADS = env_int("INTER_OP_THREADS", 0)
+
+# CPU thread budget (see models/threads.py)
+# The threads shared by the models and the request pools (0 uses every usable core)
+THREAD_BUDGET = env_int("THREAD_BUDGET", 0)
+
+# Pin model workers to cores: '' disables, 'auto' assigns disjoint core sets, or a
+# core list such as '0-3,8' (usually set per model, i.e. INFERENCE_CPU_AFFINITY_VIT)
+CPU_AFFINITY = env_str("CPU_AFFINITY", "")
+
+# Execution backends (see models/backends.py)
+# The backend running each models forward pass ('torch' or 'onnx')
+BACKEND = env_str("BACKEND", "torch")
+
+# The directory exported ONNX graphs are loaded from (defaults to <repository>/onnx)
+ONNX_DIR = env_str("ONNX_DIR", "")
+
+# Request profiling (see profiling.py)
+# The token that enables profiling a request and the admin endpoints ('' disables)
+PROFILING_TOKEN = env_str("PROFILING_TOKEN", "")
+
+# The amount of recent traces kept in memory
+PROFILING_MAX_TRACES = env_int("PROFILING_MAX_TRACES", 8)
@@ -0,0 +1,141 @@
+from threading import BoundedSemaphore
+from hashlib import sha256
+from io import BytesIO
+from PIL.Image import Image as PILImage
+import config
+import metrics
+
+"""Encoding of image responses (JPEG, WebP or PNG)
+
+The output format is negotiated through an explicit 'output' option or the
+Accept header. Images are encoded on the request thread, but only a bounded
+amount of (CPU heavy) encodes run at once regardless of the amount of request
+threads, the other requests wait for a slot. This only bounds concurrency,
+there is no encode queue: a waiting request keeps its thread.
+"""
+
+# Output format -> (PIL format, mimetype)
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "png": ("PNG", "image/png"),
+}
+
+ALIASES = {"jpg": "jpeg"}
+
+
+class EncodeOptions:
+    """How an image response is encoded
+
+    Args:
+        format (str): The output format (a FORMATS key)
+        quality (int): The JPEG/WebP quality (1-100, ignored by PNG)
+        max_dim (int): Downscale images whose longer side exceeds this (0 disables)
+    """
+
+    def __init__(self, format: str, quality: int, max_dim: int) -> None:
+        self.format = format
+        self.quality = max(1, min(quality, 100))
+        self.max_dim = max(0, max_dim)
+
+    @property
+    def mimetype(self) -> str:
+        return FORMATS[self.format][1]
+
+    def etag(self, result: str) -> str:
+        """A strong ETag for the encoded image, so a repeat request can be
+        answered without encoding
+
+        Args:
+            result (str): Identifies the served image, i.e. its result cache key
+            and the model profile and backend (see lib.remember_image_result)
+
+        Returns:
+            str: The ETag (derived from the result and the options)
+        """
+        key = f"{result}:{self.format}:{self.quality}:{self.max_dim}"
+        return sha256(key.encode()).hexdigest()[:32]
+
+
+def negotiate(
+    output: str | None, accept, quality: str | None, max_dim: str | None
+) -> EncodeOptions:
+    """Resolve the encoding options of a request
+
+    Args:
+        output (str, optional): An explicitly requested format (jpeg, webp or png)
+        accept (MIMEAccept): The parsed Accept header of the request
+        quality (str, optional): The requested quality
+        max_dim (str, optional): The requested maximum dimension
+
+    Returns:
+        EncodeOptions: The options (unknown or invalid values use the defaults)
+    """
+    format = ALIASES.get((output or "").lower(), (output or "").lower())
+
+    if format not in FORMATS:
+        # Prefer JPEG when the client accepts anything
+        mimetype = accept.best_match(
+            [mimetype for _, mimetype in FORMATS.values()], default="image/jpeg"
+        )
+        format = next(key for key, (_, m) in FORMATS.items() if m == mimetype)
+
+    def integer(value: str | None, default: int) -> int:
+        try:
+            return int(value) if value is not None else default
+        except ValueError:
+            return default
+
+    return EncodeOptions(
+        format,
+        integer(quality, config.ENCODE_QUALITY),
+        integer(max_dim, config.ENCODE_MAX_DIM),
+    )
+
+
+def encode(img: PILImage, options: EncodeOptions) -> bytes:
+    """Encode an image (downscaling it first when it exceeds options.max_dim)
+
+    Args:
+        img (PILImage): The image to encode (left unchanged)
+        options (EncodeOptions): How to encode the image
+
+    Returns:
+        bytes: The encoded image
+    """
+    if options.max_dim and max(img.size) > options.max_dim:
+        img = img.copy()
+        img.thumbnail((options.max_dim, options.max_dim), reducing_gap=3.0)
+
+    pil_format = FORMATS[options.format][0]
+
+    # JPEG has no alpha channel, WebP and PNG keep it
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    output = BytesIO()
+    match pil_format:
+        case "JPEG":
+            img.save(output, "JPEG", quality=options.quality, progressive=True)
+        case "WEBP":
+            img.save(output, "WEBP", quality=options.quality, method=4)
+        case "PNG":
+            img.save(output, "PNG", compress_level=3)
+
+    return output.getvalue()
+
+
+# Bounded so that concurrent encodes cannot starve inference of CPU
+encode_slots = BoundedSemaphore(config.ENCODE_MAX_WORKERS)
+
+
+def encode_bounded(img: PILImage, options: EncodeOptions) -> bytes:
+    """Encode an image once an encode slot is free (see encode)"""
+    metrics.ENCODE_PENDING.inc()
+    try:
+        with encode_slots:
+            return encode(img, options)
+    finally:
+        metrics.ENCODE_PENDING.dec()
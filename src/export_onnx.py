@@ -0,0 +1,172 @@
+from PIL import Image
+import argparse
+import json
+import os
+import sys
+import time
+
+"""Export models to ONNX graphs for the 'onnx' backend (and check their parity)
+
+Each model is loaded, exported with its declared input and output names and
+then run through both the torch and the onnx backend on fresh images, failing
+when any output differs by more than --atol. Example (from the repository root):
+
+    python src/export_onnx.py --models AlexNet Vit ResNet
+    INFERENCE_BACKEND_ALEXNET=onnx flask --app src/app.py run
+
+Only models with a tensor-in, tensor-out graph (input_names) can be exported.
+"""
+
+
+def sample_images(sizes: list[tuple[int, int]]) -> list[Image.Image]:
+    """Generate deterministic RGB images of the given (width, height) sizes"""
+    return [
+        Image.effect_mandelbrot(size, (-2.0 + i * 0.1, -1.2, 1.0, 1.2), 64).convert(
+            "RGB"
+        )
+        for i, size in enumerate(sizes)
+    ]
+
+
+def graph_inputs(model, imgs: list) -> tuple:
+    """Preprocess images into the graph inputs of a model (copied, the
+    preprocessor reuses its buffers)"""
+    inputs = model.preprocessor(imgs)[: len(model.input_names)]
+    return tuple(x.clone() for x in inputs)
+
+
+def dynamic_shapes(model, inputs: tuple) -> tuple:
+    """The dynamic dimensions of the graph inputs. The batch is always dynamic,
+    the image size only for models that accept variable sized (padded) batches"""
+    from torch.export import Dim
+
+    batch = Dim("batch", min=1, max=1024)
+    height = Dim("height", min=32, max=4096)
+    width = Dim("width", min=32, max=4096)
+
+    shapes = []
+    for x in inputs:
+        shape = {0: batch}
+        if model.input_spec.pad:
+            shape.update({x.dim() - 2: height, x.dim() - 1: width})
+        shapes.append(shape)
+
+    # The graph module takes its inputs as *args
+    return (tuple(shapes),)
+
+
+def export(model, path: str, opset: int) -> None:
+    """Export the loaded model to an ONNX graph"""
+    from models.backends import GraphModule
+    import torch
+
+    inputs = graph_inputs(model, sample_images([(640, 480), (480, 480)]))
+    module = GraphModule(model.model.eval(), model.output_names)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.onnx.export(
+        module,
+        inputs,
+        path,
+        input_names=list(model.input_names),
+        output_names=list(model.output_names),
+        dynamic_shapes=dynamic_shapes(model, inputs),
+        opset_version=opset,
+        dynamo=True,
+    )
+
+
+def check(model, path: str, atol: float) -> dict:
+    """Compare the outputs of the torch and onnx backends on fresh images
+
+    Returns:
+        dict: The largest absolute difference per output and the time per batch
+    """
+    from models.backends import OnnxBackend, TorchBackend
+    from models.optimize import OptimizationProfile
+
+    backends = [
+        TorchBackend(model.model, model.output_names, OptimizationProfile("")),
+        OnnxBackend(path, model.input_names, model.output_names),
+    ]
+
+    sizes = [(800, 600), (320, 480), (500, 500)]
+    if not model.input_spec.pad:
+        sizes = [sizes[0]] * len(sizes)
+    inputs = graph_inputs(model, sample_images(sizes))
+
+    outputs, seconds = [], {}
+    for backend in backends:
+        backend(*inputs)  # warm up
+        started = time.perf_counter()
+        outputs.append(backend(*inputs))
+        seconds[backend.name] = round(time.perf_counter() - started, 4)
+
+    torch_outputs, onnx_outputs = outputs
+    differences = {
+        name: (torch_outputs[name] - onnx_outputs[name]).abs().max().item()
+        for name in model.output_names
+    }
+
+    return {
+        "max_abs_difference": differences,
+        "seconds_per_batch": seconds,
+        "match": all(difference <= atol for difference in differences.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export models to ONNX and check the outputs match torch"
+    )
+    parser.add_argument("--models", nargs="+", default=["AlexNet", "Vit", "ResNet"])
+    parser.add_argument("--model-dir", help="Discover the models in this directory")
+    parser.add_argument("--output-dir", help="Defaults to INFERENCE_ONNX_DIR")
+    parser.add_argument("--opset", type=int, default=18)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--no-check", action="store_true", help="Skip the parity check")
+    parser.add_argument(
+        "--check-only", action="store_true", help="Check previously exported graphs"
+    )
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.environ["INFERENCE_ONNX_DIR"] = args.output_dir
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+    from models.backends import onnx_path
+    from models.registry import discover
+
+    specs = discover(args.model_dir) if args.model_dir else discover()
+    specs = {spec.alias.lower(): spec for spec in specs}
+    report = {}
+
+    for alias in args.models:
+        spec = specs.get(alias.lower())
+        if spec is None:
+            raise SystemExit(f"No model matches the alias '{alias}'")
+
+        model = spec.create()
+        if not model.input_names:
+            print(f"Skipping {spec.alias}, it has no exportable graph")
+            continue
+
+        model.load()
+        path = onnx_path(spec.alias)
+
+        if not args.check_only:
+            export(model, path, args.opset)
+            print(f"Exported {spec.alias} to {path}")
+
+        if not args.no_check:
+            report[spec.alias] = check(model, path, args.atol)
+
+    if report:
+        print(json.dumps(report, indent=4))
+
+    if not all(result["match"] for result in report.values()):
+        raise SystemExit("The onnx outputs do not match torch (see --atol)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from io import BytesIO
+from threading import BoundedSemaphore
+from typing import BinaryIO, Callable
+from PIL import Image, ImageOps
+from PIL.Image import Image as PILImage
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+import asyncio
+import requests
+import time
+import config
+import metrics
+
+"""Pooled, bounded and concurrent downloading of remote (src) images
+
+Images are checked from their header first: while a download is still in
+progress its first bytes are probed, so an unsupported format or an image that
+is too small or has too many pixels (a decompression bomb) is rejected before
+the rest of the body is downloaded or anything is decoded. Decoding then:
+
+    - decodes JPEGs at a reduced scale (draft mode) no smaller than the size the
+      models of the request need, other formats are reduced after decoding
+    - applies the EXIF orientation and converts the image to RGB, once, so later
+      stages receive an upright RGB image
+"""
+
+# Returns the (width, height) an image of a (width, height) is needed at, or
+# None for its full resolution (see lib.decode_size)
+DecodeSize = Callable[[int, int], tuple[int, int] | None]
+
+# The EXIF orientation tag, and the orientations that swap width and height
+ORIENTATION = 0x0112
+TRANSPOSED = (5, 6, 7, 8)
+
+# The WSGI environ key of the src images an (async) server fetched ahead of a
+# request, {url: FetchResult} (see asgi.py)
+PREFETCHED = "inference.prefetched"
+
+
+class FetchError(Exception):
+    """Raised when a src could not be turned into an image"""
+
+    pass
+
+
+class FetchResult:
+    """The outcome of fetching a single src
+
+    Args:
+        url (str): The requested src
+        image (PILImage, optional): The decoded image (None upon error)
+        error (str, optional): Why the src could not be fetched (None upon success)
+        etag (str, optional): The ETag header the origin responded with
+        last_modified (str, optional): The Last-Modified header the origin responded with
+    """
+
+    def __init__(
+        self,
+        url: str,
+        image: PILImage | None = None,
+        error: str | None = None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> None:
+        self.url = url
+        self.image = image
+        self.error = error
+
+        # Response validators (used to revalidate cached results)
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def to_dict(self) -> dict:
+        """Returns the JSON serialisable error report for a failed fetch"""
+        return {"src": self.url, "error": self.error}
+
+
+def iter_received(res: requests.Response, chunk_size: int):
+    """Yield the body of a streamed response as its bytes arrive (up to
+    chunk_size at a time). iter_content() waits for whole chunks, so a
+    trickling body would overrun the total timeout between checks"""
+    read1 = getattr(res.raw, "read1", None)
+    if read1 is None:  # urllib3 < 2
+        yield from res.iter_content(chunk_size=chunk_size)
+        return
+
+    while chunk := read1(chunk_size, decode_content=True):
+        yield chunk
+
+
+class HeaderProbe:
+    """Probes the header of an image as its body downloads. Probing is retried
+    each time the body doubles, until the header is read or probe_bytes have
+    been downloaded (the full decode then has the final word)
+
+    Args:
+        fetcher (ImageFetcher): The fetcher whose limits are checked
+    """
+
+    def __init__(self, fetcher: "ImageFetcher") -> None:
+        self.fetcher = fetcher
+        self.done = fetcher.probe_bytes <= 0
+        self._next = 4096
+
+    def feed(self, body: bytearray) -> None:
+        """Probe the body downloaded so far
+
+        Raises:
+            FetchError: The header shows the image is not accepted
+        """
+        if self.done or len(body) < self._next:
+            return
+
+        self.done = self.fetcher.probe(body) or len(body) >= self.fetcher.probe_bytes
+        self._next = len(body) * 2
+
+
+class ImageFetcher:
+    """Downloads and decodes images through a shared keep-alive connection pool
+
+    Concurrency is capped both per call to fetch_all() and globally across
+    every request served by the process. Every download is bound by connect
+    and read timeouts, a total time budget and a maximum byte size.
+
+    Args:
+        session (requests.Session, optional): The session to use. A pooled
+        session is created when not provided (i.e., override for testing)
+        max_workers (int): Maximum concurrent downloads per fetch_all() call
+        max_concurrent (int): Maximum concurrent downloads for the process
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait between bytes of the response
+        (capped to total_timeout)
+        total_timeout (float): Seconds allowed for a whole download. It is checked
+        as the bytes arrive, so a stalled read can overrun it by up to the read
+        timeout
+        max_bytes (int): The maximum size of a downloaded image
+        min_size (int): The minimum width and height of an image (in pixels)
+        max_pixels (int): The maximum pixels (width x height) of an image
+        formats (list[str]): The accepted image formats (Pillow format names)
+        probe_bytes (int): The bytes inspected for the header of an image before
+        the rest is downloaded (0 disables probing)
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        max_workers: int = config.FETCH_MAX_WORKERS,
+        max_concurrent: int = config.FETCH_MAX_CONCURRENT,
+        connect_timeout: float = config.FETCH_CONNECT_TIMEOUT,
+        read_timeout: float = config.FETCH_READ_TIMEOUT,
+        total_timeout: float = config.FETCH_TOTAL_TIMEOUT,
+        max_bytes: int = config.FETCH_MAX_BYTES,
+        min_size: int = 50,
+        max_pixels: int = config.DECODE_MAX_PIXELS,
+        formats: list[str] = config.DECODE_FORMATS,
+        probe_bytes: int = config.DECODE_PROBE_BYTES,
+    ) -> None:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=max_concurrent, pool_maxsize=max_concurrent
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+        self.session = session
+        self.max_workers = max_workers
+        self.timeout = (connect_timeout, min(read_timeout, total_timeout))
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.max_pixels = max_pixels
+        self.formats = formats
+        self.probe_bytes = probe_bytes
+
+        # The plugins opening the formats (i.e., MPO images open through JPEG)
+        Image.init()
+        self._open_formats = [name for name in formats if name in Image.OPEN]
+
+        self._slots = BoundedSemaphore(max_concurrent)
+
+    def download(self, url: str) -> tuple[bytearray, dict]:
+        """Download the body of a URL within the configured limits
+
+        Args:
+            url (str): The URL to download
+
+        Raises:
+            FetchError: The URL could not be downloaded within the limits
+
+        Returns:
+            tuple[bytearray, dict]: The response body and headers
+        """
+        with self._slots:
+            started = time.monotonic()
+
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout) as res:
+                    res.raise_for_status()
+
+                    length = res.headers.get("Content-Length")
+                    if length is not None and int(length) > self.max_bytes:
+                        raise FetchError(
+                            f"image is larger than {self.max_bytes} bytes"
+                        )
+
+                    body = bytearray()
+                    probe = HeaderProbe(self)
+                    for chunk in iter_received(res, 64 * 1024):
+                        body.extend(chunk)
+                        probe.feed(body)
+
+                        if len(body) > self.max_bytes:
+                            raise FetchError(
+                                f"image is larger than {self.max_bytes} bytes"
+                            )
+                        if time.monotonic() - started > self.total_timeout:
+                            raise FetchError(
+                                f"download took longer than {self.total_timeout}s"
+                            )
+
+                    return body, res.headers
+            except (requests.RequestException, Urllib3Error) as e:
+                raise FetchError(f"download failed ({type(e).__name__})") from e
+
+    def check(self, img: PILImage) -> None:
+        """Check the format and size of an opened (not yet decoded) image
+
+        Raises:
+            FetchError: The format is not accepted, or the image is too small or
+            has too many pixels
+        """
+        if img.format not in self.formats:
+            raise FetchError(f"{img.format} images are not supported")
+
+        if img.width < self.min_size or img.height < self.min_size:
+            raise FetchError(
+                f"image is smaller than {self.min_size}x{self.min_size} pixels"
+            )
+
+        if img.width * img.height > self.max_pixels:
+            raise FetchError(f"image has more than {self.max_pixels} pixels")
+
+    def probe(self, data: bytes | bytearray) -> bool:
+        """Check the header of a partially downloaded image (see check())
+
+        Args:
+            data (bytes | bytearray): The start of the image
+
+        Raises:
+            FetchError: The header shows the image is not accepted
+
+        Returns:
+            bool: Whether the header could be read (False when more bytes are
+            needed, or the bytes are not an image at all)
+        """
+        try:
+            img = Image.open(BytesIO(data))
+        except Image.DecompressionBombError as e:
+            raise FetchError(f"image has more than {self.max_pixels} pixels") from e
+        except Exception:
+            return False
+
+        with img:
+            self.check(img)
+        return True
+
+    def decode(
+        self, data: bytes | bytearray | BinaryIO, size: DecodeSize | None = None
+    ) -> PILImage:
+        """Decode downloaded bytes into an upright RGB image (see the module
+        docs). A (seekable) binary file is decoded in place, without reading it
+        into memory first (i.e., an uploaded file, see uploads.py)
+
+        Args:
+            data (bytes | bytearray | BinaryIO): The encoded image
+            size (DecodeSize, optional): The size the image is needed at (for its
+            upright size). Reduced images keep their full size in
+            info["source_size"] (see models/preprocess.source_size)
+
+        Raises:
+            FetchError: The bytes are not an accepted image, or it is too small or
+            too large
+
+        Returns:
+            PILImage: The decoded image
+        """
+        try:
+            img = Image.open(
+                data if hasattr(data, "read") else BytesIO(data),
+                formats=self._open_formats,
+            )
+        except Image.DecompressionBombError as e:
+            raise FetchError(f"image has more than {self.max_pixels} pixels") from e
+        except Exception as e:
+            raise FetchError("src is not a supported image") from e
+
+        self.check(img)
+
+        try:
+            orientation = img.getexif().get(ORIENTATION, 1)
+            source = img.size[::-1] if orientation in TRANSPOSED else img.size
+            target = size(*source) if size is not None else None
+
+            # The target in the stored (not yet transposed) orientation
+            if target is not None and orientation in TRANSPOSED:
+                target = target[::-1]
+
+            if target is not None and img.format in ("JPEG", "MPO"):
+                img.draft("RGB", target)
+            img.load()
+
+            if target is not None:
+                factor = min(img.width // target[0], img.height // target[1])
+                if factor >= 2:
+                    img = img.reduce(factor)
+
+            if orientation != 1:
+                img = ImageOps.exif_transpose(img)
+
+            if img.mode != "RGB":
+                if img.mode == "P" and "transparency" in img.info:
+                    img = img.convert("RGBA")
+                img = img.convert("RGB")
+        except Exception as e:
+            raise FetchError("src is not a supported image") from e
+
+        if img.size != source:
+            img.info["source_size"] = source
+
+        return img
+
+    def fetch(self, url: str, size: DecodeSize | None = None) -> FetchResult:
+        """Download and decode a single URL, capturing any error
+
+        Args:
+            url (str): The URL to fetch
+            size (DecodeSize, optional): The size the image is needed at (see decode)
+
+        Returns:
+            FetchResult: The image or error for the URL
+        """
+        try:
+            with metrics.Timer(metrics.FETCH_SECONDS, "download"):
+                body, headers = self.download(url)
+
+            with metrics.Timer(metrics.FETCH_SECONDS, "decode"):
+                image = self.decode(body, size)
+
+            return FetchResult(
+                url,
+                image=image,
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified"),
+            )
+        except FetchError as e:
+            return FetchResult(url, error=str(e))
+        except Exception as e:
+            return FetchResult(
+                url, error=f"unable to process src ({type(e).__name__})"
+            )
+
+    def revalidate(
+        self, url: str, etag: str | None, last_modified: str | None
+    ) -> bool:
+        """Check whether a previously fetched URL is unchanged using a
+        conditional request (the body is never downloaded)
+
+        Args:
+            url (str): The URL to revalidate
+            etag (str, optional): The ETag of the previous response
+            last_modified (str, optional): The Last-Modified of the previous response
+
+        Returns:
+            bool: True when the origin responded 304 Not Modified
+        """
+        headers = {}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+        with self._slots, metrics.Timer(metrics.FETCH_SECONDS, "revalidate"):
+            try:
+                with self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                ) as res:
+                    return res.status_code == 304
+            except requests.RequestException:
+                return False
+
+    def fetch_all(
+        self, urls: list[str], size: DecodeSize | None = None
+    ) -> list[FetchResult]:
+        """Concurrently fetch a list of URLs
+
+        Args:
+            urls (list[str]): The URLs to fetch
+            size (DecodeSize, optional): The size the images are needed at
+
+        Returns:
+            list[FetchResult]: One result per URL (in the same order as the input)
+        """
+        if len(urls) <= 1:
+            return [self.fetch(url, size) for url in urls]
+
+        workers = min(self.max_workers, len(urls))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda url: self.fetch(url, size), urls))
+
+
+class AsyncImageFetcher:
+    """Downloads images on an asyncio event loop (through httpx), so a slow src
+    does not hold a thread while it downloads. The limits and decoding are those
+    of an ImageFetcher, images are decoded on a bounded executor
+
+    Args:
+        fetcher (ImageFetcher): The fetcher whose limits (and decoder) are used
+        max_concurrent (int): Maximum concurrent downloads for the process
+        decoder (Executor): The executor images are decoded on
+    """
+
+    def __init__(
+        self, fetcher: "ImageFetcher", max_concurrent: int, decoder: Executor
+    ) -> None:
+        import httpx  # Only required by the async server
+
+        connect_timeout, read_timeout = fetcher.timeout
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            limits=httpx.Limits(max_connections=max_concurrent),
+            follow_redirects=True,
+        )
+        self.fetcher = fetcher
+        self.decoder = decoder
+        self._errors = (httpx.HTTPError, httpx.InvalidURL)
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def _download(self, url: str) -> tuple[bytearray, dict]:
+        async with self.client.stream("GET", url) as res:
+            if res.is_error:  # Reported like the errors of ImageFetcher
+                raise FetchError("download failed (HTTPError)")
+
+            length = res.headers.get("Content-Length")
+            if length is not None and int(length) > self.fetcher.max_bytes:
+                raise FetchError(f"image is larger than {self.fetcher.max_bytes} bytes")
+
+            body = bytearray()
+            probe = HeaderProbe(self.fetcher)
+            async for chunk in res.aiter_bytes(64 * 1024):
+                body.extend(chunk)
+                probe.feed(body)
+
+                if len(body) > self.fetcher.max_bytes:
+                    raise FetchError(
+                        f"image is larger than {self.fetcher.max_bytes} bytes"
+                    )
+
+            return body, res.headers
+
+    async def download(self, url: str) -> tuple[bytearray, dict]:
+        """Download the body of a URL within the limits (see ImageFetcher.download)"""
+        async with self._slots:
+            try:
+                return await asyncio.wait_for(
+                    self._download(url), self.fetcher.total_timeout
+                )
+            except asyncio.TimeoutError as e:
+                raise FetchError(
+                    f"download took longer than {self.fetcher.total_timeout}s"
+                ) from e
+            except self._errors as e:
+                raise FetchError(f"download failed ({type(e).__name__})") from e
+
+    async def fetch(self, url: str, size: DecodeSize | None = None) -> FetchResult:
+        """Download and decode a single URL, capturing any error (see
+        ImageFetcher.fetch)"""
+        loop = asyncio.get_running_loop()
+
+        try:
+            with metrics.Timer(metrics.FETCH_SECONDS, "download"):
+                body, headers = await self.download(url)
+
+            with metrics.Timer(metrics.FETCH_SECONDS, "decode"):
+                image = await loop.run_in_executor(
+                    self.decoder, self.fetcher.decode, body, size
+                )
+
+            return FetchResult(
+                url,
+                image=image,
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified"),
+            )
+        except FetchError as e:
+            return FetchResult(url, error=str(e))
+        except Exception as e:
+            return FetchResult(
+                url, error=f"unable to process src ({type(e).__name__})"
+            )
+
+    async def fetch_all(
+        self, urls: list[str], size: DecodeSize | None = None
+    ) -> dict[str, FetchResult]:
+        """Concurrently fetch a list of URLs (each distinct URL is fetched once)
+
+        Args:
+            urls (list[str]): The URLs to fetch
+            size (DecodeSize, optional): The size the images are needed at
+
+        Returns:
+            dict[str, FetchResult]: The result of each URL
+        """
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.fetch(url, size) for url in urls))
+        return dict(zip(urls, results))
+
+    async def aclose(self) -> None:
+        """Close the connection pool"""
+        await self.client.aclose()
+
+
+# The process wide fetcher (shares its connection pool across requests)
+fetcher = ImageFetcher()
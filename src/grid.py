@@ -0,0 +1,75 @@
+from PIL import Image
+from PIL.Image import Image as PILImage
+from threading import Lock
+import math
+
+"""Composes classified images into a single grid image
+
+The grid canvas is allocated once (as uint8 RGB) and every tile is letterboxed
+into its cell as soon as it is ready, so the memory used is bounded by the
+canvas instead of growing with each image of the grid.
+"""
+
+
+class GridCompositor:
+    """A preallocated grid canvas that tiles can be pasted into (from any thread)
+
+    Args:
+        count (int): The amount of tiles
+        tile_size (int): The width and height of each (square) tile
+        columns (int): The maximum amount of tiles per row
+        padding (int, optional): The space between (and around) the tiles
+        background (tuple, optional): The colour of the padding and letterboxes
+    """
+
+    def __init__(
+        self,
+        count: int,
+        tile_size: int,
+        columns: int,
+        padding: int = 2,
+        background: tuple = (0, 0, 0),
+    ) -> None:
+        self.count = count
+        self.tile_size = tile_size
+        self.columns = max(1, min(columns, count))
+        self.rows = math.ceil(count / self.columns)
+        self.padding = padding
+
+        step = tile_size + padding
+        self.canvas = Image.new(
+            "RGB",
+            (self.columns * step + padding, self.rows * step + padding),
+            background,
+        )
+        self._lock = Lock()
+
+    def cell(self, index: int) -> tuple[int, int]:
+        """The (x, y) position of the top left corner of a tile"""
+        row, column = divmod(index, self.columns)
+        step = self.tile_size + self.padding
+        return column * step + self.padding, row * step + self.padding
+
+    def paste(self, index: int, img: PILImage) -> None:
+        """Letterbox an image (keeping its aspect ratio) into the cell of a tile
+
+        Args:
+            index (int): The index of the tile
+            img (PILImage): The image to paste
+        """
+        scale = min(self.tile_size / img.width, self.tile_size / img.height)
+        size = (
+            max(1, round(img.width * scale)),
+            max(1, round(img.height * scale)),
+        )
+
+        tile = img.resize(size, Image.Resampling.BILINEAR, reducing_gap=3.0)
+        if tile.mode != "RGB":
+            tile = tile.convert("RGB")
+
+        x, y = self.cell(index)
+        x += (self.tile_size - size[0]) // 2
+        y += (self.tile_size - size[1]) // 2
+
+        with self._lock:
+            self.canvas.paste(tile, (x, y))
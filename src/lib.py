@@ -1,18 +1,55 @@
 from typing import Dict
 from PIL import Image
 from PIL.Image import Image as PILImage
-import requests
-from io import BytesIO
-from torchvision.utils import make_grid
-from torchvision.transforms.functional import to_pil_image, to_tensor
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from flask import send_file
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from contextvars import copy_context
+from typing import Iterator
+from flask import Response, g, request
+from encoding import encode_bounded, negotiate
 from models.base import ModelBase
+from models.threads import budget, configure_thread
+from fetch import PREFETCHED, DecodeSize, FetchResult, fetcher
+from cache import image_digest, result_cache, result_key, url_cache
+from grid import GridCompositor
+from uploads import is_uploaded
+from hashlib import sha256
+import admission
+import config
+import metrics
+import queue
+
+# The formats whose response holds results rather than an image
+RESULT_FORMATS = ("json", "text", "ndjson", "raw", "dict")
+
+# The result cache key 'format' of raw (batched) results. model.execute() results
+# are keyed by execute_path(), as they differ for the same format (see classify)
+RAW_PATH = "raw"
+
+
+def execute_path(format: str) -> str:
+    """The result cache key 'format' of a model.execute() result"""
+    return f"execute-{format}"
+
+
+def remember_image_result(key: str, model: ModelBase) -> None:
+    """Record the result an image response of the request serves, its ETag is
+    derived from it (see serve_pil_image)
+
+    Args:
+        key (str): The result cache key of the image
+        model (ModelBase): The model that produced the image
+    """
+    backend = model.backend.name if model.backend is not None else ""
+    g.image_result = f"{key}:{model.profile or ''}:{backend}"
 
 
 # Enables serving a PIL (pillow image) as a endpoint response
-def serve_pil_image(pil_img: Image.Image):
-    """Converts a PIL (pillow) image to a HTTP image/jpeg response
+def serve_pil_image(pil_img: Image.Image) -> Response:
+    """Encodes a PIL (pillow) image as a HTTP image response. The format is
+    negotiated through the 'output' option (jpeg, webp or png) or the Accept
+    header, and 'quality' and 'max_dim' options (query or POST body) are honoured.
+    Repeat requests with a matching If-None-Match are answered with a 304
 
     Args:
         pil_img (Image): The PIL image to convert
@@ -20,26 +57,58 @@ def serve_pil_image(pil_img: Image.Image):
     Returns:
         A HTTP response that serves the image
     """
-    pil_img = pil_img.convert("RGB")
-    img_io = BytesIO()
-    pil_img.save(img_io, "JPEG", quality=70)
-    img_io.seek(0)
-    return send_file(img_io, mimetype="image/jpeg")
+    params = dict(request.args)
+    if request.method == "POST" and isinstance(request.get_json(silent=True), dict):
+        params.update(request.json)
+
+    options = negotiate(
+        params.get("output"),
+        request.accept_mimetypes,
+        params.get("quality"),
+        params.get("max_dim"),
+    )
+
+    headers = {"Vary": "Accept"}
+
+    # Images that are not a (cacheable) model result carry no ETag
+    result = g.get("image_result")
+    if result is not None:
+        etag = options.etag(result)
+        headers["ETag"] = f'"{etag}"'
+
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
 
+    # Only a bounded amount of requests encode at once (see encoding.py)
+    models = g.get("models") or []
+    with metrics.timer(models[0].alias() if models else "", "encode"):
+        data = encode_bounded(pil_img, options)
+    headers["Content-Length"] = str(len(data))
 
-def execute_with_threadpool(lst: list, fn, *args):
-    with ThreadPoolExecutor(max_workers=16) as executor:
+    return Response(data, mimetype=options.mimetype, headers=headers)
+
+
+def execute_with_threadpool(lst: list, fn, *args, max_workers: int = 16):
+    """Runs fn over each item of a list using a threadpool. Each call runs in a
+    copy of the callers context (i.e., it sees the deadline of the request)
+
+    Args:
+        lst (list): The items to run fn over
+        fn (Callable): The function to run (called with an item and *args)
+        max_workers (int, optional): The size of the threadpool. Pools calling
+        into a model are sized with budget.fanout() (see models/threads.py)
+
+    Returns:
+        list: The results (in the same order as the input list)
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = []
-        results = []
 
         # Create futures and execute
         for item in lst:
-            futures.append(executor.submit(fn, item, *args))
-
-        for future in as_completed(futures):
-            results.append(future.result())
+            futures.append(executor.submit(copy_context().run, fn, item, *args))
 
-        return results
+        return [future.result() for future in futures]
 
 
 def get_image(url: str) -> PILImage | None:
@@ -51,40 +120,175 @@ def get_image(url: str) -> PILImage | None:
     Returns:
         Image: A PIL image (or None upon error)
     """
+    result = fetcher.fetch(url)
 
-    min_height = 50
-    min_width = 50
+    if result.error is not None:
+        print(f"Unable to process URL into image [{url}]: {result.error}")
 
-    try:
-        # Stole this from many hugging face examples
-        img = Image.open(requests.get(url, stream=True).raw)
+    return result.image
+
+
+def decode_size(models: list[ModelBase], format: str) -> DecodeSize | None:
+    """The size the src images of a request are decoded at (see fetch.py), the
+    largest input of its models. Responses holding an image, and models that
+    need the full resolution, decode src images at their full size
+
+    Args:
+        models (list[ModelBase]): The models of the request
+        format (str): The output format of the request
 
-        if img.width < min_width or img.height < min_height:
-            return None
+    Returns:
+        DecodeSize | None: The size (None for the full resolution)
+    """
+    if not config.DECODE_DRAFT or format not in RESULT_FORMATS:
+        return None
 
-        return img
-    except:
-        print(f"Unable to process URL into image [{url}]")
+    if any(model.input_spec is None for model in models):
         return None
 
+    def size(width: int, height: int) -> tuple[int, int]:
+        sizes = [model.input_size(width, height) for model in models]
+        return max(w for w, _ in sizes), max(h for _, h in sizes)
+
+    return size
+
+
+def fetch_images(
+    urls: list[str], size: DecodeSize | None = None
+) -> list[FetchResult]:
+    """Concurrently convert a list of URLs into PIL Images
+
+    Args:
+        urls (list[str]): The URLs to convert
+        size (DecodeSize, optional): The size the images are needed at (see
+        decode_size)
+
+    Returns:
+        list[FetchResult]: The image or error for each URL (in input order)
+    """
+    # The async server downloads the src images before handing the request over
+    prefetched = request.environ.get(PREFETCHED, {})
+    missing = [url for url in urls if url not in prefetched]
+    fetched = iter(fetcher.fetch_all(missing, size))
+    results = [
+        prefetched[url] if url in prefetched else next(fetched) for url in urls
+    ]
+
+    for result in results:
+        remember_source(result)
+
+    return results
+
+
+def remember_source(result: FetchResult) -> None:
+    """Remember the digest of a fetched image for later revalidation (uploaded
+    images have no origin to revalidate with)"""
+    if (
+        url_cache.max_entries > 0
+        and result.image is not None
+        and not is_uploaded(result.url)
+    ):
+        url_cache.put(
+            result.url,
+            image_digest(result.image),
+            result.etag,
+            result.last_modified,
+        )
+
+
+def lookup_sources(
+    urls: list[str],
+    model: ModelBase,
+    format: str,
+    options: dict | None = None,
+    raw: bool = False,
+) -> dict:
+    """Find the src URLs whose result is already cached and whose image has not
+    changed since it was fetched (revalidated through ETag/Last-Modified)
+
+    Args:
+        urls (list[str]): The src URLs
+        model (ModelBase): The model the results are for
+        format (str): The output format of the results
+        options (dict, optional): The model options of the request
+        raw (bool, optional): Look up raw results (see classify_group) rather than
+        model.execute() results (see classify)
+
+    Returns:
+        dict: The cached results keyed by the index of their URL
+    """
+    path = RAW_PATH if raw else execute_path(format)
+    candidates = {}
+
+    for i, url in enumerate(urls):
+        entry = url_cache.get(url)
+        if entry is None:
+            continue
+
+        digest, etag, last_modified = entry
+        key = result_key(digest, model.alias(), path, options)
+
+        if result_cache.contains(key):
+            candidates[i] = (key, url, etag, last_modified)
+
+    if not candidates:
+        return {}
+
+    def revalidate(candidate):
+        key, url, etag, last_modified = candidate
+        not_modified = fetcher.revalidate(url, etag, last_modified)
+        url_cache.record(not_modified)
+        return result_cache.get(key) if not_modified else None
+
+    results = execute_with_threadpool(
+        list(candidates.values()), revalidate, max_workers=fetcher.max_workers
+    )
+    cached = dict(zip(candidates.keys(), results))
+
+    if format not in RESULT_FORMATS:
+        for i, result in cached.items():
+            if result is not None:
+                remember_image_result(candidates[i][0], model)
+
+    return {i: result for i, result in cached.items() if result is not None}
 
-def classify(img: PILImage, model: ModelBase, format: str) -> PILImage | list | str:
+
+def classify(
+    img: PILImage, model: ModelBase, format: str, options: dict | None = None
+) -> PILImage | list | str:
     """Wrapper function to run a classification and output to a specified type
 
     Args:
         img (PILImage): The PIL image to classify
         format (Literal[&quot;default&quot;, &quot;json&quot;]):
         The format to return to
+        options (dict, optional): The model options of the request
 
     Returns:
         PILImage | Dict: An image or dict depending on format parameter
     """
-    # Check if there is a model available which matches the query
-    return model.execute("classify", img, format)
+    # Results are cached by image content (concurrent duplicates share one run)
+    key = result_key(image_digest(img), model.alias(), execute_path(format), options)
+    if format not in RESULT_FORMATS:
+        remember_image_result(key, model)
+
+    def compute():
+        # Requests with model options skip the micro-batching scheduler
+        if options and format == "text":
+            return model.classify_batch_raw([img], **options)[0]
+        return model.execute("classify", img, format)
+
+    return result_cache.get_or_compute(key, compute)
 
 
 def classify_group(
-    imgs: list[PILImage], model: ModelBase, format: str
+    imgs: list[PILImage],
+    model: ModelBase,
+    format: str,
+    srcs: list[str] | None = None,
+    tile_size: int | None = None,
+    columns: int | None = None,
+    options: dict | None = None,
 ) -> PILImage | Dict | list:
     """Wrapper function to run a classification on a group of images and output
     to a specified type. See classify() for similar functionality
@@ -92,6 +296,10 @@ def classify_group(
     Args:
         imgs (List[PILImage]): The list of images to classify
         format (Literal[&quot;default&quot;, &quot;json&quot;]): The output format
+        srcs (list[str], optional): The source of each image, used to key json results
+        tile_size (int, optional): The grid tile size (see grid_images)
+        columns (int, optional): The grid column count (see grid_images)
+        options (dict, optional): The model options of the request (json only)
 
     Returns:
         PILImage | Dict: _description_
@@ -99,49 +307,283 @@ def classify_group(
 
     match format:
         case "json":
-            return execute_with_threadpool(imgs, model.classify_image_raw)
+            # Only the images without a cached result are run through the model
+            keys = [
+                result_key(image_digest(img), model.alias(), RAW_PATH, options)
+                for img in imgs
+            ]
+            results = result_cache.get_or_compute_many(
+                keys,
+                lambda missing: classify_batch(
+                    [imgs[i] for i in missing], model, options
+                ),
+            )
+
+            if srcs is None:
+                return results
+
+            return [{"src": src, "result": result} for src, result in zip(srcs, results)]
         case _:
-            return grid_images(imgs, model)
+            hasher = sha256()
+            for img in imgs:
+                hasher.update(image_digest(img).encode())
+
+            tile_size = tile_size or config.GRID_TILE_SIZE
+            columns = columns or config.GRID_COLUMNS
+
+            key = result_key(
+                hasher.hexdigest(), model.alias(), f"grid-{format}-{tile_size}-{columns}"
+            )
+            remember_image_result(key, model)
+
+            # Grid canvases are too large to keep (up to hundreds of MB), identical
+            # concurrent requests still share a single composition
+            return result_cache.get_or_compute(
+                key, lambda: grid_images(imgs, model, tile_size, columns), store=False
+            )
+
 
+def classify_stream(
+    urls: list[str], model: ModelBase, options: dict | None = None
+) -> Iterator[dict]:
+    """Fetch and classify a list of URLs, yielding the json result of each
+    image as soon as it is available (in completion order, not input order)
 
-def grid_images(imgs: list[PILImage], model: ModelBase) -> PILImage:
+    Fetching and inference are pipelined: each image is handed to the model as
+    soon as its download finishes (so concurrent images share micro-batches)
+    while the remaining URLs are still downloading
+
+    Args:
+        urls (list[str]): The src URLs
+        model (ModelBase): The model to classify with
+        options (dict, optional): The model options of the request
+
+    Yields:
+        dict: The 'index' and 'src' of an image with its 'result' (or 'error')
+    """
+    # Unchanged src images with a cached result are answered straight away
+    cached = lookup_sources(urls, model, "json", options, raw=True)
+    for i, result in cached.items():
+        yield {"index": i, "src": urls[i], "result": result}
+
+    pending = [i for i in range(len(urls)) if i not in cached]
+    if not pending:
+        return
+
+    lines: queue.Queue = queue.Queue()
+    context = copy_context()  # Carries the deadline of the request to the workers
+    workers = budget.fanout(model)
+
+    fetch_pool = ThreadPoolExecutor(max_workers=min(fetcher.max_workers, len(pending)))
+    infer_pool = ThreadPoolExecutor(max_workers=min(workers, len(pending)))
+
+    def infer(i: int, img: PILImage) -> None:
+        try:
+            key = result_key(image_digest(img), model.alias(), RAW_PATH, options)
+            result = result_cache.get_or_compute(
+                key,
+                lambda: model.classify_batch_raw([img], **options)[0]
+                if options
+                else model.infer_raw(img),
+            )
+            lines.put({"index": i, "src": urls[i], "result": result})
+        except Exception as e:
+            lines.put({"index": i, "src": urls[i], "error": str(e)})
+
+    def fetched(i: int, future: Future) -> None:
+        if future.cancelled():
+            return
+
+        result = future.result()
+        if result.image is None:
+            lines.put({"index": i, "src": urls[i], "error": result.error})
+            return
+
+        remember_source(result)
+        try:
+            infer_pool.submit(context.copy().run, infer, i, result.image)
+        except RuntimeError:
+            pass  # The stream was closed (the pool is shut down)
+
+    # Uploaded (and prefetched) images are not downloaded again
+    prefetched = request.environ.get(PREFETCHED, {})
+
+    size = decode_size([model], "ndjson")
+
+    def fetch(url: str) -> FetchResult:
+        return prefetched[url] if url in prefetched else fetcher.fetch(url, size)
+
+    try:
+        for i in pending:
+            future = fetch_pool.submit(fetch, urls[i])
+            future.add_done_callback(lambda future, i=i: fetched(i, future))
+
+        for _ in pending:
+            yield lines.get()
+    finally:
+        # Stop outstanding work when the client goes away mid-stream
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        infer_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def caption_stream(
+    urls: list[str], model: ModelBase, options: dict | None = None
+) -> Iterator[tuple[str, dict]]:
+    """Caption a list of URLs (in order), yielding each token as it is generated
+
+    Args:
+        urls (list[str]): The src URLs (downloaded concurrently up front)
+        model (ModelBase): A captioning model (with a stream_caption method)
+        options (dict, optional): The decoding options of the request
+
+    Yields:
+        tuple[str, dict]: The event ('token', 'done' or 'error') and its data
+        (closing the iterator stops the caption being generated)
+    """
+    for i, fetched in enumerate(fetch_images(urls)):
+        if fetched.image is None:
+            yield "error", {"index": i, "src": fetched.url, "error": fetched.error}
+            continue
+
+        text = ""
+        try:
+            admission.check_deadline("model", model.alias())
+            tokens = model.stream_caption(fetched.image, **(options or {}))
+            with closing(tokens):
+                for token in tokens:
+                    text += token
+                    yield "token", {"index": i, "text": token}
+        except Exception as e:
+            yield "error", {"index": i, "src": fetched.url, "error": str(e)}
+            continue
+
+        yield "done", {"index": i, "src": fetched.url, "result": {"msg": text.strip()}}
+
+
+def classify_models(
+    imgs: list[PILImage],
+    models: list[ModelBase],
+    format: str,
+    options: dict[str, dict] | None = None,
+) -> list[dict]:
+    """Runs several models over the same (fetched and decoded once) images. The
+    models run concurrently, each over every image ('json' results go through
+    classify_group, so each model batches and caches them as usual)
+
+    Args:
+        imgs (list[PILImage]): The images to classify
+        models (list[ModelBase]): The models to classify with
+        format (str): The output format of the results ('json' or 'text')
+        options (dict[str, dict], optional): The model options keyed by model alias
+
+    Returns:
+        list[dict]: The results of each image keyed by model alias (in input order)
+    """
+    options = options or {}
+
+    def run(model: ModelBase) -> list:
+        model_options = options.get(model.alias())
+        if format == "json":
+            return classify_group(imgs, model, format, options=model_options)
+        return [classify(img, model, format, model_options) for img in imgs]
+
+    results = execute_with_threadpool(models, run, max_workers=len(models) or 1)
+
+    return [
+        {model.alias(): results[j][i] for j, model in enumerate(models)}
+        for i in range(len(imgs))
+    ]
+
+
+def classify_batch(
+    imgs: list[PILImage], model: ModelBase, options: dict | None = None
+) -> list:
+    """Runs raw classification over a list of images, using batched forward
+    passes (chunked to the models batch size) when the model supports it
+
+    Args:
+        imgs (list[PILImage]): The images to classify
+        model (ModelBase): The model to classify with
+        options (dict, optional): The model options of the request
+
+    Returns:
+        list: The raw results (in the same order as the input images)
+    """
+    options = options or {}
+
+    if not model.supports_batching():
+
+        def classify_image(img: PILImage):
+            admission.check_deadline("model", model.alias())
+            configure_thread(model.threads)
+            return model.classify_image_raw(img)
+
+        return execute_with_threadpool(
+            imgs, classify_image, max_workers=budget.fanout(model)
+        )
+
+    chunk_size = (
+        model.scheduler.max_batch_size
+        if model.scheduler is not None
+        else len(imgs) or 1
+    )
+
+    configure_thread(model.threads)
+
+    results = []
+    for i in range(0, len(imgs), chunk_size):
+        admission.check_deadline("model", model.alias())
+        chunk = imgs[i : i + chunk_size]
+        metrics.BATCH_SIZE.observe(len(chunk), model.alias())
+        results.extend(model.classify_batch_raw(chunk, **options))
+
+    return results
+
+
+def grid_images(
+    imgs: list[PILImage],
+    model: ModelBase,
+    tile_size: int | None = None,
+    columns: int | None = None,
+) -> PILImage | str:
     """Generates a singular grid image from a list of PIL images
     Note: These images have been evaluated and classified using the
     CNN Classifier
 
+    Each image is classified (concurrently) and letterboxed into its tile of a
+    preallocated canvas as soon as it is ready, so only the canvas and the
+    images in flight are held in memory
+
     Args:
         imgs (list[Image]): The list of images to evaluate
+        model (ModelBase): The model to classify with
+        tile_size (int, optional): The size of each tile (defaults to GRID_TILE_SIZE)
+        columns (int, optional): The tiles per row (defaults to GRID_COLUMNS)
 
     Returns:
         A gridded and evaluated PIL Image
     """
+    compositor = GridCompositor(
+        len(imgs), tile_size or config.GRID_TILE_SIZE, columns or config.GRID_COLUMNS
+    )
 
-    # Set the square (1:1 aspect ratio) for all images
-    SQUARE_DIMENSIONS = 1024
-
-    # Loop through and classify each image
-    classified_imgs = []
-
-    for pil_img in imgs:
-        # Classify the resized image (returning the img tensor)
-        img = model.classify_image(pil_img)
-
+    def annotate(index: int) -> bool:
+        img = model.classify_image(imgs[index])
         if img is None:
-            return "No Image classification has been defined for this model. Try setting 'format' to 'json'"
-
-        # Resize the images to all be the same
-        # NOTE: This will stretch and malform the images
-        # Required as all image sizes are to be the same
-        # A better method would be to add border (... future implementation)
-        resized = img.resize(size=(SQUARE_DIMENSIONS, SQUARE_DIMENSIONS))
+            return False
 
-        classified_imgs.append(to_tensor(resized))
+        with model.timed("grid"):
+            compositor.paste(index, img)
+        return True
 
-    # Generate the grid from the tensor data
-    grid = make_grid(classified_imgs)
+    indexes = list(range(len(imgs)))
+    annotated = execute_with_threadpool(
+        indexes, annotate, max_workers=budget.fanout(model)
+    )
+    if not all(annotated):
+        return "No Image classification has been defined for this model. Try setting 'format' to 'json'"
 
-    # Convert back to a PIL Image
-    return to_pil_image(grid)
+    return compositor.canvas
 
 
 ##########
@@ -0,0 +1,292 @@
+from bisect import bisect_left
+from threading import Lock
+import time
+
+"""Low overhead Prometheus metrics (counters, gauges and histograms)
+
+Every stage of a request is timed into a histogram labelled by model and stage:
+
+    queue        Waiting in the micro-batching queue of a model
+    preprocess   Converting images into model inputs
+    forward      The forward pass (or generation/recognition) of a model
+    postprocess  Turning model outputs into results
+    annotate     Drawing results onto an image (image responses)
+    grid         Composing a grid image (POST image responses)
+    encode       Encoding an image response (including waiting for an encoder)
+
+The model independent download and decoding of src images are timed separately.
+Recording a sample is a perf_counter() call and a (locked) bucket increment, so
+the instrumentation is cheap enough to always leave on. The metrics are served
+in the Prometheus text format at /metrics.
+"""
+
+# Request and stage latencies, from a millisecond up to a minute (in seconds)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# The WSGI environ key of the perf_counter() a request was received at, set by
+# servers that do work before handing a request to the app (see asgi.py)
+RECEIVED = "inference.received"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A metric family with a fixed set of label names. Samples are keyed by
+    their label values, which are passed positionally (in label name order)
+
+    Args:
+        name (str): The metric name
+        documentation (str): The help text of the metric
+        labels (tuple, optional): The label names
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple, float] = {}
+        self._lock = Lock()
+
+    def samples(self) -> list[str]:
+        """The exposition lines of the samples of the metric"""
+        with self._lock:
+            values = list(self._values.items())
+
+        return [
+            f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+    def expose(self) -> str:
+        """The metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A monotonically increasing count (i.e., requests served)"""
+
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down (i.e., requests in flight)"""
+
+    type = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """Counts observations (i.e., latencies) into cumulative buckets
+
+    Args:
+        name (str): The metric name
+        documentation (str): The help text of the metric
+        labels (tuple, optional): The label names
+        buckets (tuple, optional): The (sorted) upper bounds of the buckets
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+        # Label values -> [count per bucket (the last is +Inf), sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            series = [
+                (labels, list(counts), total, count)
+                for labels, (counts, total, count) in self._series.items()
+            ]
+
+        lines = []
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_format_labels(self.labels, labels, le)} {cumulative}"
+                )
+
+            suffix = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+
+        return lines
+
+
+class Timer:
+    """Times a block into a histogram (as a context manager)
+
+    Args:
+        histogram (Histogram): The histogram to observe the duration in
+        *labels (str): The label values of the observation
+    """
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, *labels) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    """The metrics exposed at /metrics"""
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self, extra: list[Metric] | None = None) -> str:
+        """Render every metric in the Prometheus text format
+
+        Args:
+            extra (list[Metric], optional): Metrics collected at scrape time
+
+        Returns:
+            str: The exposition
+        """
+        return "".join(metric.expose() for metric in self.metrics + (extra or []))
+
+
+# The process wide registry and metrics
+registry = Registry()
+
+STAGE_SECONDS = registry.register(
+    Histogram(
+        "inference_stage_seconds",
+        "Time spent in each stage of handling an image",
+        ("model", "stage"),
+    )
+)
+FETCH_SECONDS = registry.register(
+    Histogram(
+        "inference_fetch_seconds",
+        "Time spent downloading, decoding and revalidating src images",
+        ("stage",),
+    )
+)
+REQUEST_SECONDS = registry.register(
+    Histogram(
+        "inference_request_seconds",
+        "Request latency (streamed responses until their last line)",
+        ("endpoint", "model", "status"),
+    )
+)
+REQUESTS_IN_FLIGHT = registry.register(
+    Gauge(
+        "inference_requests_in_flight",
+        "Requests currently being handled",
+        ("endpoint",),
+    )
+)
+BATCH_SIZE = registry.register(
+    Histogram(
+        "inference_batch_size",
+        "Images per batched model call",
+        ("model",),
+        buckets=BATCH_SIZE_BUCKETS,
+    )
+)
+ENCODE_PENDING = registry.register(
+    Gauge(
+        "inference_encode_pending",
+        "Image responses waiting for or being encoded",
+    )
+)
+ADMISSION_REJECTED = registry.register(
+    Counter(
+        "inference_admission_rejected_total",
+        "Requests rejected with a 429 because the wait queue of a model was full",
+        ("model",),
+    )
+)
+DEADLINE_DROPPED = registry.register(
+    Counter(
+        "inference_deadline_dropped_total",
+        "Work dropped because its request deadline had passed",
+        ("model", "stage"),
+    )
+)
+
+
+def timer(model: str, stage: str) -> Timer:
+    """Time a stage of a model (see the module docs for the stages)
+
+    Example:
+        with metrics.timer("ResNet", "preprocess"):
+            ...
+    """
+    return Timer(STAGE_SECONDS, model, stage)
@@ -0,0 +1,68 @@
+from functools import cache
+from PIL import ImageDraw, ImageFont
+from PIL.Image import Image as PILImage
+import os
+
+"""Renders detection boxes and labels onto images (shared by the models)"""
+
+# The label font shipped at the root of the repository
+FONT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    "Poppins-Medium.ttf",
+)
+
+
+@cache
+def font(size: int) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    """Returns the label font at a size (each size is only loaded once)"""
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except OSError:
+        print(f"Unable to load the label font [{FONT_PATH}], using the default")
+        return ImageFont.load_default(size)
+
+
+def scaled(img: PILImage, ratio: float, minimum: int) -> int:
+    """Scale a length to the size of an image (relative to its longer side)"""
+    return max(minimum, round(max(img.size) * ratio))
+
+
+def draw_boxes(
+    img: PILImage,
+    boxes: list[list[float]],
+    labels: list[str] | None = None,
+    color: tuple = (255, 0, 0),
+) -> PILImage:
+    """Draw boxes (and their labels) onto a copy of an image in a single pass.
+    The outline and text sizes scale with the image (32px text on a 1280px image)
+
+    Args:
+        img (PILImage): The image to annotate (left unchanged)
+        boxes (list[list[float]]): The [x0, y0, x1, y1] boxes to draw
+        labels (list[str], optional): The label of each box
+        color (tuple, optional): The RGB colour of the boxes and labels
+
+    Returns:
+        PILImage: The annotated copy of the image
+    """
+    annotated = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    if not boxes:
+        return annotated
+
+    draw = ImageDraw.Draw(annotated)
+    width = scaled(img, 1 / 640, 1)
+    padding = scaled(img, 1 / 320, 2)
+    label_font = font(scaled(img, 1 / 40, 10)) if labels else None
+
+    for i, box in enumerate(boxes):
+        draw.rectangle(box, outline=color, width=width)
+
+        if label_font is not None and labels[i]:
+            draw.text(
+                (box[0] + padding, box[1] + padding),
+                labels[i],
+                font=label_font,
+                fill=color,
+            )
+
+    return annotated
@@ -0,0 +1,207 @@
+from models.optimize import OptimizationProfile, configure_threads
+import os
+import torch
+import config
+
+"""Execution backends that run the forward pass of a model
+
+A model declares the names of its graph inputs and outputs (input_names and
+output_names on ModelBase) and shares its pre- and post-processing across the
+backends, which only map input tensors to output tensors:
+
+    torch   Eager PyTorch (with the models optimisation profile)
+    onnx    ONNX Runtime on the CPU execution provider, running a graph exported
+            offline with src/export_onnx.py
+
+The backend is configured globally through INFERENCE_BACKEND or per model
+(i.e., INFERENCE_BACKEND_ALEXNET=onnx).
+"""
+
+BACKENDS = ("torch", "onnx")
+
+# The default directory exported graphs are written to and loaded from
+DEFAULT_ONNX_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+    "onnx",
+)
+
+
+def onnx_path(alias: str) -> str:
+    """The path of the exported ONNX graph of a model"""
+    return os.path.join(config.ONNX_DIR or DEFAULT_ONNX_DIR, f"{alias.lower()}.onnx")
+
+
+def select_outputs(outputs, names: tuple) -> tuple:
+    """Returns the named output tensors of a forward pass as a tuple
+
+    Args:
+        outputs (any): A tensor, a tuple of tensors or a mapping of outputs
+        (i.e., a transformers ModelOutput)
+        names (tuple[str]): The output names, in order
+
+    Returns:
+        tuple[Tensor]: The output tensors
+    """
+    if isinstance(outputs, torch.Tensor):
+        return (outputs,)
+
+    if hasattr(outputs, "keys"):
+        return tuple(outputs[name] for name in names)
+
+    return tuple(outputs)[: len(names)]
+
+
+class GraphModule(torch.nn.Module):
+    """Wraps a model so its forward pass returns a tuple of tensors (as required
+    to export it)
+
+    Args:
+        module (torch.nn.Module): The model
+        output_names (tuple[str]): The outputs to return, in order
+    """
+
+    def __init__(self, module: torch.nn.Module, output_names: tuple) -> None:
+        super().__init__()
+        self.module = module
+        self.output_names = output_names
+
+    def forward(self, *inputs):
+        return select_outputs(self.module(*inputs), self.output_names)
+
+
+class TorchBackend:
+    """Runs the forward pass with eager PyTorch
+
+    Args:
+        module (torch.nn.Module): The (optimised) model
+        output_names (tuple[str]): The names of the outputs to return
+        profile (OptimizationProfile): The profile the module was optimised with
+    """
+
+    name = "torch"
+
+    def __init__(
+        self, module, output_names: tuple, profile: OptimizationProfile
+    ) -> None:
+        self.module = module
+        self.output_names = output_names
+        self.profile = profile
+
+    def __call__(self, *inputs: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Run the forward pass
+
+        Args:
+            *inputs (Tensor): The input tensors (in input_names order)
+
+        Returns:
+            dict[str, Tensor]: The float32 output tensors by name
+        """
+        with self.profile.context():
+            outputs = self.module(*(self.profile.prepare(x) for x in inputs))
+
+        outputs = select_outputs(outputs, self.output_names)
+        return {
+            name: output.float() for name, output in zip(self.output_names, outputs)
+        }
+
+    def generate(self, pixel_values: torch.Tensor, **kwargs) -> torch.Tensor:
+        """Run generate() of an encoder-decoder module (the captioning models)
+
+        Args:
+            pixel_values (Tensor): The preprocessed images
+            **kwargs: The generate() arguments
+
+        Returns:
+            Tensor: The generated token ids
+        """
+        with self.profile.context():
+            return self.module.generate(
+                pixel_values=self.profile.prepare(pixel_values), **kwargs
+            )
+
+
+class OnnxBackend:
+    """Runs the forward pass with ONNX Runtime on the CPU execution provider
+
+    Args:
+        path (str): The path of the exported graph
+        input_names (tuple[str]): The names of the graph inputs
+        output_names (tuple[str]): The names of the graph outputs
+        threads (int, optional): The intra-op threads of the session
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        path: str,
+        input_names: tuple,
+        output_names: tuple,
+        threads: int | None = None,
+    ) -> None:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(
+                "The 'onnx' backend requires onnxruntime (pip install onnxruntime)"
+            ) from e
+
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f"No ONNX graph at '{path}', export it with src/export_onnx.py"
+            )
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        if config.INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = config.INTER_OP_THREADS
+
+        self.path = path
+        self.input_names = input_names
+        self.output_names = output_names
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, *inputs: torch.Tensor) -> dict[str, torch.Tensor]:
+        """Run the forward pass (see TorchBackend.__call__)"""
+        feeds = {
+            name: x.contiguous().numpy() for name, x in zip(self.input_names, inputs)
+        }
+        outputs = self.session.run(list(self.output_names), feeds)
+
+        return {
+            name: torch.from_numpy(output)
+            for name, output in zip(self.output_names, outputs)
+        }
+
+
+def create_backend(model, name: str | None = None) -> TorchBackend | OnnxBackend:
+    """Create the configured backend for a loaded model
+
+    Args:
+        model (ModelBase): The loaded model
+        name (str, optional): The backend to use (defaults to the configured one)
+
+    Returns:
+        TorchBackend | OnnxBackend: The backend
+    """
+    alias = model.alias()
+    name = name or config.model_option("BACKEND", alias, config.BACKEND)
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of {BACKENDS}")
+
+    if name == "onnx":
+        if not model.input_names:
+            raise ValueError(f"{alias} does not support the 'onnx' backend")
+        return OnnxBackend(
+            onnx_path(alias), model.input_names, model.output_names, model.threads
+        )
+
+    configure_threads()
+    model.profile = OptimizationProfile.for_model(alias)
+    model.model = model.profile.apply(model.model, model.example_inputs())
+
+    return TorchBackend(model.model, model.output_names, model.profile)
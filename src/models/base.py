@@ -1,6 +1,10 @@
 from abc import ABC, abstractmethod
 from PIL.Image import Image
 from typing import Dict
+from models.threads import configure_thread
+import admission
+import metrics
+import profiling
 
 """Available model modules for use within the inference api"""
 
@@ -14,6 +18,28 @@ class ModelBase(ABC):
         ABC (Abstract Base Class): The abstract base class python identifier (... just ignore)
     """
 
+    # Optional micro-batching scheduler placed in front of classify_image_raw.
+    # Attached by the ModelController for models that implement classify_batch_raw
+    scheduler = None
+
+    # The CPU optimisation profile applied to the model (see models/optimize.py)
+    profile = None
+
+    # The input of vision models using the shared preprocessing (see
+    # models/preprocess.py). Src images are decoded no larger than it needs
+    input_spec = None
+
+    # The backend running the forward pass of the model (see models/backends.py).
+    # Models with a tensor-in, tensor-out graph declare its input and output names
+    input_names: tuple = ()
+    output_names: tuple = ("logits",)
+    backend = None
+
+    # The intra-op threads and cores of the model (see models/threads.py).
+    # Assigned by the ModelController when the model is created
+    threads: int | None = None
+    cpus: list[int] | None = None
+
     @property
     @abstractmethod
     def alias(self) -> str:
@@ -52,7 +78,7 @@ class ModelBase(ABC):
         match mode:
             case "classify":
                 if format == "text":
-                    return self.classify_image_raw(img)
+                    return self.infer_raw(img)
 
                 if format == "image":
                     # Get the data from the image
@@ -68,6 +94,59 @@ class ModelBase(ABC):
         """Load the model, and any other preprocess information"""
         pass
 
+    def close(self) -> None:
+        """Release what load() started that is not freed with the models
+        attributes (i.e., threads or native handles). Called by the
+        ModelController before it unloads the model"""
+        pass
+
+    def example_inputs(self) -> tuple | None:
+        """Example inputs for self.model, used to trace it with TorchScript
+
+        Returns:
+            tuple | None: The example inputs (None if the model cannot be traced)
+        """
+        return None
+
+    def optimize(self) -> None:
+        """Create the configured backend for the loaded model, applying the
+        optimisation profile to self.model. Called by the ModelController after load()
+        """
+        if getattr(self, "model", None) is None:
+            return
+
+        from models.backends import create_backend
+
+        self.backend = create_backend(self)
+
+    def forward(self, *inputs):
+        """Run the forward pass of the model on its backend
+
+        Args:
+            *inputs (Tensor): The input tensors (in input_names order)
+
+        Returns:
+            dict[str, Tensor]: The output tensors by name (see output_names)
+        """
+        if self.backend is None:
+            self.optimize()
+
+        with self.timed("forward"):
+            return self.backend(*inputs)
+
+    def timed(self, stage: str) -> metrics.Timer:
+        """Time a stage of the model, i.e. 'preprocess' (see metrics.py)"""
+        return metrics.timer(self.alias(), stage)
+
+    def inference_context(self):
+        """The context to run the forward pass in (see models/optimize.py)"""
+        if self.profile is None:
+            from models.optimize import OptimizationProfile
+
+            self.profile = OptimizationProfile()
+
+        return self.profile.context()
+
     @abstractmethod
     def classify_image(self, img: Image) -> Image:
         """Classify an image using the model
@@ -93,3 +172,76 @@ class ModelBase(ABC):
         """
         return None
         return "No raw classification has been defined for this model. Try setting 'format' to 'img'"
+
+    def classify_batch_raw(self, imgs: list[Image]) -> list:
+        """Classify a batch of images and return raw/text data.
+        Models that can run a batched forward pass should override this,
+        the default implementation classifies each image in turn
+
+        Args:
+            imgs (list[Image]): The images to classify
+
+        Returns:
+            list: One classify_image_raw() style result per image (in input order)
+        """
+        return [self.classify_image_raw(img) for img in imgs]
+
+    def request_options(self, params: dict) -> dict:
+        """Read the model specific options of a request (i.e., decoding settings).
+        Models with options accept them as keyword arguments of classify_batch_raw
+
+        Args:
+            params (dict): The request parameters (query or POST body)
+
+        Returns:
+            dict: The options (empty when the request uses the defaults)
+        """
+        return {}
+
+    def input_size(self, width: int, height: int) -> tuple[int, int] | None:
+        """The (width, height) an image is resized to before the forward pass
+
+        Args:
+            width (int): The width of the image
+            height (int): The height of the image
+
+        Returns:
+            tuple[int, int] | None: The size (None when the model needs the full
+            resolution, i.e., it does not declare an input_spec)
+        """
+        if self.input_spec is None:
+            return None
+
+        height, width = self.input_spec.resized_size(height, width)
+        return width, height
+
+    def supports_batching(self) -> bool:
+        """Whether the model overrides classify_batch_raw with a batched implementation"""
+        return type(self).classify_batch_raw is not ModelBase.classify_batch_raw
+
+    def infer_raw(self, img: Image):
+        """Classify a single image, going through the batching scheduler
+        (when one is attached) so concurrent requests share a forward pass
+
+        Args:
+            img (Image): The image to classify
+
+        Returns:
+            any: The same result as classify_image_raw()
+        """
+        # Without a scheduler the forward pass runs on the calling thread, which
+        # takes on the intra-op threads of the model (cores are only pinned on
+        # the scheduler worker, request threads are shared between models)
+        if self.scheduler is None:
+            admission.check_deadline("model", self.alias())
+            configure_thread(self.threads)
+            return self.classify_batch_raw([img])[0]
+
+        # A profiled request runs the batch function of the scheduler inline, so
+        # its forward pass is on the profiled thread
+        if profiling.active():
+            admission.check_deadline("model", self.alias())
+            configure_thread(self.threads)
+            return self.classify_batch_raw([img])[0]
+
+        return self.scheduler.submit(img, admission.deadline())
@@ -0,0 +1,184 @@
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Callable
+from admission import DeadlineExceeded, expired
+import metrics
+import queue
+import time
+
+"""Dynamic micro-batching for models that support batched inference"""
+
+
+class BatchStats:
+    """Thread-safe counters describing the batches a scheduler has run"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_size = 0
+        self.sizes: dict[int, int] = {}
+
+    def record(self, size: int) -> None:
+        """Record a completed batch
+
+        Args:
+            size (int): The amount of items within the batch
+        """
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.max_size = max(self.max_size, size)
+            self.sizes[size] = self.sizes.get(size, 0) + 1
+
+    def snapshot(self) -> dict:
+        """Returns a JSON serialisable copy of the counters"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": round(self.items / self.batches, 2)
+                if self.batches
+                else 0,
+                "largest_batch_size": self.max_size,
+                "batch_sizes": dict(sorted(self.sizes.items())),
+            }
+
+
+class BatchScheduler:
+    """Collects concurrent single-item requests and runs them as one batch
+
+    A background worker waits for the first request, then keeps collecting
+    requests for up to 'window_ms' milliseconds (or until 'max_batch_size'
+    requests are queued) before handing the whole batch to 'fn'. Each caller
+    blocks until its own result is available.
+
+    Args:
+        fn (Callable[[list], list]): The batched function. Must return one
+        result per input item, in the same order
+        window_ms (float): How long to wait for a batch to fill up
+        max_batch_size (int): The maximum amount of items per batch
+        name (str, optional): The model alias (names the worker thread and labels
+        the metrics of the scheduler)
+        initializer (Callable, optional): Called on the worker thread before it
+        runs the first batch (i.e., to apply the thread budget of the model)
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[list], list],
+        window_ms: float,
+        max_batch_size: int,
+        name: str = "model",
+        initializer: Callable[[], None] | None = None,
+    ) -> None:
+        self.fn = fn
+        self.name = name
+        self.initializer = initializer
+        self.stats = BatchStats()
+        self.configure(window_ms, max_batch_size)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._worker: Thread | None = None
+        self._worker_lock = Lock()
+
+    def configure(self, window_ms: float, max_batch_size: int) -> None:
+        """Update the batching window and batch size (applies to the next batch)"""
+        self.window_ms = max(0.0, window_ms)
+        self.max_batch_size = max(1, max_batch_size)
+
+    def submit(self, item, deadline: float | None = None):
+        """Queue an item and block until its result is available
+
+        Args:
+            item (any): A single input item (i.e., a PIL image)
+            deadline (float, optional): The perf_counter() time after which the
+            item is dropped instead of run (see admission.py)
+
+        Raises:
+            DeadlineExceeded: The deadline passed while the item was queued
+
+        Returns:
+            any: The result 'fn' produced for this item
+        """
+        self._ensure_worker()
+
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter(), deadline))
+        return future.result()
+
+    def depth(self) -> int:
+        """The amount of items waiting for a batch"""
+        return self._queue.qsize()
+
+    def _ensure_worker(self) -> None:
+        """Start the worker thread on first use"""
+        if self._worker is not None:
+            return
+
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = Thread(
+                    target=self._run, name=f"batcher-{self.name}", daemon=True
+                )
+                self._worker.start()
+
+    def _collect(self) -> list:
+        """Block for the first request then gather a batch within the window"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self) -> None:
+        if self.initializer is not None:
+            self.initializer()
+
+        while True:
+            batch = self._collect()
+
+            started = time.perf_counter()
+            for _, _, queued, _ in batch:
+                metrics.STAGE_SECONDS.observe(started - queued, self.name, "queue")
+
+            # Items whose request can no longer use the result never reach the model
+            for _, future, _, deadline in batch:
+                if expired(deadline):
+                    metrics.DEADLINE_DROPPED.inc(self.name, "queue")
+                    future.set_exception(
+                        DeadlineExceeded("the request deadline passed while queued")
+                    )
+
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+
+            items = [item for item, _, _, _ in batch]
+            futures = [future for _, future, _, _ in batch]
+
+            try:
+                results = list(self.fn(items))
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"the batch function of {self.name} returned {len(results)} "
+                        f"results for {len(items)} items"
+                    )
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.stats.record(len(batch))
+            metrics.BATCH_SIZE.observe(len(batch), self.name)
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
@@ -0,0 +1,212 @@
+from models.base import ModelBase
+from models.threads import configure_thread
+from PIL.Image import Image as PILImage
+from threading import Event, Thread
+from typing import Iterator
+from cache import image_digest
+import config
+
+"""Shared batched (and streamed) caption generation for the captioning models
+
+Captioning models load an image processor, a tokenizer and an encoder-decoder
+model with a transformers generate() method, which runs on the torch backend of
+the model (with its optimisation profile, see models/optimize.py). Images are
+captioned in padded batches. generate() runs the vision encoder once per batch
+and reuses its outputs for every decoding step (and beam); across the members
+of a batch only identical images share encoder outputs, as they are captioned
+once. Decoding can be controlled per request:
+
+    max_new_tokens   The maximum length of a caption (in tokens)
+    num_beams        1 decodes greedily, more runs a beam search
+    early_stopping   Stop the beam search once every beam has finished
+"""
+
+
+def _boolean(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def stop_on(event: Event):
+    """Stopping criteria that end every sequence of a generate() call once an
+    event is set (i.e., when the client of a stream has gone)
+
+    Args:
+        event (Event): The event
+
+    Returns:
+        StoppingCriteriaList: The generate() stopping_criteria
+    """
+    from transformers import StoppingCriteria, StoppingCriteriaList
+    import torch
+
+    class EventStoppingCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full(
+                (input_ids.shape[0],), event.is_set(), device=input_ids.device
+            )
+
+    return StoppingCriteriaList([EventStoppingCriteria()])
+
+
+class CaptionModel(ModelBase):
+    """A model that generates a text caption for an image. Subclasses load
+    self.image_processor, self.tokenizer and self.model"""
+
+    image_processor = None
+    tokenizer = None
+    model = None
+
+    def request_options(self, params: dict) -> dict:
+        """Read the decoding options of a request (see the module docs). The
+        values are clamped to the configured limits
+
+        Args:
+            params (dict): The request parameters (query or POST body)
+
+        Returns:
+            dict: The requested decoding options (empty for the defaults)
+        """
+        options = {}
+
+        if params.get("max_new_tokens") is not None:
+            options["max_new_tokens"] = max(
+                1, min(int(params["max_new_tokens"]), config.CAPTION_TOKEN_LIMIT)
+            )
+
+        if params.get("num_beams") is not None:
+            options["num_beams"] = max(
+                1, min(int(params["num_beams"]), config.CAPTION_BEAM_LIMIT)
+            )
+
+        if params.get("early_stopping") is not None:
+            options["early_stopping"] = _boolean(params["early_stopping"])
+
+        return options
+
+    def generation_kwargs(self, options: dict) -> dict:
+        """The generate() arguments for a set of decoding options"""
+        kwargs = {
+            "max_new_tokens": config.CAPTION_MAX_NEW_TOKENS,
+            "num_beams": config.CAPTION_NUM_BEAMS,
+            "early_stopping": False,
+            **options,
+        }
+
+        # Early stopping only applies to beam search
+        if kwargs["num_beams"] == 1:
+            kwargs.pop("early_stopping")
+
+        if self.tokenizer.pad_token_id is not None:
+            kwargs["pad_token_id"] = self.tokenizer.pad_token_id
+        else:
+            kwargs["pad_token_id"] = self.tokenizer.eos_token_id
+
+        return kwargs
+
+    def generate(self, pixel_values, **kwargs):
+        """Run generate() of the model on its backend (see TorchBackend.generate)
+
+        Args:
+            pixel_values (Tensor): The preprocessed batch
+            **kwargs: The generate() arguments (see generation_kwargs)
+
+        Returns:
+            Tensor: The generated token ids
+        """
+        if self.backend is None:
+            self.optimize()
+
+        with self.timed("forward"):
+            return self.backend.generate(pixel_values, **kwargs)
+
+    def pixel_values(self, imgs: list[PILImage]):
+        """Preprocess a list of images into a batch of pixel values"""
+        imgs = [img.convert("RGB") if img.mode != "RGB" else img for img in imgs]
+        return self.image_processor(images=imgs, return_tensors="pt").pixel_values
+
+    def caption_batch(self, imgs: list[PILImage], **options) -> list[str]:
+        """Caption a batch of images with a single (padded) generate() call
+
+        Args:
+            imgs (list[PILImage]): The images to caption
+            **options: Decoding options (see request_options)
+
+        Returns:
+            list[str]: The caption of each image (in input order)
+        """
+        # Identical images are only encoded (and decoded) once
+        unique: dict[str, int] = {}
+        positions = [
+            unique.setdefault(image_digest(img), len(unique)) for img in imgs
+        ]
+        first = {position: img for position, img in zip(positions, imgs)}
+
+        with self.timed("preprocess"):
+            pixel_values = self.pixel_values([first[i] for i in range(len(unique))])
+
+        ids = self.generate(pixel_values, **self.generation_kwargs(options))
+
+        with self.timed("postprocess"):
+            captions = self.tokenizer.batch_decode(ids, skip_special_tokens=True)
+            return [captions[position].strip() for position in positions]
+
+    def stream_caption(self, img: PILImage, **options) -> Iterator[str]:
+        """Caption an image, yielding the text of each token as it is generated.
+        Streaming decodes greedily (num_beams is ignored). Generation stops when
+        the iterator is closed (i.e., the client of the response disconnected)
+
+        Args:
+            img (PILImage): The image to caption
+            **options: Decoding options (see request_options)
+
+        Yields:
+            str: The text of the next generated token(s)
+        """
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        kwargs = self.generation_kwargs({**options, "num_beams": 1})
+        with self.timed("preprocess"):
+            pixel_values = self.pixel_values([img])
+        errors = []
+        stop = Event()
+
+        def run():
+            configure_thread(self.threads, self.cpus)
+            try:
+                self.generate(
+                    pixel_values,
+                    streamer=streamer,
+                    stopping_criteria=stop_on(stop),
+                    **kwargs,
+                )
+            except Exception as e:
+                # Unblock the consumer, which re-raises the error
+                errors.append(e)
+                streamer.end()
+
+        Thread(target=run, name=f"stream-{self.alias()}", daemon=True).start()
+
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            # Closed early, stop generating at the next token
+            stop.set()
+
+        if errors:
+            raise errors[0]
+
+    def classify_image(self, img: PILImage) -> PILImage:
+        return super().classify_image(img)
+
+    def classify_image_raw(self, img: PILImage) -> dict:
+        return self.classify_batch_raw([img])[0]
+
+    def classify_batch_raw(self, imgs: list[PILImage], **options) -> list[dict]:
+        return [{"msg": caption} for caption in self.caption_batch(imgs, **options)]
@@ -0,0 +1,17 @@
+from functools import cache
+import os
+
+"""Shared label sets used by the pretrained models"""
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "static")
+
+
+@cache
+def imagenet_classes() -> list[str]:
+    """Returns the 1000 ImageNet class labels (read from disk once)
+
+    Returns:
+        list[str]: The labels indexed by class id
+    """
+    with open(os.path.join(STATIC_DIR, "imagenet_classes.txt"), "r") as f:
+        return [s.strip() for s in f.readlines()]
@@ -0,0 +1,69 @@
+import ctypes
+import gc
+import os
+
+"""Helpers to measure (and release) the memory used by loaded models"""
+
+
+def current_rss() -> int:
+    """Returns the resident set size of the current process (in bytes).
+    Only supported on Linux, other platforms report 0
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _module(obj):
+    """Returns the torch module of a loaded object (a torch module, or an object
+    wrapping one such as a transformers pipeline), else None"""
+    if not hasattr(obj, "parameters") and hasattr(obj, "model"):
+        obj = obj.model
+
+    if not callable(getattr(obj, "parameters", None)) or not hasattr(obj, "buffers"):
+        return None
+
+    return obj
+
+
+def module_bytes(obj) -> int:
+    """Approximate the memory used by the weights of a loaded object
+
+    Args:
+        obj (any): The object to measure
+
+    Returns:
+        int: The size of all parameters and buffers (in bytes), 0 if unknown
+    """
+    module = _module(obj)
+    if module is None:
+        return 0
+
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def share_module(obj) -> int:
+    """Move the weights of a loaded object into shared memory (see module_bytes)
+
+    Returns:
+        int: The amount of bytes moved into shared memory
+    """
+    module = _module(obj)
+    if module is None:
+        return 0
+
+    module.share_memory()
+    return module_bytes(module)
+
+
+def release_memory() -> None:
+    """Collect garbage and ask the allocator to hand freed memory back to the OS"""
+    gc.collect()
+
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
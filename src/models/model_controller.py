@@ -1,91 +1,143 @@
-from importlib import import_module
 from multiprocessing.dummy import Pool as ThreadPool
 
 from models.base import ModelBase
-from models.pretrained.resnet import Resnet
-from models.pretrained.alexnet import Alexnet
-from models.pretrained.vit import Vit
-from models.pretrained.gpt import Gpt
-from models.pretrained.blip import Blip
-from models.pretrained.tesseract import Tesseract
-from functools import cache
-
-import os
-
-# # Define models to pre-load
-# preloaded_models: list[ModelBase] = [
-#     ResNet(),
-#     AlexNet(),
-#     Vit(),
-#     Gpt(),
-#     Blip(),
-#     Tesseract(),
-# ]
+from models.batching import BatchScheduler
+from models.memory import current_rss, module_bytes, release_memory, share_module
+from models.registry import ModelSpec, discover
+from models.threads import budget, configure_thread
+from functools import cache, partial
+from threading import Lock, RLock, Thread
+
+import config
+import time
+
+
+class ModelState:
+    """Tracks the lifecycle of a single model within the controller
+
+    Args:
+        spec (ModelSpec): The registry entry the model is created from
+    """
+
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+
+    def __init__(self, spec: ModelSpec) -> None:
+        self.spec = spec
+        self.model: ModelBase | None = None  # Created (imported) on first use
+        self.status = ModelState.UNLOADED
+        self.lock = RLock()  # Serialises creating/loading/unloading of the model
+        self.in_use = 0  # The amount of requests currently using the model
+        self.last_used: float | None = None
+        self.load_seconds: float | None = None
+        self.memory = 0  # Approximate memory used by the model (bytes)
+        self.attributes: set[str] = set()  # Instance attributes created by load()
+        self.pinned = False  # Pinned models are never evicted
+        self.batching: tuple = (None, None)  # (window_ms, max_batch_size) overrides
 
 
 class ModelController:
-    """Handles the management of a set of models"""
+    """Handles the management of a set of models
 
-    # The models to control
-    models: list = []
+    Models are discovered without importing them (see models/registry.py).
+    A model is imported and loaded according to the configured load mode
+    ('eager' loads every model up front, 'lazy' loads a model on its first
+    use). Once the process RSS exceeds the configured memory budget, the least
+    recently used idle models are unloaded again.
+    """
 
-    def __init__(self) -> None:
-        self.models = self.auto_load("src/models/pretrained")
+    def __init__(
+        self,
+        load_mode: str = config.LOAD_MODE,
+        preload: list[str] | None = None,
+        memory_budget: int = config.MEMORY_BUDGET_MB * 1024 * 1024,
+        model_dir: str = config.MODEL_DIR,
+    ) -> None:
+        self.states: dict[str, ModelState] = {
+            spec.alias.lower(): ModelState(spec) for spec in self.auto_load(model_dir)
+        }
+        self._states_lock = Lock()
 
-    def auto_load(self, model_dir: str) -> list:
-        """Automatically load pretrained models from a specified directory
+        self.load_mode = load_mode
+        self.preload = config.PRELOAD if preload is None else preload
+        self.memory_budget = memory_budget
+
+        # Explicitly preloaded models are pinned (never evicted)
+        for alias in self.preload:
+            state = self.states.get(alias.lower())
+            if state is None:
+                raise ValueError(f"No model matches the preload alias '{alias}'")
+            state.pinned = True
+
+        # The default intra-op threads are split between the models loaded at startup
+        budget.share(len(self.states) if load_mode == "eager" else len(self.preload))
+
+    def auto_load(self, model_dir: str) -> list[ModelSpec]:
+        """Automatically discover pretrained models from a specified directory
+        (the models are not imported until they are used)
 
         Args:
             model_dir (str): The model directory to load from
 
         Returns:
-            list: A list of loaded model
+            list[ModelSpec]: A list of discovered models
         """
+        specs = discover(model_dir) if model_dir else discover()
 
-        preloaded_models = []
+        print([spec.alias for spec in specs])
 
-        # Get a list of all the models
-        models = [model for model in os.listdir(model_dir) if model.endswith(".py")]
+        return specs
 
-        for model in models:
-            # Get the module name
-            module_name = os.path.splitext(model)[0]
-            model_module = import_module(f"models.pretrained.{module_name}")
+    def _state(self, model: ModelBase) -> ModelState:
+        """Returns the state of a created model"""
+        return self.states[model.alias().lower()]
 
-            # Get the model class
-            model_class = getattr(model_module, module_name.capitalize())
+    def _create(self, state: ModelState) -> ModelBase:
+        """Create (import and instantiate) the model of a state on first use"""
+        if state.model is not None:
+            return state.model
 
-            # Instantiate the model
-            model_instance = model_class()
+        with state.lock:
+            if state.model is None:
+                model = state.spec.create()
+                model.threads, model.cpus = budget.assign(model.alias())
 
-            # Add the model to the list
-            preloaded_models.append(model_instance)
+                # Place a micro-batching scheduler in front of batch-capable models,
+                # its worker runs the forward passes with the threads of the model
+                if model.supports_batching():
+                    window_ms, max_batch_size = self._batching_options(
+                        model.alias(), *state.batching
+                    )
+                    model.scheduler = BatchScheduler(
+                        model.classify_batch_raw,
+                        window_ms,
+                        max_batch_size,
+                        model.alias(),
+                        partial(configure_thread, model.threads, model.cpus),
+                    )
 
-        print(preloaded_models)
+                state.model = model
 
-        return preloaded_models
+        return state.model
 
     def find_model(self, input: str) -> ModelBase | None:
         """Resolves a model type from an input string.
         This is resolved based on the value returned from the
-        models alias() method
+        models alias() method. The model is created (imported) but not loaded
 
         Args:
             input (str): The input to match
 
         Returns:
-            ModelBase | None: The first-matched model (or None if no result)
+            ModelBase | None: The matched model (or None if no result)
         """
-        matched_model = None
-        for model in self.models:
-            matcher = input.lower()
-            target = model.alias().lower()
+        state = self.states.get(input.lower())
+        if state is None:
+            return None
 
-            if matcher == target:
-                matched_model = model
-        return matched_model
+        return self._create(state)
 
-    @cache
     def display_models(self) -> list:
         """Returns a descriptive string about each of the available models
 
@@ -95,23 +147,301 @@ class ModelController:
 
         models = []
 
-        for model in self.models:
+        for state in self.states.values():
+            model = state.model
+            backend = getattr(model, "backend", None)
+
             models.append(
-                {"name": model.alias().lower(), "description": model.description()}
+                {
+                    "name": state.spec.alias.lower(),
+                    "description": state.spec.description,
+                    "state": state.status,
+                    "memory_bytes": state.memory,
+                    "last_used": state.last_used,
+                    "load_seconds": state.load_seconds,
+                    "in_use": state.in_use,
+                    "backend": backend.name if backend is not None else None,
+                    "threads": model.threads if model is not None else None,
+                    "cpus": model.cpus if model is not None else None,
+                    "profile": str(model.profile)
+                    if model is not None and model.profile is not None
+                    else None,
+                }
             )
 
         return models
 
     def display_available_models(self) -> str:
         """Returns a list of the available models via their alias"""
-        available_models = [model.alias() for model in self.models]
+        available_models = [state.spec.alias for state in self.states.values()]
         return " ".join(available_models)
 
+    def _batching_options(
+        self, alias: str, window_ms: float | None, max_batch_size: int | None
+    ) -> tuple[float, int]:
+        """Fill in the batching options that are not provided from the config"""
+        if window_ms is None:
+            window_ms = config.model_option(
+                "BATCH_WINDOW_MS", alias, config.BATCH_WINDOW_MS
+            )
+        if max_batch_size is None:
+            max_batch_size = config.model_option(
+                "BATCH_MAX_SIZE", alias, config.BATCH_MAX_SIZE
+            )
+
+        return window_ms, max_batch_size
+
+    def configure_batching(
+        self,
+        alias: str,
+        window_ms: float | None = None,
+        max_batch_size: int | None = None,
+    ) -> None:
+        """Configure the micro-batching scheduler of a model. Values that are
+        not provided are read from the configuration (see config.py)
+
+        Args:
+            alias (str): The alias of the model to configure
+            window_ms (float, optional): How long to collect requests for a batch
+            max_batch_size (int, optional): The maximum amount of images per batch
+        """
+        state = self.states.get(alias.lower())
+        if state is None:
+            raise ValueError(f"No model matches the alias '{alias}'")
+
+        with state.lock:
+            state.batching = (window_ms, max_batch_size)
+
+            # Models that have not been created yet pick the options up on creation
+            if state.model is not None and state.model.scheduler is not None:
+                state.model.scheduler.configure(
+                    *self._batching_options(state.spec.alias, window_ms, max_batch_size)
+                )
+
+    def batching_stats(self) -> dict:
+        """Returns the batching configuration and achieved batch sizes per model"""
+        stats = {}
+
+        for state in self.states.values():
+            if state.model is None or state.model.scheduler is None:
+                continue
+
+            scheduler = state.model.scheduler
+            stats[state.spec.alias] = {
+                "window_ms": scheduler.window_ms,
+                "max_batch_size": scheduler.max_batch_size,
+                **scheduler.stats.snapshot(),
+            }
+
+        return stats
+
+    def model_stats(self) -> dict:
+        """Returns the status, load time, memory, requests in flight and batching
+        queue depth of every model"""
+        stats = {}
+
+        for state in self.states.values():
+            scheduler = state.model.scheduler if state.model is not None else None
+            stats[state.spec.alias] = {
+                "status": state.status,
+                "load_seconds": state.load_seconds,
+                "memory": state.memory,
+                "in_use": state.in_use,
+                "queue_depth": scheduler.depth() if scheduler is not None else 0,
+            }
+
+        return stats
+
     @cache
-    def load_models(self, num_threads: int = 8) -> None:
-        """Loads all models using threading"""
+    def load_models(
+        self, num_threads: int | None = None, background: bool = False
+    ) -> None:
+        """Loads the models required at startup using threading.
+        In 'eager' mode this is every model, otherwise the preloaded models
+
+        Args:
+            num_threads (int, optional): The amount of models loaded at once
+            (defaults to the thread budget)
+            background (bool, optional): Load from a background thread so the
+            server can start answering requests (i.e., /ping) straight away
+        """
+        num_threads = num_threads or budget.total
+
+        if background:
+            Thread(
+                target=self._load_models,
+                args=(num_threads,),
+                name="model-loader",
+                daemon=True,
+            ).start()
+        else:
+            self._load_models(num_threads)
+
+    def _load_models(self, num_threads: int) -> None:
+        if self.load_mode == "eager":
+            states = list(self.states.values())
+        else:
+            states = [state for state in self.states.values() if state.pinned]
+
+        def load(state: ModelState) -> None:
+            # A model that fails to load is retried on its first request instead
+            try:
+                self.ensure_loaded(self._create(state))
+            except Exception as e:
+                print(f"Unable to load {state.spec.alias}: {type(e).__name__}: {e}")
+
         pool = ThreadPool(num_threads)
-        pool.map(lambda model: model.load(), self.models)
+        try:
+            pool.map(load, states)
+        finally:
+            # Join the loader threads rather than only stopping them, so none
+            # is left running when serve.py forks its workers
+            pool.close()
+            pool.join()
+
+    def share_weights(self) -> int:
+        """Move the weights of every loaded model into shared memory, so that
+        worker processes forked afterwards attach to a single copy
+
+        Returns:
+            int: The amount of bytes moved into shared memory
+        """
+        shared = 0
+
+        for state in self.states.values():
+            if state.status != ModelState.READY:
+                continue
+
+            for attr in state.attributes:
+                shared += share_module(getattr(state.model, attr))
+
+        return shared
+
+    def ensure_loaded(self, model: ModelBase) -> None:
+        """Load a model if it is not loaded yet. Concurrent callers for the
+        same model wait for a single load
+
+        Args:
+            model (ModelBase): The model to load
+        """
+        state = self._state(model)
+
+        if state.status == ModelState.READY:
+            return
+
+        with state.lock:
+            if state.status == ModelState.READY:
+                return
+
+            state.status = ModelState.LOADING
+            before = set(vars(model))
+            rss = current_rss()
+            started = time.perf_counter()
+
+            try:
+                model.load()
+                model.optimize()
+            except Exception:
+                state.status = ModelState.UNLOADED
+                raise
+
+            state.load_seconds = round(time.perf_counter() - started, 3)
+            state.attributes = set(vars(model)) - before
+
+            # Prefer the size of the weights, the RSS delta is skewed by concurrent loads
+            weights = sum(
+                module_bytes(getattr(model, attr)) for attr in state.attributes
+            )
+            state.memory = weights or max(0, current_rss() - rss)
+            state.status = ModelState.READY
+
+        self.evict_idle(exclude=model)
+
+    def unload(self, model: ModelBase) -> None:
+        """Unload a model, releasing everything its load() created
+
+        Args:
+            model (ModelBase): The model to unload
+        """
+        state = self._state(model)
+
+        with state.lock:
+            with self._states_lock:
+                if state.status != ModelState.READY or state.in_use > 0:
+                    return
+                state.status = ModelState.UNLOADED
+
+            model.close()
+            for attr in state.attributes:
+                delattr(model, attr)
+
+            state.attributes = set()
+            state.memory = 0
+
+        release_memory()
+
+    def evict_idle(self, exclude: ModelBase | None = None) -> None:
+        """Unload the least recently used idle models until the process RSS
+        is within the memory budget (does nothing without a budget)
+
+        Args:
+            exclude (ModelBase, optional): A model that must not be evicted
+        """
+        if self.memory_budget <= 0:
+            return
+
+        while current_rss() > self.memory_budget:
+            candidates = [
+                state
+                for state in self.states.values()
+                if state.model is not exclude
+                and state.status == ModelState.READY
+                and state.in_use == 0
+                and not state.pinned
+            ]
+
+            if not candidates:
+                return
+
+            lru = min(candidates, key=lambda state: state.last_used or 0)
+            print(f"Memory budget exceeded, unloading idle model [{lru.spec.alias}]")
+            self.unload(lru.model)
+
+    def acquire(self, model: ModelBase) -> ModelBase:
+        """Mark a model as in use (loading it when required). Models in use
+        are never evicted. Every acquire() must be paired with a release()
+
+        Args:
+            model (ModelBase): The model to use
+
+        Returns:
+            ModelBase: The loaded model
+        """
+        state = self._state(model)
+
+        with self._states_lock:
+            state.in_use += 1
+            state.last_used = time.time()
+
+        try:
+            self.ensure_loaded(model)
+        except Exception:
+            self.release(model)
+            raise
+
+        return model
+
+    def release(self, model: ModelBase) -> None:
+        """Mark a model as no longer in use by a request (see acquire()). Models
+        that were in use when the memory budget was exceeded can be evicted now
+        """
+        state = self._state(model)
+
+        with self._states_lock:
+            state.in_use -= 1
+            state.last_used = time.time()
+
+        self.evict_idle()
 
 
 if __name__ == "__main__":
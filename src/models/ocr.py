@@ -0,0 +1,316 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL.Image import Image as PILImage
+from threading import BoundedSemaphore
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import config
+
+"""OCR engines used by the Tesseract model
+
+Both engines return the text and the word boxes of every image from a single
+recognition pass:
+
+    tesserocr   A pool of long-lived Tesseract API instances (the C API through
+                tesserocr), so nothing is forked and the language model is only
+                loaded once per worker
+    cli         The tesseract executable, run once per batch of images (through
+                an image list file) instead of once per image
+
+INFERENCE_OCR_ENGINE selects the engine ('auto' prefers tesserocr when it is
+installed).
+"""
+
+
+class OcrWord:
+    """A recognised word
+
+    Args:
+        text (str): The word
+        box (list[int]): The [x0, y0, x1, y1] bounding box of the word
+        confidence (float): The recognition confidence (0-100)
+    """
+
+    def __init__(self, text: str, box: list[int], confidence: float) -> None:
+        self.text = text
+        self.box = box
+        self.confidence = confidence
+
+
+class OcrResult:
+    """The text and words recognised in an image
+
+    Args:
+        text (str): The recognised text (lines separated by newlines, paragraphs
+        by blank lines)
+        words (list[OcrWord]): The recognised words
+        error (str, optional): Why the image could not be recognised
+    """
+
+    def __init__(
+        self, text: str, words: list[OcrWord], error: str | None = None
+    ) -> None:
+        self.text = text
+        self.words = words
+        self.error = error
+
+
+class OcrError(Exception):
+    """An image that tesseract could not recognise"""
+
+    status = 422
+
+
+def parse_tsv(tsv: str) -> dict[int, OcrResult]:
+    """Parse the TSV output of tesseract into one result per page
+
+    Args:
+        tsv (str): The TSV output (with or without its header row)
+
+    Returns:
+        dict[int, OcrResult]: The results keyed by their (1 based) page number
+    """
+    pages: dict[int, dict] = {}
+
+    for row in tsv.splitlines():
+        columns = row.split("\t")
+        if len(columns) < 12 or columns[0] != "5":  # Only the word level rows
+            continue
+
+        page, block, paragraph, line = (int(column) for column in columns[1:5])
+        left, top, width, height = (int(column) for column in columns[6:10])
+        text = columns[11].strip()
+
+        if not text:
+            continue
+
+        words = pages.setdefault(page, {})
+        words.setdefault((block, paragraph, line), []).append(
+            OcrWord(text, [left, top, left + width, top + height], float(columns[10]))
+        )
+
+    results = {}
+    for page, lines in pages.items():
+        text, previous = [], None
+
+        for (block, paragraph, _), words in lines.items():
+            if previous is not None and previous != (block, paragraph):
+                text.append("")
+            text.append(" ".join(word.text for word in words))
+            previous = (block, paragraph)
+
+        results[page] = OcrResult(
+            "\n".join(text), [word for words in lines.values() for word in words]
+        )
+
+    return results
+
+
+def otsu_threshold(img: PILImage) -> int:
+    """The threshold that best separates the (grayscale) histogram in two classes"""
+    histogram = img.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+
+    best, threshold = 0.0, 127
+    background, weighted_background = 0, 0
+
+    for i, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+
+        foreground = total - background
+        if foreground == 0:
+            break
+
+        weighted_background += i * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best:
+            best, threshold = variance, i
+
+    return threshold
+
+
+def preprocess(img: PILImage, options: set[str]) -> PILImage:
+    """Optionally convert an image to grayscale and binarize it (Otsu threshold)
+
+    Args:
+        img (PILImage): The image to preprocess
+        options (set[str]): 'grayscale' and/or 'binarize'
+
+    Returns:
+        PILImage: The preprocessed image
+    """
+    if "grayscale" in options or "binarize" in options:
+        img = img.convert("L")
+
+    if "binarize" in options:
+        threshold = otsu_threshold(img)
+        img = img.point(lambda value: 255 if value > threshold else 0)
+
+    return img
+
+
+class TesserocrEngine:
+    """Recognises images on a pool of long-lived Tesseract API instances
+
+    Args:
+        workers (int): The amount of API instances (images recognised at once)
+        lang (str): The tesseract language(s), i.e. 'eng'
+        tessdata (str, optional): The tessdata directory (defaults to tesseracts)
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, workers: int, lang: str, tessdata: str = "") -> None:
+        import tesserocr
+
+        self._apis: queue.Queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+
+        try:
+            for _ in range(workers):
+                kwargs = {"path": tessdata} if tessdata else {}
+                self._apis.put(tesserocr.PyTessBaseAPI(lang=lang, **kwargs))
+        except Exception:
+            self.close()  # The instances created before the failure
+            raise
+
+    def _recognize(self, img: PILImage) -> OcrResult:
+        api = self._apis.get()
+        try:
+            api.SetImage(img)
+            api.Recognize()
+            return parse_tsv(api.GetTSVText(0)).get(1, OcrResult("", []))
+        finally:
+            api.Clear()
+            self._apis.put(api)
+
+    def recognize(self, imgs: list[PILImage]) -> list[OcrResult]:
+        """Recognise a batch of images (concurrently across the pool)
+
+        Args:
+            imgs (list[PILImage]): The images to recognise
+
+        Returns:
+            list[OcrResult]: One result per image (in input order)
+        """
+        return list(self._pool.map(self._recognize, imgs))
+
+    def close(self) -> None:
+        """Wait for the running recognitions, then end every API instance"""
+        self._pool.shutdown(wait=True)
+
+        while not self._apis.empty():
+            self._apis.get_nowait().End()
+
+
+class CliEngine:
+    """Recognises batches of images with a single run of the tesseract executable
+
+    Args:
+        workers (int): The maximum amount of concurrent tesseract processes
+        lang (str): The tesseract language(s), i.e. 'eng'
+        tessdata (str, optional): The tessdata directory (defaults to tesseracts)
+        cmd (str, optional): The tesseract executable
+    """
+
+    name = "cli"
+
+    def __init__(
+        self, workers: int, lang: str, tessdata: str = "", cmd: str = "tesseract"
+    ) -> None:
+        self.cmd = shutil.which(cmd)
+        if self.cmd is None:
+            raise FileNotFoundError(f"The tesseract executable '{cmd}' was not found")
+
+        self.lang = lang
+        self.tessdata = tessdata
+        self._slots = BoundedSemaphore(workers)
+
+    def recognize(self, imgs: list[PILImage]) -> list[OcrResult]:
+        """Recognise a batch of images (see TesserocrEngine.recognize). When
+        tesseract fails on the batch each image is retried on its own, so an
+        image it cannot read only fails its own result (see OcrResult.error)
+        """
+        with tempfile.TemporaryDirectory(prefix="ocr-") as directory:
+            paths = []
+            for i, img in enumerate(imgs):
+                path = os.path.join(directory, f"{i}.png")
+                img.save(path, compress_level=1)
+                paths.append(path)
+
+            try:
+                # Every image of the list is a page of the output
+                pages = parse_tsv(self._run(directory, paths))
+                return [pages.get(i + 1, OcrResult("", [])) for i in range(len(imgs))]
+            except subprocess.CalledProcessError as e:
+                if len(imgs) == 1:
+                    return [OcrResult("", [], self._error(e))]
+
+            return [self.recognize([img])[0] for img in imgs]
+
+    def _run(self, directory: str, paths: list[str]) -> str:
+        """Run tesseract over an image list, returns its TSV output"""
+        images = os.path.join(directory, "images.txt")
+        with open(images, "w") as f:
+            f.write("\n".join(paths) + "\n")
+
+        args = [self.cmd, images, "stdout", "-l", self.lang]
+        if self.tessdata:
+            args += ["--tessdata-dir", self.tessdata]
+
+        with self._slots:
+            return subprocess.run(
+                args + ["tsv"], capture_output=True, text=True, check=True
+            ).stdout
+
+    @staticmethod
+    def _error(e: subprocess.CalledProcessError) -> str:
+        """Describe a failed tesseract run (with the last line it printed)"""
+        lines = (e.stderr or "").strip().splitlines()
+        detail = f": {lines[-1]}" if lines else ""
+        return f"tesseract exited with status {e.returncode}{detail}"
+
+    def close(self) -> None:
+        """Nothing to release, tesseract runs per batch"""
+
+
+def preload_tesserocr() -> None:
+    """Import tesserocr ahead of time. Its first import installs signal handlers
+    (through cysignals), which only works on the main thread, whereas models are
+    loaded from background and request threads"""
+    if config.OCR_ENGINE in ("auto", "tesserocr"):
+        try:
+            import tesserocr  # noqa: F401
+        except ImportError:
+            pass
+
+
+def create_engine() -> TesserocrEngine | CliEngine:
+    """Create the configured OCR engine
+
+    Returns:
+        TesserocrEngine | CliEngine: The engine
+    """
+    engine = config.OCR_ENGINE
+    args = (config.OCR_WORKERS, config.OCR_LANG, config.OCR_TESSDATA)
+
+    if engine in ("auto", "tesserocr"):
+        try:
+            return TesserocrEngine(*args)
+        except ImportError:
+            if engine == "tesserocr":
+                raise
+            print("tesserocr is not installed, running the tesseract executable")
+
+    if engine in ("auto", "cli"):
+        return CliEngine(*args, cmd=config.OCR_CMD)
+
+    raise ValueError(f"Unknown OCR engine '{engine}'")
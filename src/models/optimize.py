@@ -0,0 +1,141 @@
+from contextlib import ExitStack, contextmanager
+import torch
+import config
+
+"""CPU optimisation profiles for the torch based models
+
+A profile is a comma separated list of options, configured globally through
+INFERENCE_PROFILE or per model (i.e., INFERENCE_PROFILE_ALEXNET):
+
+    inference_mode   Run inference under torch.inference_mode (else no_grad)
+    channels_last    Use the channels last memory format for conv weights/inputs
+    int8             Dynamically quantise the Linear layers to int8
+    trace            TorchScript trace the model (models with example inputs only)
+    compile          torch.compile the model
+    bf16             Run inference under bf16 autocast (when the CPU supports it)
+"""
+
+OPTIONS = {"inference_mode", "channels_last", "int8", "trace", "compile", "bf16"}
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU can run bf16 kernels natively (AVX512-BF16 / AMX)"""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+_threads_configured = False
+
+
+def configure_threads() -> None:
+    """Apply the configured inter-op thread count (once per process). The intra-op
+    threads are set per model (see models/threads.py)"""
+    global _threads_configured
+
+    if _threads_configured:
+        return
+    _threads_configured = True
+
+    if config.INTER_OP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(config.INTER_OP_THREADS)
+        except RuntimeError:
+            # Can only be set before any inter-op parallel work has started
+            print("Unable to set the inter-op thread count, torch is already running")
+
+
+class OptimizationProfile:
+    """A set of CPU optimisations applied to a model
+
+    Args:
+        options (str): Comma separated profile options (see the module docs)
+    """
+
+    def __init__(self, options: str = "inference_mode") -> None:
+        self.options = {option.strip() for option in options.split(",") if option}
+
+        unknown = self.options - OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown optimisation profile options {unknown}")
+
+        if "trace" in self.options and "compile" in self.options:
+            raise ValueError("A profile can either 'trace' or 'compile' a model")
+
+        # Only autocast when the hardware supports bf16 (it is slower otherwise)
+        self.bf16 = "bf16" in self.options and bf16_supported()
+
+    @classmethod
+    def for_model(cls, alias: str) -> "OptimizationProfile":
+        """Returns the profile configured for a model"""
+        return cls(config.model_option("PROFILE", alias, config.PROFILE))
+
+    def __str__(self) -> str:
+        return ",".join(sorted(self.options))
+
+    def apply(self, module, example_inputs: tuple | None = None):
+        """Apply the profile to a loaded torch module
+
+        Args:
+            module (torch.nn.Module): The module to optimise (other objects are
+            returned unchanged)
+            example_inputs (tuple, optional): Inputs used to trace the module
+
+        Returns:
+            The optimised module
+        """
+        if not isinstance(module, torch.nn.Module):
+            return module
+
+        module.eval()
+
+        if "channels_last" in self.options:
+            module = module.to(memory_format=torch.channels_last)
+
+        if "int8" in self.options:
+            module = torch.ao.quantization.quantize_dynamic(
+                module, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        if "trace" in self.options:
+            if example_inputs is None:
+                print(f"'trace' skipped, {type(module).__name__} has no example inputs")
+            else:
+                with torch.no_grad(), self._autocast():
+                    module = torch.jit.trace(
+                        module, tuple(self.prepare(x) for x in example_inputs)
+                    )
+                module = torch.jit.freeze(module)
+
+        if "compile" in self.options:
+            if hasattr(module, "generate"):
+                # generate() calls the forward pass of the module once per token
+                module.forward = torch.compile(module.forward, dynamic=True)
+            else:
+                module = torch.compile(module, dynamic=True)
+
+        return module
+
+    def prepare(self, tensor: torch.Tensor) -> torch.Tensor:
+        """Convert an input batch to the memory format the profile expects"""
+        if "channels_last" in self.options and tensor.dim() == 4:
+            return tensor.contiguous(memory_format=torch.channels_last)
+        return tensor
+
+    def _autocast(self):
+        if self.bf16:
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return ExitStack()
+
+    @contextmanager
+    def context(self):
+        """The context to run inference in (no autograd, optional bf16 autocast)"""
+        grad = (
+            torch.inference_mode()
+            if "inference_mode" in self.options
+            else torch.no_grad()
+        )
+
+        with grad, self._autocast():
+            yield
@@ -0,0 +1,197 @@
+from collections import defaultdict
+from threading import local
+from PIL.Image import Image
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+"""Vectorised, tensor-native preprocessing shared by the vision models
+
+Images are turned into uint8 tensors straight from their decoded pixels, then
+resized, cropped and normalised as whole batches (instead of one PIL image at
+a time through a per-model processor).
+"""
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class InputSpec:
+    """Declares the input a vision model expects
+
+    Args:
+        mean (tuple[float, float, float]): The per-channel normalisation mean
+        std (tuple[float, float, float]): The per-channel normalisation std
+        size (tuple[int, int], optional): Resize every image to (height, width)
+        resize (int, optional): Resize the shorter side to this length (keeping
+        the aspect ratio)
+        max_size (int, optional): The maximum length of the longer side when
+        resizing the shorter side
+        crop (int, optional): Center crop a square of this size after resizing
+        pad (bool, optional): Pad the batch to its largest image (with a pixel mask)
+    """
+
+    def __init__(
+        self,
+        mean: tuple,
+        std: tuple,
+        size: tuple[int, int] | None = None,
+        resize: int | None = None,
+        max_size: int | None = None,
+        crop: int | None = None,
+        pad: bool = False,
+    ) -> None:
+        self.mean = mean
+        self.std = std
+        self.size = size
+        self.resize = resize
+        self.max_size = max_size
+        self.crop = crop
+        self.pad = pad
+
+    def resized_size(self, height: int, width: int) -> tuple[int, int]:
+        """The (height, width) an image is resized to (before cropping)"""
+        if self.size is not None:
+            return self.size
+
+        if self.resize is None:
+            return height, width
+
+        size = self.resize
+        short, long = min(height, width), max(height, width)
+
+        if self.max_size is not None and long / short * size > self.max_size:
+            size = int(round(self.max_size * short / long))
+
+        if width <= height:
+            return int(size * height / width), size
+        return size, int(size * width / height)
+
+
+def source_size(img: Image) -> tuple[int, int]:
+    """The (width, height) of the src image an image was decoded from. Images
+    can be decoded at a reduced size (see fetch.py), model outputs in pixel
+    coordinates (i.e., boxes) are scaled to the src image"""
+    return img.info.get("source_size", img.size)
+
+
+def to_uint8_tensor(img: Image) -> torch.Tensor:
+    """Convert a decoded PIL image to a (H, W, 3) uint8 RGB tensor"""
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    return torch.from_numpy(np.array(img))
+
+
+def resize_uint8(batch: torch.Tensor, size: tuple[int, int]) -> torch.Tensor:
+    """Antialiased bilinear resize of a (N, 3, H, W) uint8 batch (matches a PIL
+    bilinear resize). Runs directly on uint8 pixels when torch supports it"""
+    try:
+        return F.interpolate(batch, size=size, mode="bilinear", antialias=True)
+    except RuntimeError:
+        # Older torch versions only interpolate floats
+        resized = F.interpolate(
+            batch.float(), size=size, mode="bilinear", antialias=True
+        )
+        return resized.round_().clamp_(0, 255).to(torch.uint8)
+
+
+class Preprocessor:
+    """Turns a list of images into a normalised float batch for a model
+
+    Images of the same size are resized together in a single uint8
+    interpolation, and the whole batch is normalised in one operation. The batch is written
+    into a preallocated buffer (one per thread) that is reused across calls,
+    so the returned tensors are only valid until the next call on the thread.
+
+    Args:
+        spec (InputSpec): The input the model expects
+    """
+
+    def __init__(self, spec: InputSpec) -> None:
+        self.spec = spec
+
+        # Normalise on the 0-255 scale (saves rescaling the batch separately)
+        self.mean = torch.tensor(spec.mean).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(spec.std).view(1, 3, 1, 1) * 255
+
+        self._local = local()
+
+    def _buffer(self, shape: tuple) -> torch.Tensor:
+        """Returns a float tensor of the given shape backed by this threads buffer"""
+        needed = int(np.prod(shape))
+        storage = getattr(self._local, "storage", None)
+
+        if storage is None or storage.numel() < needed:
+            storage = torch.empty(needed, dtype=torch.float32)
+            self._local.storage = storage
+
+        return storage[:needed].view(shape)
+
+    def _resize(self, tensors: list[torch.Tensor]) -> list[torch.Tensor]:
+        """Resize (and crop) the uint8 images, batching images of the same size"""
+        groups = defaultdict(list)
+        for i, tensor in enumerate(tensors):
+            groups[tuple(tensor.shape[:2])].append(i)
+
+        resized: list = [None] * len(tensors)
+        crop = self.spec.crop
+
+        for (height, width), indexes in groups.items():
+            # (N, H, W, 3) -> (N, 3, H, W) as a channels last view (no copy)
+            batch = torch.stack([tensors[i] for i in indexes]).permute(0, 3, 1, 2)
+            target = self.spec.resized_size(height, width)
+
+            if target != (height, width):
+                batch = resize_uint8(batch, target)
+
+            if crop is not None:
+                top = int(round((target[0] - crop) / 2.0))
+                left = int(round((target[1] - crop) / 2.0))
+                batch = batch[:, :, top : top + crop, left : left + crop]
+
+            for i, image in zip(indexes, batch):
+                resized[i] = image
+
+        return resized
+
+    def __call__(
+        self, imgs: list[Image]
+    ) -> tuple[torch.Tensor, torch.Tensor | None]:
+        """Preprocess a list of images into a single batch
+
+        Args:
+            imgs (list[Image]): The images to preprocess
+
+        Returns:
+            tuple[Tensor, Tensor | None]: The (N, 3, H, W) pixel values and, when
+            the spec pads the batch, the (N, H, W) pixel mask (else None)
+        """
+        resized = self._resize([to_uint8_tensor(img) for img in imgs])
+
+        height = max(image.shape[1] for image in resized)
+        width = max(image.shape[2] for image in resized)
+
+        if not self.spec.pad and any(
+            image.shape[1:] != (height, width) for image in resized
+        ):
+            raise ValueError("Images of different sizes require a padded InputSpec")
+
+        batch = self._buffer((len(resized), 3, height, width))
+        mask = None
+
+        if self.spec.pad:
+            batch.zero_()
+            mask = torch.zeros((len(resized), height, width), dtype=torch.long)
+
+        for i, image in enumerate(resized):
+            batch[i, :, : image.shape[1], : image.shape[2]].copy_(image)
+            if mask is not None:
+                mask[i, : image.shape[1], : image.shape[2]] = 1
+
+        # Rescale and normalise the whole batch at once (padding is reset to zero)
+        batch.sub_(self.mean).div_(self.std)
+        if mask is not None:
+            batch.mul_(mask.unsqueeze(1))
+
+        return batch, mask
@@ -1,13 +1,17 @@
 from models.base import ModelBase
-from torchvision import transforms
+from models.preprocess import IMAGENET_MEAN, IMAGENET_STD, InputSpec, Preprocessor
 from PIL.Image import Image
 import torch
-from torchvision import transforms
 from torchvision.models.alexnet import AlexNet_Weights
 from functools import cache
+from models.labels import imagenet_classes
 
 
 class Alexnet(ModelBase):
+    # Resize to 256 then center crop 224 (the torchvision AlexNet preset)
+    input_spec = InputSpec(IMAGENET_MEAN, IMAGENET_STD, resize=256, crop=224)
+    input_names = ("pixel_values",)
+
     def load(self) -> None:
         """Use the init function to load the model
 
@@ -22,20 +26,8 @@ class Alexnet(ModelBase):
         )
         model.eval()
 
-        # Define the preprocess
-        preprocess = transforms.Compose(
-            [
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
-                ),
-            ]
-        )
-
         self.model = model
-        self.preprocess = preprocess
+        self.preprocessor = Preprocessor(self.input_spec)
 
     def alias(self) -> str:
         return "AlexNet"
@@ -43,32 +35,33 @@ class Alexnet(ModelBase):
     def description(self) -> str:
         return "I need to have a description"
 
+    def example_inputs(self) -> tuple:
+        return (torch.zeros(1, 3, 224, 224),)
+
     def classify_image(self, img: Image) -> Image:
         return super().classify_image(img)
 
     def classify_image_raw(self, img: Image) -> list:
-        input_tensor = self.preprocess(img)
+        return self.classify_batch_raw([img])[0]
 
+    def classify_batch_raw(self, imgs: list[Image]) -> list:
         # create a mini-batch as expected by the model
-        input_batch = input_tensor.unsqueeze(0)  # type: ignore
-
-        with torch.no_grad():
-            output = self.model(input_batch)
+        with self.timed("preprocess"):
+            input_batch, _ = self.preprocessor(imgs)
 
-        # The output has unnormalized scores.
-        # To get probabilities, you can run a softmax on it.
-        probabilities = torch.nn.functional.softmax(output[0], dim=0)
+        output = self.forward(input_batch)["logits"]
 
-        # Output labels
-        labels = []
+        with self.timed("postprocess"):
+            # The output has unnormalized scores.
+            # To get probabilities, you can run a softmax on it.
+            probabilities = torch.nn.functional.softmax(output, dim=1)
 
-        # Read the categories
-        with open("src/static/imagenet_classes.txt", "r") as f:
-            categories = [s.strip() for s in f.readlines()]
+            # Show top categories per image (for the whole batch at once)
+            top5_prob, top5_catid = torch.topk(probabilities, 5, dim=1)
 
-        # Show top categories per image
-        top5_prob, top5_catid = torch.topk(probabilities, 5)
-        for i in range(top5_prob.size(0)):
-            labels.append((categories[top5_catid[i]], top5_prob[i].item()))
+            categories = imagenet_classes()
 
-        return labels
+            return [
+                [(categories[catid], prob) for catid, prob in zip(catids, probs)]
+                for catids, probs in zip(top5_catid.tolist(), top5_prob.tolist())
+            ]
@@ -1,26 +1,24 @@
-from models.base import ModelBase
-from PIL.Image import Image as PILImage
+from models.captioning import CaptionModel
 from transformers import BlipProcessor, BlipForConditionalGeneration
-from typing import Dict
 
 
-class Blip(ModelBase):
-
-    # Has the model loaded
-    loaded = False
-
-    # Loaded elements
-    processor = None
-    model = None
-
+class Blip(CaptionModel):
     def load(self) -> None:
-        self.processor = BlipProcessor.from_pretrained(
+        processor = BlipProcessor.from_pretrained(
             "Salesforce/blip-image-captioning-large"
         )
+        self.image_processor = processor.image_processor
+        self.tokenizer = processor.tokenizer
         self.model = BlipForConditionalGeneration.from_pretrained(
             "Salesforce/blip-image-captioning-large"
         )
 
+    def generation_kwargs(self, options: dict) -> dict:
+        # BLIP passes the pad token of its text decoder to generate() itself
+        kwargs = super().generation_kwargs(options)
+        kwargs.pop("pad_token_id")
+        return kwargs
+
     def description(self) -> str:
         return (
             "Bootstrapping Language-Image Pre-training for Unified Vision-Language Understanding and Generation."
@@ -29,11 +27,3 @@ class Blip(ModelBase):
 
     def alias(self) -> str:
         return "Blip"
-
-    def classify_image(self, img: PILImage) -> PILImage:
-        return super().classify_image(img)
-
-    def classify_image_raw(self, img: PILImage) -> dict:
-        inputs = self.processor(img, return_tensors="pt")
-        out_tensor = self.model.generate(**inputs)
-        return {"msg": self.processor.decode(out_tensor[0], skip_special_tokens=True)}
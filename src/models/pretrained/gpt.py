@@ -1,12 +1,8 @@
-from models.base import ModelBase
-from PIL import Image
-from PIL.Image import Image as PILImage
-from typing import Dict
-from transformers import pipeline
-import torch
+from models.captioning import CaptionModel
+from transformers import AutoTokenizer, ViTImageProcessor, VisionEncoderDecoderModel
 
 
-class Gpt(ModelBase):
+class Gpt(CaptionModel):
     def alias(self) -> str:
         return "Gpt"
 
@@ -14,12 +10,12 @@ class Gpt(ModelBase):
         return "GPT"
 
     def load(self) -> None:
-        self.image_to_text = pipeline(
-            "image-to-text", model="nlpconnect/vit-gpt2-image-captioning"
+        self.image_processor = ViTImageProcessor.from_pretrained(
+            "nlpconnect/vit-gpt2-image-captioning"
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            "nlpconnect/vit-gpt2-image-captioning"
+        )
+        self.model = VisionEncoderDecoderModel.from_pretrained(
+            "nlpconnect/vit-gpt2-image-captioning"
         )
-
-    def classify_image_raw(self, img: PILImage) -> dict:
-        return {"msg": self.image_to_text(img)[0]["generated_text"]}
-
-    def classify_image(self, img: PILImage) -> PILImage:
-        return None
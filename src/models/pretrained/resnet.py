@@ -1,19 +1,35 @@
-from typing import Dict, Tuple
+from typing import Dict
 import uuid
-from torch import Tensor
+from models.annotate import draw_boxes
 from models.base import ModelBase
+from models.preprocess import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    InputSpec,
+    Preprocessor,
+    source_size,
+)
 from transformers import DetrImageProcessor, DetrForObjectDetection
+from transformers.models.detr.modeling_detr import DetrObjectDetectionOutput
 from torchvision.io.image import read_image
 import os
 from PIL.Image import Image
 from torchvision.utils import draw_bounding_boxes
 from torchvision.transforms.functional import to_pil_image
 import torch
-from PIL import ImageDraw, ImageFont
 
 
 class Resnet(ModelBase):
+    # Matches the facebook/detr-resnet-50 image processor (padded to the largest image)
+    input_spec = InputSpec(
+        IMAGENET_MEAN, IMAGENET_STD, resize=800, max_size=1333, pad=True
+    )
+    input_names = ("pixel_values", "pixel_mask")
+    output_names = ("logits", "pred_boxes")
+
     def load(self) -> None:
+        self.preprocessor = Preprocessor(self.input_spec)
+        # Only used to post-process the detections
         self.processor = DetrImageProcessor.from_pretrained("facebook/detr-resnet-50")
         self.model = DetrForObjectDetection.from_pretrained("facebook/detr-resnet-50")
 
@@ -23,54 +39,61 @@ class Resnet(ModelBase):
     def description(self) -> str:
         return "The resnet model"
 
-    def classify(self, img: Image) -> Tuple[Dict, list, Tensor]:
-        inputs = self.processor(images=img, return_tensors="pt")
-        outputs = self.model(**inputs)
+    def classify(self, img: Image) -> list[Dict]:
+        # Through the batching scheduler, so concurrent (grid) images share a batch
+        return self.infer_raw(img)
+
+    def classify_batch(self, imgs: list[Image]) -> list[list[Dict]]:
+        # The batch is padded to a common size (with a pixel mask)
+        with self.timed("preprocess"):
+            pixel_values, pixel_mask = self.preprocessor(imgs)
+
+        outputs = DetrObjectDetectionOutput(**self.forward(pixel_values, pixel_mask))
+
+        with self.timed("postprocess"):
+            # convert outputs (bounding boxes and class logits) to COCO API
+            # let's only keep detections with score > 0.8
+            target_sizes = torch.tensor([source_size(img)[::-1] for img in imgs])
+            batch_results = self.processor.post_process_object_detection(
+                outputs, target_sizes=target_sizes, threshold=0.8
+            )
 
-        # convert outputs (bounding boxes and class logits) to COCO API
-        # let's only keep detections with score > 0.9
-        target_sizes = torch.tensor([img.size[::-1]])
-        results = self.processor.post_process_object_detection(
-            outputs, target_sizes=target_sizes, threshold=0.8
-        )[0]
+            id2label = self.model.config.id2label
 
-        formatted_results = []
-        for score, label, box in zip(
-            results["scores"], results["labels"], results["boxes"]
-        ):
-            result = {
-                "box": [round(i, 2) for i in box.tolist()],
-                "label": self.model.config.id2label[label.item()],
-                "score": round(score.item(), 3),
-            }
+            formatted_batch = []
+            for results in batch_results:
+                formatted_results = []
+                for score, label, box in zip(
+                    results["scores"].tolist(),
+                    results["labels"].tolist(),
+                    results["boxes"].tolist(),
+                ):
+                    result = {
+                        "box": [round(i, 2) for i in box],
+                        "label": id2label[label],
+                        "score": round(score, 3),
+                    }
 
-            formatted_results.append(result)
+                    formatted_results.append(result)
 
-        return formatted_results
+                formatted_batch.append(formatted_results)
+
+            return formatted_batch
 
     def classify_image(self, img: Image) -> Image:
         # Run the image through the CNN returning a tuple
         results = self.classify(img)
 
-        draw = ImageDraw.Draw(img)
-        for result in results:
-            # Draw bounding box information
-            draw.rectangle(result["box"], outline="red", width=2)
-
-            # Add the label and score
-            padding = 4
-            x_text = result["box"][0] + padding
-            y_text = result["box"][1] + padding
-            draw.text(
-                (x_text, y_text),
-                f'{result["label"].upper()} (score: {result["score"]})',
-                font=ImageFont.truetype("Poppins-Medium.ttf", 32),
-                fill=(255, 0, 0, 255),
-            )
-
-        # Return the box as a PIL Image
-        return img
+        # Draw the bounding boxes with their label and score (on a copy)
+        labels = [
+            f'{result["label"].upper()} (score: {result["score"]})' for result in results
+        ]
+        with self.timed("annotate"):
+            return draw_boxes(img, [result["box"] for result in results], labels)
 
     def classify_image_raw(self, img) -> list:
         # Get the image data
         return self.classify(img)
+
+    def classify_batch_raw(self, imgs: list[Image]) -> list:
+        return self.classify_batch(imgs)
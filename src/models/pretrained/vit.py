@@ -1,10 +1,14 @@
 from models.base import ModelBase
+from models.preprocess import InputSpec, Preprocessor
 from PIL.Image import Image
-from transformers import AutoImageProcessor, ViTForImageClassification
-import torch
+from transformers import ViTForImageClassification
 
 
 class Vit(ModelBase):
+    # Matches the google/vit-base-patch16-224 image processor
+    input_spec = InputSpec((0.5, 0.5, 0.5), (0.5, 0.5, 0.5), size=(224, 224))
+    input_names = ("pixel_values",)
+
     def alias(self) -> str:
         return "Vit"
 
@@ -12,24 +16,27 @@ class Vit(ModelBase):
         return "VIT Description"
 
     def load(self) -> None:
-        self.processor = AutoImageProcessor.from_pretrained(
-            "google/vit-base-patch16-224"
-        )
+        self.preprocessor = Preprocessor(self.input_spec)
         self.model = ViTForImageClassification.from_pretrained(
             "google/vit-base-patch16-224"
         )
 
     def classify_image_raw(self, img: Image) -> dict:
+        return self.classify_batch_raw([img])[0]
 
-        inputs = self.processor(img, return_tensors="pt")
+    def classify_batch_raw(self, imgs: list[Image]) -> list[dict]:
+        with self.timed("preprocess"):
+            pixel_values, _ = self.preprocessor(imgs)
 
-        with torch.no_grad():
-            logits = self.model(**inputs).logits
+        logits = self.forward(pixel_values)["logits"]
 
-        # model predicts one of the 1000 ImageNet classes
-        predicted_label = logits.argmax(-1).item()
+        with self.timed("postprocess"):
+            # model predicts one of the 1000 ImageNet classes
+            predicted_labels = logits.argmax(-1).tolist()
 
-        return {"msg": self.model.config.id2label[predicted_label]}
+            return [
+                {"msg": self.model.config.id2label[label]} for label in predicted_labels
+            ]
 
     def classify_image(self, img: Image) -> Image:
         return super().classify_image(img)
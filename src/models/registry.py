@@ -0,0 +1,150 @@
+from importlib import import_module, util
+from models.base import ModelBase
+from threading import RLock
+import ast
+import os
+import sys
+
+"""Lightweight discovery of the models available to the inference api
+
+Models are discovered by reading (not importing) the python files within a
+model directory. The alias() and description() of a model are read from its
+source, so the heavy ML libraries a model depends on are only imported once
+the model is actually created.
+"""
+
+# The directory containing the pretrained models shipped with the api
+PRETRAINED_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "pretrained"
+)
+
+# Models are created concurrently when loading at startup, but the lazy modules of
+# libraries such as transformers cannot be imported from several threads at once
+_import_lock = RLock()
+
+
+class ModelSpec:
+    """Describes a model that can be created on demand
+
+    Args:
+        alias (str): The alias of the model
+        description (str): The description of the model
+        module (str): The name of the module containing the model class
+        class_name (str): The name of the model class
+        path (str): The path of the module file
+    """
+
+    def __init__(
+        self, alias: str, description: str, module: str, class_name: str, path: str
+    ) -> None:
+        self.alias = alias
+        self.description = description
+        self.module = module
+        self.class_name = class_name
+        self.path = path
+
+    def create(self) -> ModelBase:
+        """Import the model module and instantiate the model (does not load it)
+
+        Returns:
+            ModelBase: The unloaded model instance
+        """
+        with _import_lock:
+            module = sys.modules.get(self.module)
+
+            if module is None:
+                if os.path.dirname(self.path) == PRETRAINED_DIR:
+                    module = import_module(self.module)
+                else:
+                    spec = util.spec_from_file_location(self.module, self.path)
+                    module = util.module_from_spec(spec)
+                    sys.modules[self.module] = module
+                    try:
+                        spec.loader.exec_module(module)
+                    except BaseException:
+                        # A later create() retries the import from scratch
+                        sys.modules.pop(self.module, None)
+                        raise
+
+        return getattr(module, self.class_name)()
+
+
+def _literal_return(cls: ast.ClassDef, method: str) -> str | None:
+    """Read the literal value returned by a method of a class (without running it)
+
+    Args:
+        cls (ast.ClassDef): The parsed class
+        method (str): The method name (i.e., 'alias')
+
+    Returns:
+        str | None: The returned string, or None if it is not a literal
+    """
+    for node in cls.body:
+        if isinstance(node, ast.FunctionDef) and node.name == method:
+            for statement in node.body:
+                if isinstance(statement, ast.Return) and statement.value is not None:
+                    try:
+                        value = ast.literal_eval(statement.value)
+                    except ValueError:
+                        return None
+                    return value if isinstance(value, str) else None
+    return None
+
+
+def discover(model_dir: str = PRETRAINED_DIR) -> list[ModelSpec]:
+    """Discover the models within a directory. Each file must contain a class
+    named after the capitalised file name (i.e., resnet.py -> Resnet)
+
+    Models whose alias() or description() do not return a literal string are
+    imported to read them (see models/pretrained/README.md)
+
+    Args:
+        model_dir (str): The directory to discover models in
+
+    Returns:
+        list[ModelSpec]: The discovered models (sorted by file name)
+    """
+    specs = []
+
+    if os.path.realpath(model_dir) == PRETRAINED_DIR:
+        package = "models.pretrained"
+    else:
+        package = f"models.external.{os.path.basename(os.path.normpath(model_dir))}"
+
+    for file in sorted(os.listdir(model_dir)):
+        if not file.endswith(".py"):
+            continue
+
+        module_name = os.path.splitext(file)[0]
+        class_name = module_name.capitalize()
+        path = os.path.join(os.path.realpath(model_dir), file)
+
+        with open(path, "r") as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        cls = next(
+            (
+                node
+                for node in tree.body
+                if isinstance(node, ast.ClassDef) and node.name == class_name
+            ),
+            None,
+        )
+        if cls is None:
+            continue
+
+        alias = _literal_return(cls, "alias")
+        description = _literal_return(cls, "description")
+        spec = ModelSpec(
+            alias, description, f"{package}.{module_name}", class_name, path
+        )
+
+        # Fall back to importing the model for dynamic metadata
+        if alias is None or description is None:
+            model = spec.create()
+            spec.alias = model.alias()
+            spec.description = model.description()
+
+        specs.append(spec)
+
+    return specs
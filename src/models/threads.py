@@ -0,0 +1,156 @@
+from threading import Lock
+import os
+import config
+
+"""The CPU thread budget shared by the models and the request fan-out pools
+
+Left alone, every torch model uses all cores for its intra-op work while the
+request pools fan out to many more threads, so a busy process runs far more
+runnable threads than it has cores. Instead, a budget of threads
+(INFERENCE_THREAD_BUDGET, every usable core by default) is split:
+
+    model threads   Each model runs its forward passes with its own intra-op
+                    thread count (INFERENCE_INTRA_OP_THREADS, can be set per
+                    model). By default the budget is split between the models
+                    loaded at startup. The count is applied on the
+                    micro-batching worker of the model (torch keeps it per thread)
+    fan-out         Request pools calling into a model are sized so that the
+                    model stays within the budget (see ThreadBudget.fanout)
+    affinity        Model workers can be pinned to a core set
+                    (INFERENCE_CPU_AFFINITY): 'auto' assigns disjoint core sets
+                    in load order, or a core list such as '0-3,8' (per model).
+                    Linux only
+"""
+
+
+def available_cpus() -> list[int]:
+    """The cores the process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # Not supported on this platform
+        return list(range(os.cpu_count() or 1))
+
+
+def parse_cpus(value: str) -> list[int]:
+    """Parse a core list such as '0-3,8' into [0, 1, 2, 3, 8]"""
+    cpus = []
+
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+
+    return cpus
+
+
+def configure_thread(threads: int | None, cpus: list[int] | None = None) -> None:
+    """Apply the intra-op thread count (and core set) of a model to the calling
+    thread, i.e. the micro-batching worker of the model
+
+    Args:
+        threads (int, optional): The intra-op thread count
+        cpus (list[int], optional): The cores to pin the thread to
+    """
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"Unable to pin a model worker to cores {cpus}: {e}")
+
+    if threads:
+        import torch
+
+        # Reading the count first initialises the threading of this thread, which
+        # would otherwise reset the count on the first operation
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+
+class ThreadBudget:
+    """Splits a budget of CPU threads between the models (see the module docs)
+
+    Args:
+        total (int): The thread budget (0 for every usable core)
+    """
+
+    def __init__(self, total: int = config.THREAD_BUDGET) -> None:
+        self.cpus = available_cpus()
+        self.total = total if total > 0 else len(self.cpus)
+        self.sharing = 1
+
+        self._next_cpu = 0
+        self._assigned: dict[str, tuple[int, list[int] | None]] = {}
+        self._lock = Lock()
+
+    def share(self, models: int) -> None:
+        """Split the default intra-op threads between an amount of models"""
+        self.sharing = max(1, models)
+
+    def assign(self, alias: str) -> tuple[int, list[int] | None]:
+        """Assign a model its intra-op threads and core set (once per model)
+
+        Args:
+            alias (str): The model alias
+
+        Returns:
+            tuple[int, list[int] | None]: The thread count and the cores the model
+            is pinned to (None when it is not pinned)
+        """
+        with self._lock:
+            if alias in self._assigned:
+                return self._assigned[alias]
+
+            threads = config.model_option(
+                "INTRA_OP_THREADS", alias, config.INTRA_OP_THREADS
+            )
+            if threads <= 0:
+                threads = max(1, self.total // self.sharing)
+
+            affinity = config.model_option("CPU_AFFINITY", alias, config.CPU_AFFINITY)
+            if affinity == "auto":
+                cpus = [
+                    self.cpus[(self._next_cpu + i) % len(self.cpus)]
+                    for i in range(min(threads, len(self.cpus)))
+                ]
+                self._next_cpu += len(cpus)
+            else:
+                cpus = parse_cpus(affinity) or None
+
+            self._assigned[alias] = (threads, cpus)
+            return threads, cpus
+
+    def stats(self) -> dict:
+        """Returns the budget and the threads and cores assigned to each model"""
+        with self._lock:
+            return {
+                "total": self.total,
+                "cpus": self.cpus,
+                "models": {
+                    alias: {"threads": threads, "cpus": cpus}
+                    for alias, (threads, cpus) in self._assigned.items()
+                },
+            }
+
+    def fanout(self, model) -> int:
+        """The amount of threads a request should call into a model with.
+        Batched models queue on their scheduler, so a batch worth of callers
+        keeps them busy. Other models run on the calling threads, so their
+        callers are limited to what fits the budget
+
+        Args:
+            model (ModelBase): The model
+
+        Returns:
+            int: The amount of threads
+        """
+        if model.scheduler is not None:
+            return model.scheduler.max_batch_size
+
+        return max(1, self.total // (model.threads or self.total))
+
+
+# The process wide thread budget
+budget = ThreadBudget()
@@ -0,0 +1,242 @@
+from collections import deque
+from threading import Lock, local
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import tempfile
+import time
+import uuid
+import config
+
+"""On-demand profiling of single requests
+
+A request carrying the configured token in its X-Profile-Token header is run
+under cProfile (the Python time of the request thread, i.e. lib.py) and, when
+torch is installed, torch.profiler (the operator level time of the forward
+passes). The profiled request runs its inference on the request thread instead
+of the micro-batching scheduler, so both profilers see its forward pass (torch
+versions that support it also profile the operators of every other thread). A
+capture lasts until the response has been sent, so streamed responses are
+profiled until their last line. The files of a trace:
+
+    torch.json    Chrome trace of the torch operators (chrome://tracing, Perfetto)
+    stacks.txt    Collapsed Python stacks of the operators (flamegraph.pl)
+    python.prof   cProfile statistics (pstats, snakeviz)
+    python.txt    The functions with the highest cumulative time
+
+Only one request is profiled at a time. The most recent traces are kept in a
+ring buffer (INFERENCE_PROFILING_MAX_TRACES) and listed and downloaded through
+the /api/admin/profiles endpoints (with the same token).
+"""
+
+HEADER = "X-Profile-Token"
+
+MIMETYPES = {
+    "torch.json": "application/json",
+    "stacks.txt": "text/plain",
+    "python.prof": "application/octet-stream",
+    "python.txt": "text/plain",
+}
+
+
+# Whether the current thread is being profiled
+_state = local()
+
+
+def enabled() -> bool:
+    return bool(config.PROFILING_TOKEN)
+
+
+def active() -> bool:
+    """Whether the current thread is running a profiled request"""
+    return getattr(_state, "active", False)
+
+
+def authorized(token: str | None) -> bool:
+    """Whether a token matches the configured (non empty) profiling token"""
+    if not enabled() or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), config.PROFILING_TOKEN.encode())
+
+
+class Trace:
+    """The files captured while profiling a request
+
+    Args:
+        method (str): The request method
+        path (str): The request path (with its query string)
+    """
+
+    def __init__(self, method: str, path: str) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.method = method
+        self.path = path
+        self.model = ""
+        self.status = 0
+        self.seconds = 0.0
+        self.files: dict[str, bytes] = {}
+
+    def describe(self) -> dict:
+        return {
+            "id": self.id,
+            "created": self.created,
+            "method": self.method,
+            "path": self.path,
+            "model": self.model,
+            "status": self.status,
+            "seconds": round(self.seconds, 4),
+            "files": {name: len(data) for name, data in self.files.items()},
+        }
+
+
+class Capture:
+    """Profiles the current thread (cProfile) and the torch operators of the
+    process (torch.profiler) between start() and stop()
+
+    Args:
+        trace (Trace): The trace the captured files are stored in
+    """
+
+    def __init__(self, trace: Trace) -> None:
+        self.trace = trace
+        self._python = cProfile.Profile()
+        self._torch = None
+        self._started = 0.0
+
+    def start(self) -> None:
+        try:
+            from torch.profiler import ProfilerActivity, profile
+
+            # Verbose traces carry the Python stacks (for stacks.txt), newer torch
+            # versions can also profile the operators of every thread
+            kwargs = {}
+            try:
+                from torch._C._profiler import _ExperimentalConfig
+
+                try:
+                    experimental = _ExperimentalConfig(
+                        verbose=True, profile_all_threads=True
+                    )
+                except TypeError:
+                    experimental = _ExperimentalConfig(verbose=True)
+                kwargs["experimental_config"] = experimental
+            except ImportError:
+                pass
+
+            self._torch = profile(
+                activities=[ProfilerActivity.CPU],
+                record_shapes=True,
+                with_stack=True,
+                **kwargs,
+            )
+            self._torch.__enter__()
+        except ImportError:
+            self._torch = None
+
+        _state.active = True
+        self._started = time.perf_counter()
+        self._python.enable()
+
+    def stop(self) -> Trace:
+        """Stop profiling and store the captured files in the trace. Called from
+        the thread that started the capture"""
+        self._python.disable()
+        self.trace.seconds = time.perf_counter() - self._started
+        _state.active = False
+
+        if self._torch is not None:
+            self._torch.__exit__(None, None, None)
+            self.trace.files.update(self._export_torch())
+
+        self.trace.files.update(self._export_python())
+        return self.trace
+
+    def _export_torch(self) -> dict[str, bytes]:
+        files = {}
+
+        with tempfile.TemporaryDirectory(prefix="profile-") as directory:
+            chrome = os.path.join(directory, "trace.json")
+            self._torch.export_chrome_trace(chrome)
+
+            stacks = os.path.join(directory, "stacks.txt")
+            self._torch.export_stacks(stacks, "self_cpu_time_total")
+
+            for name, path in (("torch.json", chrome), ("stacks.txt", stacks)):
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        files[name] = f.read()
+
+        return files
+
+    def _export_python(self) -> dict[str, bytes]:
+        summary = io.StringIO()
+        stats = pstats.Stats(self._python, stream=summary)
+        stats.sort_stats("cumulative").print_stats(50)
+
+        with tempfile.TemporaryDirectory(prefix="profile-") as directory:
+            path = os.path.join(directory, "python.prof")
+            stats.dump_stats(path)
+            with open(path, "rb") as f:
+                prof = f.read()
+
+        return {"python.prof": prof, "python.txt": summary.getvalue().encode()}
+
+
+class Profiler:
+    """Runs one capture at a time and keeps the most recent traces
+
+    Args:
+        max_traces (int): The size of the trace ring buffer
+    """
+
+    def __init__(self, max_traces: int) -> None:
+        self.traces: deque[Trace] = deque(maxlen=max(1, max_traces))
+        self._busy = Lock()
+        self._lock = Lock()
+
+    def start(self, method: str, path: str) -> Capture | None:
+        """Start profiling a request
+
+        Returns:
+            Capture | None: The running capture (None when another request is
+            being profiled)
+        """
+        if not self._busy.acquire(blocking=False):
+            return None
+
+        try:
+            capture = Capture(Trace(method, path))
+            capture.start()
+        except Exception:
+            self._busy.release()
+            raise
+
+        return capture
+
+    def stop(self, capture: Capture) -> Trace:
+        """Stop a capture and keep its trace (dropping the oldest trace when full)"""
+        try:
+            trace = capture.stop()
+        finally:
+            self._busy.release()
+
+        with self._lock:
+            self.traces.append(trace)
+
+        return trace
+
+    def list(self) -> list[dict]:
+        """Describe the kept traces (newest first)"""
+        with self._lock:
+            return [trace.describe() for trace in reversed(self.traces)]
+
+    def find(self, id: str) -> Trace | None:
+        with self._lock:
+            return next((trace for trace in self.traces if trace.id == id), None)
+
+
+# The process wide profiler
+profiler = Profiler(config.PROFILING_MAX_TRACES)
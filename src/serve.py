@@ -0,0 +1,124 @@
+from werkzeug.serving import make_server
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+"""Multi-process serving with model weights shared across the workers
+
+The parent process loads the models once, moves their weights into shared
+memory and then forks the workers. Every worker serves the same listening
+socket and attaches to the parents weights read-only, so adding a worker does
+not add another copy of every model. Example (from the repository root):
+
+    INFERENCE_LOAD_MODE=eager python src/serve.py --workers 4 --port 5000
+
+The workers are forked once the model loaders (and the torch threads they
+started) have exited. Only models loaded before forking are shared ('eager'
+mode, or the models in INFERENCE_PRELOAD in 'lazy' mode). Models loaded later
+are loaded per worker.
+Requires a platform that supports fork (i.e., Linux).
+"""
+
+
+def run_worker(app, sock: socket.socket) -> None:
+    """Serve the app on an inherited listening socket (runs within a worker)"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def wait_for_threads(timeout: float = 30) -> None:
+    """Wait until the main thread is the only thread of the process. fork() only
+    copies the calling thread, so a lock held by any other thread (i.e., a model
+    loader or a torch thread pool) would never be released within the workers
+
+    Raises:
+        SystemExit: Other threads are still running after the timeout
+    """
+    deadline = time.monotonic() + timeout
+
+    while len(os.listdir("/proc/self/task")) > 1:
+        if time.monotonic() > deadline:
+            names = [thread.name for thread in threading.enumerate()]
+            raise SystemExit(f"Unable to fork the workers, threads running: {names}")
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the api from several worker processes"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    # The models have to be loaded before forking (not on a background thread)
+    os.environ["INFERENCE_LOAD_IN_BACKGROUND"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+    from app import app, model_controller
+
+    shared = model_controller.share_weights()
+    print(f"Shared {shared / 1024 / 1024:.1f} MB of model weights across workers")
+
+    # Stop the garbage collector from touching (and copying) the parents objects
+    gc.collect()
+    gc.freeze()
+
+    wait_for_threads()
+
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    sock.set_inheritable(True)
+
+    workers: set[int] = set()
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        spawn()
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers")
+
+    # Replace workers that exit unexpectedly
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker [{pid}] exited, starting a replacement")
+            spawn()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+from base64 import b64decode
+from binascii import Error as Base64Error
+from flask import Request
+from werkzeug.datastructures import FileStorage
+from fetch import PREFETCHED, DecodeSize, FetchError, FetchResult, fetcher
+import os
+import config
+import metrics
+
+"""Images uploaded with an /api/enrich request, instead of being fetched from src
+
+Three kinds of uploads are accepted:
+
+    raw         A POST body holding an image (Content-Type image/* or
+                application/octet-stream). The other parameters are read from
+                the query string
+    multipart   A multipart/form-data POST with any amount of image files. The
+                other parameters are read from the form fields and query string
+    base64      'data:' URIs (i.e., data:image/png;base64,...) in place of src
+                URLs (JSON body, form fields or query string)
+
+Every upload takes the place of a src labelled 'upload:<index>' (followed by
+the filename of a multipart file), which labels its result. Uploaded files are
+decoded straight from the spooled request part and raw bodies from a single
+read of the request stream, each within INFERENCE_UPLOAD_MAX_BYTES. The decoded
+images are registered like prefetched src images (see fetch.PREFETCHED), so
+they go through the same classify / classify_group paths as downloaded images.
+"""
+
+# The prefix of the src labels of uploaded images
+UPLOAD_PREFIX = "upload:"
+
+# The content types of a raw image body
+RAW_TYPES = ("application/octet-stream",)
+
+
+class UploadError(Exception):
+    """Raised when the uploads of a request exceed the limits"""
+
+    status = 413
+
+
+def is_upload(request: Request) -> bool:
+    """Whether the body of a POST request is a raw or multipart image upload"""
+    mimetype = request.mimetype
+    return request.method == "POST" and (
+        mimetype.startswith("image/")
+        or mimetype in RAW_TYPES
+        or mimetype == "multipart/form-data"
+    )
+
+
+def upload_params(request: Request) -> dict:
+    """Read the parameters of an upload request from its query string and form
+    fields. Repeated parameters (i.e., model) become lists and whole numbers are
+    read as integers (i.e., tile_size), like their JSON body counterparts
+
+    Args:
+        request (Request): The upload request
+
+    Returns:
+        dict: The parameters (form fields take precedence over the query string)
+    """
+    params = {}
+
+    for source in (request.args, request.form):
+        for key in source:
+            values = [
+                int(value) if value.isdigit() else value
+                for value in source.getlist(key)
+            ]
+            params[key] = values[0] if len(values) == 1 else values
+
+    return params
+
+
+def decode_upload(label: str, data, size: DecodeSize | None = None) -> FetchResult:
+    """Decode an uploaded image (bytes or a binary file), capturing any error"""
+    try:
+        with metrics.Timer(metrics.FETCH_SECONDS, "decode"):
+            return FetchResult(label, image=fetcher.decode(data, size))
+    except FetchError as e:
+        return FetchResult(label, error=str(e))
+    except Exception as e:
+        return FetchResult(
+            label, error=f"unable to process upload ({type(e).__name__})"
+        )
+
+
+def decode_data_uri(
+    label: str, uri: str, max_bytes: int, size: DecodeSize | None = None
+) -> FetchResult:
+    """Decode a base64 'data:' URI into an image (within a maximum size)"""
+    header, separator, payload = uri.partition(",")
+    if not separator or not header.endswith(";base64"):
+        return FetchResult(label, error="data URIs must be base64 encoded")
+
+    # Checked before decoding, 4 base64 characters encode 3 bytes
+    if len(payload) // 4 * 3 > max_bytes:
+        return FetchResult(label, error=f"image is larger than {max_bytes} bytes")
+
+    try:
+        data = b64decode(payload, validate=True)
+    except (Base64Error, ValueError):
+        return FetchResult(label, error="data URI is not valid base64")
+
+    return decode_upload(label, data, size)
+
+
+def read_file(
+    label: str, file: FileStorage, max_bytes: int, size: DecodeSize | None = None
+) -> FetchResult:
+    """Decode an uploaded multipart file in place (within a maximum size)"""
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    length = stream.tell()
+    stream.seek(0)
+
+    if length > max_bytes:
+        return FetchResult(label, error=f"image is larger than {max_bytes} bytes")
+
+    return decode_upload(label, stream, size)
+
+
+def read_body(
+    label: str, request: Request, max_bytes: int, size: DecodeSize | None = None
+) -> FetchResult:
+    """Decode a raw image body, read once from the request stream (within a
+    maximum size)"""
+    if request.content_length is not None and request.content_length > max_bytes:
+        return FetchResult(label, error=f"image is larger than {max_bytes} bytes")
+
+    data = request.stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        return FetchResult(label, error=f"image is larger than {max_bytes} bytes")
+
+    return decode_upload(label, data, size)
+
+
+def receive_uploads(
+    request: Request,
+    src: list,
+    size: DecodeSize | None = None,
+    max_bytes: int = config.UPLOAD_MAX_BYTES,
+    max_files: int = config.UPLOAD_MAX_FILES,
+) -> list:
+    """Decode the images uploaded with a request, and register them as
+    prefetched src images (see the module docs)
+
+    Args:
+        request (Request): The request
+        src (list): The src URLs of the request ('data:' URIs are decoded)
+        size (DecodeSize, optional): The size the images are needed at (see
+        lib.decode_size)
+        max_bytes (int, optional): The maximum size of an uploaded image
+        max_files (int, optional): The maximum amount of uploaded images
+
+    Raises:
+        UploadError: More than max_files images were uploaded
+
+    Returns:
+        list: The src URLs, with each upload replaced by its label (the data URIs
+        in place, followed by the raw body or the multipart files)
+    """
+    uploads: dict[str, FetchResult] = {}
+
+    def label(name: str | None = None) -> str:
+        if len(uploads) >= max_files:
+            raise UploadError(f"at most {max_files} images can be uploaded at once")
+        return f"{UPLOAD_PREFIX}{len(uploads)}" + (f"/{name}" if name else "")
+
+    labelled = []
+    for url in src:
+        if isinstance(url, str) and url.startswith("data:"):
+            name = label()
+            uploads[name] = decode_data_uri(name, url, max_bytes, size)
+            url = name
+        labelled.append(url)
+
+    if is_upload(request):
+        if request.mimetype == "multipart/form-data":
+            for key in request.files:
+                for file in request.files.getlist(key):
+                    name = label(file.filename)
+                    uploads[name] = read_file(name, file, max_bytes, size)
+                    labelled.append(name)
+        else:
+            name = label()
+            uploads[name] = read_body(name, request, max_bytes, size)
+            labelled.append(name)
+
+    if uploads:
+        request.environ.setdefault(PREFETCHED, {}).update(uploads)
+
+    return labelled
+
+
+def is_uploaded(url: str) -> bool:
+    """Whether a src is the label of an uploaded image"""
+    return url.startswith(UPLOAD_PREFIX)
@@ -0,0 +1,129 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from threading import Lock, Thread
+from PIL import Image
+import os
+import sys
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
+
+"""Shared fixtures: a local HTTP stand-in for the origins src images come from"""
+
+
+def jpeg(size: tuple[int, int] = (64, 64)) -> bytes:
+    """Encode a plain JPEG image"""
+    output = BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(output, "JPEG")
+    return output.getvalue()
+
+
+class StandinServer:
+    """Serves the routes of StandinHandler on a background thread, and tracks
+    how many requests it serves at once
+
+    Routes:
+        /image              A JPEG image
+        /slow-image         A JPEG image, after `delay` seconds
+        /missing            A 404
+        /text               A text (non image) body
+        /stall              Headers, then nothing for `delay` seconds
+        /trickle            A byte every 0.05s for `delay` seconds
+        /large-declared     A Content-Length beyond any test limit (no body)
+        /large-undeclared   `size` bytes without a Content-Length
+    """
+
+    def __init__(self) -> None:
+        self.image = jpeg()
+        self.delay = 1.0
+        self.size = 1024 * 1024
+
+        self.active = 0
+        self.peak = 0
+        self._lock = Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        """Returns the URL of a route"""
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def _handler(self) -> type:
+        standin = self
+
+        class StandinHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with standin._lock:
+                    standin.active += 1
+                    standin.peak = max(standin.peak, standin.active)
+                try:
+                    self.route()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client gave up (i.e., a timeout)
+                finally:
+                    with standin._lock:
+                        standin.active -= 1
+
+            def send(self, body: bytes, content_type: str = "image/jpeg"):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def route(self):
+                match self.path.partition("?")[0]:
+                    case "/image":
+                        self.send(standin.image)
+                    case "/slow-image":
+                        time.sleep(standin.delay)
+                        self.send(standin.image)
+                    case "/text":
+                        self.send(b"not an image", "text/plain")
+                    case "/stall":
+                        self.send_response(200)
+                        self.send_header("Content-Length", "1000")
+                        self.end_headers()
+                        self.wfile.flush()
+                        time.sleep(standin.delay)
+                    case "/trickle":
+                        self.send_response(200)
+                        self.end_headers()
+                        stop = time.monotonic() + standin.delay
+                        while time.monotonic() < stop:
+                            self.wfile.write(b"x")
+                            self.wfile.flush()
+                            time.sleep(0.05)
+                    case "/large-declared":
+                        self.send_response(200)
+                        self.send_header("Content-Length", str(1024**3))
+                        self.end_headers()
+                    case "/large-undeclared":
+                        self.send_response(200)
+                        self.end_headers()
+                        self.wfile.write(b"x" * standin.size)
+                    case _:
+                        self.send_error(404)
+
+        return StandinHandler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def origin():
+    """A local stand-in for the origin of src images"""
+    with StandinServer() as server:
+        yield server
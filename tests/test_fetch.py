@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor
+from fetch import ImageFetcher
+import socket
+import time
+
+"""The download limits of ImageFetcher, against a local stand-in origin"""
+
+
+def timed_fetch(fetcher: ImageFetcher, url: str):
+    """Fetch a URL, returning the result and the seconds it took"""
+    started = time.monotonic()
+    result = fetcher.fetch(url)
+    return result, time.monotonic() - started
+
+
+def test_fetch_all_reports_each_url_in_order(origin):
+    urls = [origin.url(path) for path in ("/image", "/missing", "/text", "/image")]
+    results = ImageFetcher(min_size=1).fetch_all(urls)
+
+    assert [result.url for result in results] == urls
+    assert results[0].image is not None and results[0].error is None
+    assert results[1].image is None and "HTTPError" in results[1].error
+    assert results[2].image is None and "not a supported image" in results[2].error
+    assert results[3].image is not None
+
+
+def test_connect_timeout():
+    # A listening socket whose backlog is never accepted from stalls new
+    # connections on some platforms, and refuses them on others
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(0)
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}/image"
+
+        fetcher = ImageFetcher(connect_timeout=0.5, read_timeout=0.5)
+        result, seconds = timed_fetch(fetcher, url)
+
+    assert result.image is None
+    assert "download failed" in result.error
+    assert seconds < 3
+
+
+def test_read_timeout(origin):
+    origin.delay = 3
+    fetcher = ImageFetcher(read_timeout=0.3)
+    result, seconds = timed_fetch(fetcher, origin.url("/stall"))
+
+    assert "download failed" in result.error
+    assert seconds < 2
+
+
+def test_read_timeout_is_capped_to_the_total_timeout(origin):
+    origin.delay = 3
+    fetcher = ImageFetcher(read_timeout=10, total_timeout=0.3)
+    result, seconds = timed_fetch(fetcher, origin.url("/stall"))
+
+    assert result.image is None
+    assert seconds < 2
+
+
+def test_total_timeout(origin):
+    # Every read succeeds, but the body as a whole takes too long
+    origin.delay = 3
+    fetcher = ImageFetcher(read_timeout=1, total_timeout=0.5)
+    result, seconds = timed_fetch(fetcher, origin.url("/trickle"))
+
+    assert "download took longer than 0.5s" in result.error
+    # Checked as chunks arrive, so it can overrun by up to the read timeout
+    assert seconds < 0.5 + 1 + 0.5
+
+
+def test_max_bytes_from_content_length(origin):
+    fetcher = ImageFetcher(max_bytes=1024)
+    result, seconds = timed_fetch(fetcher, origin.url("/large-declared"))
+
+    assert result.error == "image is larger than 1024 bytes"
+    assert seconds < 1
+
+
+def test_max_bytes_from_the_body(origin):
+    origin.size = 512 * 1024
+    fetcher = ImageFetcher(max_bytes=100 * 1024)
+    result, _ = timed_fetch(fetcher, origin.url("/large-undeclared"))
+
+    assert result.error == "image is larger than 102400 bytes"
+
+
+def test_max_workers_caps_a_single_request(origin):
+    origin.delay = 0.2
+    fetcher = ImageFetcher(max_workers=2, max_concurrent=16, min_size=1)
+    results = fetcher.fetch_all([origin.url(f"/slow-image?{i}") for i in range(6)])
+
+    assert all(result.image is not None for result in results)
+    assert origin.peak == 2
+
+
+def test_max_concurrent_caps_the_process(origin):
+    origin.delay = 0.2
+    fetcher = ImageFetcher(max_workers=4, max_concurrent=3, min_size=1)
+
+    def request(i: int) -> list:
+        return fetcher.fetch_all(
+            [origin.url(f"/slow-image?{i}-{j}") for j in range(4)]
+        )
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        batches = list(pool.map(request, range(3)))
+
+    assert all(result.image is not None for batch in batches for result in batch)
+    assert origin.peak == 3
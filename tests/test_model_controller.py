@@ -0,0 +1,46 @@
+from models.memory import current_rss
+from models.model_controller import ModelController
+import pytest
+
+"""Loading and evicting models with the ModelController"""
+
+MODEL = '''from models.base import ModelBase
+
+
+class {name}(ModelBase):
+    def alias(self) -> str:
+        return "{name}"
+
+    def description(self) -> str:
+        return "Holds a buffer"
+
+    def load(self) -> None:
+        self.buffer = bytearray(1024)
+
+    def classify_image(self, img):
+        return img
+
+    def classify_image_raw(self, img):
+        return []
+'''
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    (tmp_path / "first.py").write_text(MODEL.format(name="First"))
+    return str(tmp_path)
+
+
+@pytest.mark.skipif(current_rss() == 0, reason="reading the RSS requires Linux")
+def test_a_model_in_use_is_evicted_once_it_is_released(model_dir):
+    # Any process exceeds a 1 byte budget, so every idle model is evicted
+    controller = ModelController("lazy", [], memory_budget=1, model_dir=model_dir)
+    first = controller.find_model("First")
+
+    controller.acquire(first)
+    assert controller.model_stats()["First"]["status"] == "ready"
+    assert hasattr(first, "buffer")
+
+    controller.release(first)
+    assert controller.model_stats()["First"]["status"] == "unloaded"
+    assert not hasattr(first, "buffer")
@@ -0,0 +1,84 @@
+from models.ocr import CliEngine, TesserocrEngine
+from PIL import Image
+import os
+import sys
+import types
+import pytest
+
+"""The OCR engines, with stand-ins for tesseract (nothing is recognised)"""
+
+# Fails on a list with an image over 1000 bytes, else prints a word per page
+TESSERACT = """#!/bin/sh
+for path in $(cat "$1"); do
+  if [ $(wc -c < "$path") -gt 1000 ]; then
+    echo "Error in pixReadStream: unreadable image" >&2
+    exit 1
+  fi
+done
+pages=$(wc -l < "$1")
+page=1
+while [ $page -le $pages ]; do
+  printf "5\\t$page\\t1\\t1\\t1\\t1\\t0\\t0\\t5\\t5\\t90\\tword\\n"
+  page=$((page + 1))
+done
+"""
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="the stand-in is a shell script")
+def test_cli_engine_reports_a_failed_image_in_its_own_result(tmp_path):
+    cmd = tmp_path / "tesseract"
+    cmd.write_text(TESSERACT)
+    cmd.chmod(0o755)
+
+    blank = Image.new("RGB", (10, 10))
+    noise = Image.frombytes("RGB", (100, 100), os.urandom(100 * 100 * 3))
+    results = CliEngine(2, "eng", cmd=str(cmd)).recognize([blank, noise, blank])
+
+    assert [result.text for result in results] == ["word", "", "word"]
+    assert results[0].error is None and results[2].error is None
+    assert results[1].error == (
+        "tesseract exited with status 1: Error in pixReadStream: unreadable image"
+    )
+
+
+class StandinApi:
+    """Records the Tesseract API instances that were created and ended"""
+
+    created: list = []
+    ended: list = []
+    fail_after: int | None = None
+
+    def __init__(self, lang: str, **kwargs) -> None:
+        if len(StandinApi.created) == StandinApi.fail_after:
+            raise RuntimeError("Failed to init API, possibly an invalid tessdata path")
+        StandinApi.created.append(self)
+
+    def End(self) -> None:
+        StandinApi.ended.append(self)
+
+
+@pytest.fixture
+def tesserocr(monkeypatch):
+    StandinApi.created, StandinApi.ended, StandinApi.fail_after = [], [], None
+    module = types.SimpleNamespace(PyTessBaseAPI=StandinApi)
+    monkeypatch.setitem(sys.modules, "tesserocr", module)
+    return StandinApi
+
+
+def test_tesserocr_engine_close_ends_every_api(tesserocr):
+    engine = TesserocrEngine(3, "eng")
+    engine.close()
+
+    assert len(tesserocr.ended) == 3
+    assert tesserocr.ended == tesserocr.created
+    with pytest.raises(RuntimeError):
+        engine._pool.submit(print)
+
+
+def test_tesserocr_engine_ends_the_apis_created_before_a_failure(tesserocr):
+    tesserocr.fail_after = 2
+
+    with pytest.raises(RuntimeError):
+        TesserocrEngine(3, "eng")
+
+    assert len(tesserocr.ended) == 2
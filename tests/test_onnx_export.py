@@ -0,0 +1,34 @@
+import os
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnxscript")  # The dynamo exporter of torch.onnx
+
+from export_onnx import check, export  # noqa: E402
+from models.registry import discover  # noqa: E402
+
+"""ONNX parity: the exported stand-in models match their torch outputs"""
+
+STANDINS = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "benchmarks", "standins"
+)
+
+ATOL = 1e-4
+
+
+@pytest.fixture(scope="module")
+def standins() -> dict:
+    """The stand-in model specs (random weights) by alias"""
+    return {spec.alias: spec for spec in discover(STANDINS)}
+
+
+@pytest.mark.parametrize("alias", ["AlexNet", "Vit", "ResNet"])
+def test_onnx_outputs_match_torch(standins, alias, tmp_path):
+    model = standins[alias].create()
+    model.load()
+
+    path = str(tmp_path / f"{alias.lower()}.onnx")
+    export(model, path, opset=18)
+    result = check(model, path, ATOL)
+
+    assert result["match"], result["max_abs_difference"]
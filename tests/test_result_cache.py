@@ -0,0 +1,41 @@
+from PIL import Image
+from lib import classify, classify_group
+from models.base import ModelBase
+
+"""Result cache keys: results computed by different code paths never collide"""
+
+
+class EchoModel(ModelBase):
+    """A model whose raw and model.execute() results differ for the same format"""
+
+    def alias(self) -> str:
+        return "Echo"
+
+    def description(self) -> str:
+        return "Returns where its result was computed"
+
+    def load(self) -> None:
+        pass
+
+    def classify_image(self, img: Image.Image) -> Image.Image:
+        return img
+
+    def classify_image_raw(self, img: Image.Image) -> list:
+        return ["raw"]
+
+    def execute(self, mode: str, img: Image.Image, format: str):
+        return f"execute-{format}"
+
+
+def test_execute_and_raw_json_results_are_cached_apart():
+    model = EchoModel()
+    img = Image.new("RGB", (64, 64), (1, 2, 3))
+
+    # i.e. a GET format=json, then a POST json for the same image
+    assert classify(img, model, "json") == "execute-json"
+    assert classify_group([img], model, "json") == [["raw"]]
+
+    # And the other way around
+    other = Image.new("RGB", (64, 64), (4, 5, 6))
+    assert classify_group([other], model, "json") == [["raw"]]
+    assert classify(other, model, "json") == "execute-json"
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+import requests
+
+"""Memory of multi-process serving (src/serve.py) with the stand-in models
+
+The proportional set size (PSS) splits shared pages between the processes
+sharing them, so the total PSS is the real memory cost of the server. With the
+weights shared across the workers each extra worker stays well below the size
+of the models
+"""
+
+pytestmark = pytest.mark.skipif(
+    not (hasattr(os, "fork") and os.path.exists("/proc/self/smaps_rollup")),
+    reason="forking workers and reading their PSS requires Linux",
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+STANDINS = os.path.join(ROOT, "benchmarks", "standins")
+
+# The PSS an extra worker may add (the stand-in weights alone are ~1 GB)
+MAX_EXTRA_MB = 150
+
+
+def free_port() -> int:
+    """Returns a free TCP port on the loopback interface"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int) -> list[int]:
+    """Returns the child process ids of a process"""
+    pids = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            pids.extend(int(child) for child in f.read().split())
+    return pids
+
+
+def pss(pid: int) -> float:
+    """Returns the PSS of a process (in MB)"""
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+@contextmanager
+def serve(workers: int, timeout: float = 300):
+    """Start src/serve.py with the stand-in models, yields the server process
+    and its base URL once it answers /ping"""
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "src/serve.py",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+        ],
+        cwd=ROOT,
+        env={
+            **os.environ,
+            "INFERENCE_MODEL_DIR": STANDINS,
+            "INFERENCE_LOAD_MODE": "eager",
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            assert process.poll() is None, "serve.py exited before it was ready"
+            assert time.monotonic() < deadline, "serve.py did not start in time"
+            try:
+                if requests.get(f"{base}/ping", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+
+        yield process, base
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def total_pss(workers: int, src: str) -> float:
+    """The total PSS of the server with a number of workers, after running
+    inference so that every worker touches the model weights"""
+    with serve(workers) as (process, base):
+
+        def enrich(_) -> int:
+            return requests.post(
+                f"{base}/api/enrich",
+                json={"src": [src], "model": "AlexNet", "format": "json"},
+                timeout=120,
+            ).status_code
+
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            statuses = list(pool.map(enrich, range(workers * 8)))
+        assert statuses == [200] * len(statuses)
+
+        workers_pids = children(process.pid)
+        assert len(workers_pids) == workers
+
+        return pss(process.pid) + sum(pss(pid) for pid in workers_pids)
+
+
+def test_extra_workers_share_the_model_weights(origin):
+    src = origin.url("/image")
+    one, three = total_pss(1, src), total_pss(3, src)
+
+    assert (three - one) / 2 < MAX_EXTRA_MB